@@ -16,15 +16,7 @@ def error_page(message, status=400):
 @app.route("/list", methods=["GET"])
 def get_list():
     try:
-        owners = database.get_owners()
-        print(owners)
-        pets = database.get_pets()
-        print(pets)
-        for pet in pets:   
-            pet["owner_name"] = "<Unknown>"
-            for owner in owners:
-                if owner["id"] == pet["owner_id"]:
-                    pet["owner_name"] = owner["name"]
+        pets = database.get_pets_with_owner()
         return render_template("list.html", pets=pets)
     except sqlite3.Error as e:
         return error_page(f"Database error while listing pets: {e}", 500)        
@@ -228,8 +220,7 @@ def post_owner_update(id):
 def health():
     # Quick check that the DB is reachable and FK enforcement is ON.
     try:
-        fk = database.connection.execute("PRAGMA foreign_keys").fetchone()[0]
-        if fk != 1:
+        if not database.foreign_keys_active():
             return error_page("Error: foreign key constraints are NOT active.", 500)
         return error_page("ok", 200)
     except Exception as e:
@@ -0,0 +1,116 @@
+"""
+Time the /list page's data access as the database grows.
+
+For each size a fresh database gets N pets and N/10 owners. Two ways of
+building the page's rows are timed:
+
+    nested   get_owners() + get_pets(), then a Python loop matching every
+             pet against every owner (what get_list used to do)
+    join     get_pets_with_owner(), one LEFT JOIN query
+
+    python3 benchmark.py --sizes 1000,2000,4000,8000
+
+"us/pet" staying flat as N doubles means the cost grows linearly; for the
+nested loop it doubles with N, because the owners grow with it too.
+
+--inserts N also times inserting N pets one create_pet() (and one commit)
+at a time against a single create_pets() call.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import database
+
+
+def nested_loop_listing():
+    owners = database.get_owners()
+    pets = database.get_pets()
+    for pet in pets:
+        pet["owner_name"] = "<Unknown>"
+        for owner in owners:
+            if owner["id"] == pet["owner_id"]:
+                pet["owner_name"] = owner["name"]
+    return pets
+
+
+LISTINGS = {
+    "nested": nested_loop_listing,
+    "join": database.get_pets_with_owner,
+}
+
+
+def seed(path, pets, owners):
+    database.setup_test_database(path)
+    owner_ids = database.create_owners(
+        {"name": f"owner{i}", "city": "Kent", "type_of_home": "house"} for i in range(owners)
+    )
+    database.create_pets(
+        {"name": f"pet{i}", "type": "dog", "age": i % 20, "owner_id": owner_ids[i % owners]}
+        for i in range(pets)
+    )
+    return owner_ids
+
+
+def insert_rates(path, inserts):
+    """Return rows/sec for create_pet() in a loop and for one create_pets()."""
+    owner_ids = seed(path, 0, 10)
+    rows = [
+        {"name": f"new{i}", "type": "cat", "age": 1, "owner_id": owner_ids[i % len(owner_ids)]}
+        for i in range(inserts)
+    ]
+    start = time.perf_counter()
+    for row in rows:
+        database.create_pet(dict(row))
+    one_by_one = inserts / (time.perf_counter() - start)
+    start = time.perf_counter()
+    database.create_pets(rows)
+    bulk = inserts / (time.perf_counter() - start)
+    return {"create_pet": one_by_one, "create_pets": bulk}
+
+
+def best_time(listing, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = listing()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the topic-05 pet listing.")
+    parser.add_argument("--sizes", default="1000,2000,4000,8000", help="comma separated pet counts")
+    parser.add_argument("--owners-per-pet", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--listings", default="nested,join")
+    parser.add_argument("--inserts", type=int, default=0, help="also time N inserts")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench_pets.db")
+        for pets in (int(size) for size in args.sizes.split(",")):
+            seed(path, pets, max(1, int(pets * args.owners_per_pet)))
+            for name in args.listings.split(","):
+                seconds, rows = best_time(LISTINGS[name], args.repeat)
+                results.append({"listing": name, "pets": rows, "seconds": seconds})
+                print(
+                    f"{name:7} {rows:>8} pets {seconds * 1000:10.2f} ms "
+                    f"{seconds / rows * 1e6:8.2f} us/pet"
+                )
+        if args.inserts:
+            rates = insert_rates(path, args.inserts)
+            results.append({"inserts": args.inserts, **rates})
+            for name, rate in rates.items():
+                print(f"{name:11} {args.inserts:>8} rows {rate:12.0f} rows/s")
+            print(f"create_pets is {rates['create_pets'] / rates['create_pet']:.0f}x faster")
+        database.close_connection()
+    return results
+
+
+if __name__ == "__main__":
+    main()
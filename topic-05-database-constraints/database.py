@@ -1,174 +1,466 @@
+import contextlib
 import sqlite3
 import os
+import pathlib
+import threading
 from pprint import pprint
 
-connection = None
-
-def initialize(database_file):
-    global connection
-
-    # Close any prior connection so PRAGMAs and file handles are clean.
-    if connection is not None:
+# Connections kept open for reuse once returned; extra ones are closed.
+POOL_SIZE = 8
+# How long a connection waits for another one's write lock before failing.
+BUSY_TIMEOUT_SECONDS = 5.0
+
+# (table, column) pairs that queries filter on, besides the foreign key
+# child columns ensure_indexes() finds by itself. Add to it when a new query
+# starts filtering on a column.
+FILTERED_COLUMNS = []
+
+pool = None
+# Read-only connections for the get_* functions, next to the writer pool.
+readers = None
+
+
+class ConnectionPool:
+    """
+    Hands each thread its own sqlite3 connection for the length of a call.
+
+    Every connection has foreign keys on, WAL journaling (readers never wait
+    for a writer, and a writer never waits for readers) and a busy timeout.
+    borrow() is re-entrant: a call made while the thread already holds a
+    connection reuses it, so nested calls share one transaction.
+
+    A read_only pool opens the file with mode=ro and query_only, so its
+    connections can never write. The database must already be in WAL mode.
+    """
+
+    def __init__(self, database_file, size=POOL_SIZE, read_only=False):
+        self.database_file = database_file
+        self.size = size
+        self.read_only = read_only
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.read_only:
+            uri = pathlib.Path(self.database_file).resolve().as_uri() + "?mode=ro"
+            connection = sqlite3.connect(
+                uri, uri=True, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA query_only = ON")
+            return connection
+
+        connection = sqlite3.connect(
+            self.database_file, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False
+        )
+        connection.row_factory = sqlite3.Row
+
+        # Enforce foreign keys (per-connection in SQLite).
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA journal_mode = WAL")
+
+        # Fail fast if constraints are not active.
+        fk = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+        assert fk == 1, "Foreign key constraints are not active on this connection."
+        return connection
+
+    def held(self):
+        """True while the calling thread has a connection borrowed."""
+        return getattr(self._local, "connection", None) is not None
+
+    @contextlib.contextmanager
+    def borrow(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            connection = self._connect()
+        self._local.connection = connection
         try:
+            yield connection
+        finally:
+            self._local.connection = None
+            self._give_back(connection)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.borrow() as connection:
+            if getattr(self._local, "in_transaction", False):
+                # Joins the enclosing transaction.
+                yield connection
+                return
+            # IMMEDIATE takes the write lock up front, so the transaction can
+            # never fail half way with "database is locked" on its first write.
+            connection.execute("BEGIN IMMEDIATE")
+            self._local.in_transaction = True
+            try:
+                yield connection
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                self._local.in_transaction = False
+
+    def commit(self, connection):
+        # Inside transaction() the commit waits for the end of the block.
+        if not getattr(self._local, "in_transaction", False):
+            connection.commit()
+
+    def _give_back(self, connection):
+        # A call that failed mid-write must not leave its transaction open.
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            if self._idle is not None and len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, None
+        for connection in idle or []:
             connection.close()
-        except Exception:
-            pass
-        connection = None
 
-    connection = sqlite3.connect(database_file, check_same_thread=False)
-    connection.row_factory = sqlite3.Row
 
-    # Enforce foreign keys (per-connection in SQLite).
-    connection.execute("PRAGMA foreign_keys = ON")
+def borrow_connection():
+    if pool is None:
+        raise RuntimeError("database is not initialized.")
+    return pool.borrow()
+
+
+def borrow_reader():
+    """
+    Borrow a read-only connection. Each query on it sees the last committed
+    state, even while another thread holds the write lock.
+
+    A thread that already holds a writer connection (inside transaction() or
+    a write) reads through that one instead, so it sees its own writes.
+    """
+    if readers is None:
+        raise RuntimeError("database is not initialized.")
+    if pool.held():
+        return pool.borrow()
+    return readers.borrow()
+
+
+def transaction():
+    """
+    Run the enclosed database calls as one transaction.
+
+    Commits when the block ends and rolls everything back if it raises.
+    Yields the connection; nested transaction() blocks join the outer one.
+    """
+    if pool is None:
+        raise RuntimeError("database is not initialized.")
+    return pool.transaction()
 
-    # Fail fast if constraints are not active.
-    fk = connection.execute("PRAGMA foreign_keys").fetchone()[0]
-    assert fk == 1, "Foreign key constraints are not active on this connection."
+
+def _commit(connection):
+    pool.commit(connection)
+
+
+def initialize(database_file):
+    global pool, readers
+
+    # Close any prior pool so PRAGMAs and file handles are clean.
+    close_connection()
+
+    pool = ConnectionPool(database_file)
+    with borrow_connection():
+        pass
+    # Opened after the writer has switched the file to WAL.
+    readers = ConnectionPool(database_file, read_only=True)
     print("succeeded in making connection.")
+    ensure_indexes()
 
 def close_connection():
-    global connection
-    if connection is not None:
+    global pool, readers
+    if readers is not None:
         try:
-            connection.close()
+            readers.close()
         finally:
-            connection = None
+            readers = None
+    if pool is not None:
+        try:
+            pool.close()
+        finally:
+            pool = None
+
+
+def _tables(connection):
+    rows = connection.execute(
+        "select name from sqlite_master where type = 'table' and name not like 'sqlite_%'"
+    )
+    return [row["name"] for row in rows]
+
+
+def _leading_index(connection, table, column):
+    # An index can serve lookups on its first column only.
+    for index in connection.execute(f"PRAGMA index_list({table})").fetchall():
+        first = connection.execute(f"PRAGMA index_info({index['name']})").fetchone()
+        if first is not None and first["name"] == column:
+            return index["name"]
+    return None
+
+
+def _lookup_plan(connection, table, column):
+    # sqlite3 caches prepared statements, and SQLite never re-prepares a
+    # cached EXPLAIN after the schema changes; the schema version in a
+    # comment gives every schema its own statement.
+    version = connection.execute("PRAGMA schema_version").fetchone()[0]
+    rows = connection.execute(
+        f"EXPLAIN QUERY PLAN select * from {table} where {column} = ? -- schema {version}", (0,)
+    ).fetchall()
+    return "; ".join(row["detail"] for row in rows)
+
+
+def ensure_indexes(columns=None, create=True):
+    """
+    Check that every foreign key child column, and every (table, column) in
+    `columns` (default FILTERED_COLUMNS), is the first column of an index.
+
+    Without an index on pet.owner_id, each delete_owner() makes SQLite scan
+    every pet to enforce "on delete restrict". Missing indexes are created
+    unless create=False. Returns one dict per column with its table, column,
+    index name (None if missing), whether it was just created, and the
+    EXPLAIN QUERY PLAN of an equality lookup on the column.
+    """
+    report = []
+    with borrow_connection() as connection:
+        wanted = []
+        for table in _tables(connection):
+            for key in connection.execute(f"PRAGMA foreign_key_list({table})"):
+                wanted.append((table, key["from"]))
+        wanted.extend(FILTERED_COLUMNS if columns is None else columns)
+
+        for table, column in dict.fromkeys(wanted):
+            index = _leading_index(connection, table, column)
+            created = False
+            if index is None and create:
+                index = f"{table}_{column}_idx"
+                connection.execute(f"create index if not exists {index} on {table}({column})")
+                created = True
+            plan = _lookup_plan(connection, table, column)
+            report.append(
+                {
+                    "table": table,
+                    "column": column,
+                    "index": index,
+                    "created": created,
+                    "plan": plan,
+                    "uses_index": "USING INDEX" in plan or "USING COVERING INDEX" in plan,
+                }
+            )
+        _commit(connection)
+
+    for entry in report:
+        if entry["created"]:
+            print(f"created index {entry['index']} on {entry['table']}({entry['column']})")
+        elif entry["index"] is None:
+            print(f"missing index on {entry['table']}({entry['column']}): {entry['plan']}")
+    return report
+
+
+def foreign_keys_active():
+    with borrow_connection() as connection:
+        return connection.execute("PRAGMA foreign_keys").fetchone()[0] == 1
 
 
 def get_owners():
-    cursor = connection.cursor()
-    cursor.execute("""select * from owner""")
-    owners = [dict(owner) for owner in cursor.fetchall()]
-    return owners
+    with borrow_reader() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""select * from owner""")
+        owners = [dict(owner) for owner in cursor.fetchall()]
+        return owners
 
 
 def get_owner(id):
     id = int(id)
-    cursor = connection.cursor()
-    cursor.execute("select * from owner where id = ?", (id,))
-    owners = [dict(row) for row in cursor.fetchall()]
-    if len(owners) == 0:
-        return None
-    assert len(owners) == 1
-    return owners[0]
+    with borrow_reader() as connection:
+        cursor = connection.cursor()
+        cursor.execute("select * from owner where id = ?", (id,))
+        owners = [dict(row) for row in cursor.fetchall()]
+        if len(owners) == 0:
+            return None
+        assert len(owners) == 1
+        return owners[0]
 
 def create_owner(data):
-    cursor = connection.cursor()
-    cursor.execute(
-        """insert into owner(name, city, type_of_home) values (?,?,?)""",
-        (data["name"], data.get("city"), data.get("type_of_home")),
-    )
-    connection.commit()
-    return cursor.lastrowid
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """insert into owner(name, city, type_of_home) values (?,?,?)""",
+            (data["name"], data.get("city"), data.get("type_of_home")),
+        )
+        _commit(connection)
+        return cursor.lastrowid
+
+def _insert_many(table, columns, rows):
+    # One executemany in one transaction. The write lock is held throughout,
+    # so the new ids are the consecutive run ending at last_insert_rowid().
+    with transaction() as connection:
+        placeholders = ",".join("?" for _ in columns)
+        connection.executemany(
+            f"""insert into {table}({", ".join(columns)}) values ({placeholders})""",
+            rows,
+        )
+        last_id = connection.execute("select last_insert_rowid()").fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def create_owners(rows):
+    # Returns the new ids in the order of rows.
+    rows = [(row["name"], row.get("city"), row.get("type_of_home")) for row in rows]
+    if not rows:
+        return []
+    return _insert_many("owner", ["name", "city", "type_of_home"], rows)
 
 def delete_owner(id):
     id = int(id)
-    cursor = connection.cursor()
-    cursor.execute("""delete from owner where id = ?""", (id,))
-    connection.commit()
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""delete from owner where id = ?""", (id,))
+        _commit(connection)
 
 def update_owner(id, data):
-    cursor = connection.cursor()
-    cursor.execute(
-        """update owner set name=?, city=?, type_of_home=? where id=?""",
-        (data["name"], data.get("city"), data.get("type_of_home"), id),
-    )
-    connection.commit()
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """update owner set name=?, city=?, type_of_home=? where id=?""",
+            (data["name"], data.get("city"), data.get("type_of_home"), id),
+        )
+        _commit(connection)
 
 
 def get_pets():
-    cursor = connection.cursor()
-    cursor.execute("""select * from pet""")
-    pets = cursor.fetchall()
-    pets = [dict(pet) for pet in pets]
-    return pets
+    with borrow_reader() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""select * from pet""")
+        pets = cursor.fetchall()
+        pets = [dict(pet) for pet in pets]
+        return pets
+
+def get_pets_with_owner():
+    # One LEFT JOIN instead of matching every pet against every owner in
+    # Python; a pet whose owner is missing still gets listed.
+    with borrow_reader() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            select pet.*, coalesce(owner.name, '<Unknown>') as owner_name
+            from pet left join owner on owner.id = pet.owner_id
+            order by pet.id
+            """
+        )
+        pets = [dict(pet) for pet in cursor.fetchall()]
+        return pets
 
 def get_pet(id):
     id = int(id)
-    cursor = connection.cursor()
-    cursor.execute("""select * from pet where id = ?""", (id,))
-    pets = cursor.fetchall()
-    pets = [dict(pet) for pet in pets]
-    assert len(pets) == 1
-    if len(pets) == 0:
-        return None
-    return pets[0]
-
-def create_pet(data):
+    with borrow_reader() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""select * from pet where id = ?""", (id,))
+        pets = cursor.fetchall()
+        pets = [dict(pet) for pet in pets]
+        assert len(pets) == 1
+        if len(pets) == 0:
+            return None
+        return pets[0]
+
+def _to_age(value):
     try:
-        data["age"] = int(data["age"])
+        return int(value)
     except:
-        data["age"] = 0
-    cursor = connection.cursor()
-    cursor.execute(
-        """insert into pet(name, age, type, owner_id) values (?,?,?,?)""",
-        (data["name"], data["age"], data["type"], data["owner_id"]),
-    )
-    connection.commit()
-    return cursor.lastrowid
+        return 0
+
+def create_pet(data):
+    data["age"] = _to_age(data.get("age"))
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """insert into pet(name, age, type, owner_id) values (?,?,?,?)""",
+            (data["name"], data["age"], data["type"], data["owner_id"]),
+        )
+        _commit(connection)
+        return cursor.lastrowid
+
+def create_pets(rows):
+    # Returns the new ids in the order of rows. If any row breaks a
+    # constraint (such as an unknown owner_id) none of them are inserted.
+    rows = [
+        (row["name"], _to_age(row.get("age")), row["type"], row["owner_id"]) for row in rows
+    ]
+    if not rows:
+        return []
+    return _insert_many("pet", ["name", "age", "type", "owner_id"], rows)
 
 def delete_pet(id):
     id = int(id)
-    cursor = connection.cursor()
-    cursor.execute(f"""delete from pet where id = ?""", (id,))
-    connection.commit()
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"""delete from pet where id = ?""", (id,))
+        _commit(connection)
 
 def update_pet(id, data):
-    try:
-        data["age"] = int(data["age"])
-    except:
-        data["age"] = 0
-    cursor = connection.cursor()
-    cursor.execute(
-        """update pet set name=?, age=?, type=?, owner_id=? where id=?""",
-        (data["name"], data["age"], data["type"], data["owner_id"], id),
-    )
-    connection.commit()
+    data["age"] = _to_age(data.get("age"))
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """update pet set name=?, age=?, type=?, owner_id=? where id=?""",
+            (data["name"], data["age"], data["type"], data["owner_id"], id),
+        )
+        _commit(connection)
 
 def setup_test_database(db_file="test_pets.db"):
     # Always start from a fresh file.
     close_connection()
-    try:
-        os.remove(db_file)
-    except FileNotFoundError:
-        pass
+    for path in [db_file, db_file + "-wal", db_file + "-shm"]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
     initialize(db_file)
 
-    cursor = connection.cursor()
-
-    cursor.execute(
-        """
-        create table owner (
-            id integer primary key autoincrement,
-            name text not null,
-            city text,
-            type_of_home text
+    with borrow_connection() as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(
+            """
+            create table owner (
+                id integer primary key autoincrement,
+                name text not null,
+                city text,
+                type_of_home text
+            )
+            """
         )
-        """
-    )
-    cursor.execute(
-        """
-        create table pet (
-            id integer primary key autoincrement,
-            name text not null,
-            type text not null,
-            age integer,
-            owner_id integer not null,
-            foreign key (owner_id) references owner(id) on delete restrict
+        cursor.execute(
+            """
+            create table pet (
+                id integer primary key autoincrement,
+                name text not null,
+                type text not null,
+                age integer,
+                owner_id integer not null,
+                foreign key (owner_id) references owner(id) on delete restrict
+            )
+            """
         )
-        """
-    )
-    connection.commit()
+        connection.commit()
+    ensure_indexes()
 
     owners = [
         {"name": "greg", "city": "Portland", "type_of_home": "condo"},
         {"name": "david", "city": "Seattle", "type_of_home": "farm"},
     ]
-    owner_ids = {}
-    for owner in owners:
-        owner_id = create_owner(owner)
-        owner_ids[owner["name"]] = owner_id
+    owner_ids = dict(zip([owner["name"] for owner in owners], create_owners(owners)))
 
     pets = [
         {"name": "dorothy", "type": "dog", "age": 9, "owner": "greg"},
@@ -178,21 +470,109 @@ def setup_test_database(db_file="test_pets.db"):
     ]
     for pet in pets:
         pet["owner_id"] = owner_ids[pet["owner"]]
-        create_pet(
-            {
-                "name": pet["name"],
-                "age": pet["age"],
-                "type": pet["type"],
-                "owner_id": pet["owner_id"],
-            }
-        )
+    create_pets(pets)
 
     assert len(get_pets()) == 4
     return owner_ids
 
 def test_constraints_are_active():
-    fk = connection.execute("PRAGMA foreign_keys").fetchone()[0]
-    assert fk == 1
+    assert foreign_keys_active()
+
+
+def test_foreign_key_columns_are_indexed():
+    [entry] = ensure_indexes()
+    assert (entry["table"], entry["column"], entry["created"]) == ("pet", "owner_id", False)
+    assert entry["uses_index"], entry["plan"]
+
+    with borrow_connection() as connection:
+        connection.execute(f"drop index {entry['index']}")
+    [missing] = ensure_indexes(create=False)
+    assert missing["index"] is None
+    assert not missing["uses_index"] and "SCAN" in missing["plan"]
+
+    report = ensure_indexes(columns=[("pet", "type")])
+    assert [(entry["column"], entry["created"]) for entry in report] == [
+        ("owner_id", True),
+        ("type", True),
+    ]
+    assert all(entry["uses_index"] for entry in report)
+    assert not any(entry["created"] for entry in ensure_indexes(columns=[("pet", "type")]))
+    with borrow_connection() as connection:
+        connection.execute("drop index pet_type_idx")
+
+
+def test_connections_are_per_thread():
+    with borrow_connection() as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("PRAGMA busy_timeout").fetchone()[0] == BUSY_TIMEOUT_SECONDS * 1000
+        # Nested calls reuse the thread's connection.
+        with borrow_connection() as again:
+            assert again is connection
+
+        seen = []
+
+        def other_thread():
+            with borrow_connection() as other:
+                seen.append(other)
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        # The other thread got its own connection and gave it back.
+        assert seen[0] is not connection
+        assert pool._idle == [seen[0]]
+
+
+def test_failed_write_does_not_leave_a_transaction_open():
+    try:
+        create_pet({"name": "ghost", "age": 1, "type": "dog", "owner_id": 999999})
+    except sqlite3.IntegrityError:
+        pass
+    with borrow_connection() as connection:
+        assert not connection.in_transaction
+
+
+def test_readers_are_read_only_and_see_committed_rows(owner_ids):
+    with borrow_reader() as reader:
+        assert reader.execute("PRAGMA query_only").fetchone()[0] == 1
+        try:
+            reader.execute("delete from pet")
+            assert False, "Expected a read-only error, but delete succeeded."
+        except sqlite3.OperationalError as e:
+            assert "readonly" in str(e).lower()
+
+    count = len(get_pets())
+    started, finish = threading.Event(), threading.Event()
+
+    def writer():
+        with borrow_connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "insert into pet(name, type, age, owner_id) values (?,?,?,?)",
+                ("pending", "dog", 1, owner_ids["greg"]),
+            )
+            started.set()
+            finish.wait()
+            connection.commit()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    started.wait()
+    try:
+        # The writer holds the lock with an uncommitted insert; reads go on
+        # from the committed snapshot without waiting for it.
+        assert len(get_pets()) == count
+        assert "pending" not in [pet["name"] for pet in get_pets_with_owner()]
+    finally:
+        finish.set()
+        thread.join()
+    [pending] = [pet for pet in get_pets() if pet["name"] == "pending"]
+
+    with transaction():
+        # Inside a transaction reads see its own uncommitted writes.
+        delete_pet(pending["id"])
+        assert len(get_pets()) == count
+    assert len(get_pets()) == count
 
 
 def test_get_pets():
@@ -205,6 +585,16 @@ def test_get_pets():
     assert type(pets[0]["name"]) is str
 
 
+def test_get_pets_with_owner(owner_ids):
+    pets = get_pets_with_owner()
+    assert len(pets) == len(get_pets())
+    names = {pet["name"]: pet["owner_name"] for pet in pets}
+    assert names["dorothy"] == "greg"
+    assert names["heidi"] == "david"
+    for key in ["name", "age", "type", "owner_id", "id", "owner_name"]:
+        assert key in pets[0]
+
+
 def test_create_pet_and_get_pet(owner_ids):
     new_id = create_pet(
         {"name": "walter", "age": "2", "type": "mouse", "owner_id": owner_ids["greg"]}
@@ -217,6 +607,63 @@ def test_create_pet_and_get_pet(owner_ids):
     assert pet["owner_id"] == owner_ids["greg"]
 
 
+def test_create_owners_and_pets(owner_ids):
+    new_owner_ids = create_owners(
+        [{"name": "ann", "city": "Akron"}, {"name": "bob", "type_of_home": "boat"}]
+    )
+    assert [get_owner(id)["name"] for id in new_owner_ids] == ["ann", "bob"]
+    pet_ids = create_pets(
+        [
+            {"name": "rex", "age": "4", "type": "dog", "owner_id": new_owner_ids[0]},
+            {"name": "fin", "age": "?", "type": "fish", "owner_id": new_owner_ids[1]},
+        ]
+    )
+    assert [get_pet(id)["name"] for id in pet_ids] == ["rex", "fin"]
+    assert get_pet(pet_ids[1])["age"] == 0
+    assert create_pets([]) == []
+
+    for id in pet_ids:
+        delete_pet(id)
+    for id in new_owner_ids:
+        delete_owner(id)
+
+
+def test_create_pets_rolls_back_on_bad_owner(owner_ids):
+    count = len(get_pets())
+    try:
+        create_pets(
+            [
+                {"name": "fine", "age": 1, "type": "dog", "owner_id": owner_ids["greg"]},
+                {"name": "ghost", "age": 1, "type": "dog", "owner_id": 999999},
+            ]
+        )
+        assert False, "Expected FOREIGN KEY constraint failure, but insert succeeded."
+    except sqlite3.IntegrityError:
+        pass
+    assert len(get_pets()) == count
+    with borrow_connection() as connection:
+        assert not connection.in_transaction
+
+
+def test_transaction_commits_or_rolls_back(owner_ids):
+    try:
+        with transaction():
+            owner_id = create_owner({"name": "temp"})
+            create_pet({"name": "tmp", "age": 1, "type": "cat", "owner_id": owner_id})
+            raise RuntimeError("undo")
+    except RuntimeError:
+        pass
+    assert get_owner(owner_id) is None
+
+    with transaction():
+        owner_id = create_owner({"name": "kept"})
+        # Nested writes join the open transaction instead of committing it.
+        pet_ids = create_pets([{"name": "k", "age": 1, "type": "cat", "owner_id": owner_id}])
+    assert get_pet(pet_ids[0])["owner_id"] == owner_id
+    delete_pet(pet_ids[0])
+    delete_owner(owner_id)
+
+
 def test_fk_rejects_bad_owner_id():
     try:
         create_pet({"name": "ghost", "age": 1, "type": "dog", "owner_id": 999999})
@@ -317,8 +764,16 @@ if __name__ == "__main__":
 
     # Run tests in a simple way without pytest, but still pytest-compatible.
     test_constraints_are_active()
+    test_foreign_key_columns_are_indexed()
+    test_connections_are_per_thread()
+    test_failed_write_does_not_leave_a_transaction_open()
+    test_readers_are_read_only_and_see_committed_rows(owner_ids)
     test_get_pets()
+    test_get_pets_with_owner(owner_ids)
     test_create_pet_and_get_pet(owner_ids)
+    test_create_owners_and_pets(owner_ids)
+    test_create_pets_rolls_back_on_bad_owner(owner_ids)
+    test_transaction_commits_or_rolls_back(owner_ids)
     test_fk_rejects_bad_owner_id()
     test_delete_owner_restricted(owner_ids)
     test_delete_pet_then_delete_owner_succeeds(owner_ids)
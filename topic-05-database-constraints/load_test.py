@@ -0,0 +1,112 @@
+"""
+Multi-threaded read load while a write transaction is open.
+
+A fresh database is seeded, then one writer thread opens a write
+transaction (BEGIN IMMEDIATE), keeps inserting pets and does not commit
+until every step has run. Meanwhile 1, 2, 4, ... reader threads call
+get_pets_with_owner() for a few seconds each, and the page reads per
+second are reported next to the same run before the writer started.
+
+    python3 load_test.py --pets 2000 --threads 1,2,4,8 --seconds 2
+
+Each reader borrows its own read-only WAL connection, so reads keep going
+(and only ever see committed rows) while the write is in progress. sqlite3
+releases the GIL while a query runs, so on a multi-core machine throughput
+can grow with threads; on one core it should at least stay flat.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import benchmark
+import database
+
+
+def hold_write(started, stop, inserted):
+    with database.borrow_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        owner_id = connection.execute("select min(id) from owner").fetchone()[0]
+        started.set()
+        while not stop.is_set():
+            connection.execute(
+                "insert into pet(name, type, age, owner_id) values (?,?,?,?)",
+                ("uncommitted", "dog", 1, owner_id),
+            )
+            inserted[0] += 1
+            time.sleep(0.001)
+        connection.commit()
+
+
+def read_for(seconds, threads, expected_pets):
+    reads = [0] * threads
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def reader(index):
+        try:
+            while time.perf_counter() < deadline:
+                pets = database.get_pets_with_owner()
+                if len(pets) != expected_pets:
+                    raise AssertionError(f"saw {len(pets)} pets, expected {expected_pets}")
+                reads[index] += 1
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=reader, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return sum(reads) / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read load test for the topic-05 data layer.")
+    parser.add_argument("--pets", type=int, default=2000)
+    parser.add_argument("--threads", default="1,2,4,8", help="comma separated reader counts")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark.seed(os.path.join(directory, "load_pets.db"), args.pets, max(1, args.pets // 10))
+        expected_pets = len(database.get_pets())
+        thread_counts = [int(count) for count in args.threads.split(",")]
+        idle = {threads: read_for(args.seconds, threads, expected_pets) for threads in thread_counts}
+
+        started, stop, inserted = threading.Event(), threading.Event(), [0]
+        writer = threading.Thread(target=hold_write, args=(started, stop, inserted))
+        writer.start()
+        started.wait()
+        try:
+            for threads in thread_counts:
+                reads_per_second = read_for(args.seconds, threads, expected_pets)
+                results.append(
+                    {
+                        "threads": threads,
+                        "idle_reads_per_second": idle[threads],
+                        "reads_per_second": reads_per_second,
+                    }
+                )
+                print(
+                    f"{threads:3} readers {idle[threads]:10.1f} pages/s idle "
+                    f"{reads_per_second:10.1f} pages/s during the write "
+                    f"(writer has {inserted[0]} uncommitted inserts)"
+                )
+        finally:
+            stop.set()
+            writer.join()
+        print(f"writer committed {inserted[0]} inserts; {len(database.get_pets())} pets now")
+        database.close_connection()
+    return results
+
+
+if __name__ == "__main__":
+    main()
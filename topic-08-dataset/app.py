@@ -4,6 +4,10 @@ import dataset
 # Connect to the SQLite database using dataset
 db = dataset.connect('sqlite:///pets.db')
 
+# delete_kind looks up pets by kind_id, so make sure that column is indexed
+if db['pets'].exists:
+    db['pets'].create_index(['kind_id'])
+
 app = Flask(__name__)
 
 # List of pets, showing related kind information
@@ -16,6 +16,9 @@ CREATE TABLE pets (
         ON UPDATE CASCADE
 );
 
+-- delete_kind looks up pets by kind_id before deleting a kind
+CREATE INDEX pets_kind_id_idx ON pets(kind_id);
+
 INSERT INTO kind (kind_name, food, noise) 
 VALUES ('Dog', 'Dog food', 'Bark');
 
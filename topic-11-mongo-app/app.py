@@ -1,12 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for
+import json
+
+from flask import Blueprint, Flask, Response, jsonify, render_template, request, redirect, url_for
+from mongita import MongitaClientDisk
 import database
 
 # remember to $ pip install flask
 # remember to $ pip install mongita
 
-database.setup_database("pets")
+pages = Blueprint("pages", __name__)
+
+# The owner dropdowns in create.html and update.html only show these.
+OWNER_CHOICE_FIELDS = ["id", "name"]
 
-app = Flask(__name__)
+# Query arguments accepted by /api/pets and /api/owners.
+PET_FILTER_ARGS = ["type", "owner_id", "min_age", "max_age"]
+OWNER_FILTER_ARGS = ["name", "city", "type_of_home"]
 
 
 def error_page(message, status=400):
@@ -14,36 +22,49 @@ def error_page(message, status=400):
     return message, status, {"Content-Type": "text/plain; charset=utf-8"}
 
 
-@app.route("/", methods=["GET"])
-@app.route("/list", methods=["GET"])
+@pages.route("/", methods=["GET"])
+@pages.route("/list", methods=["GET"])
 def get_list():
-    pets = database.get_pets()
-    return render_template("list.html", pets=pets)
+    try:
+        pets, next_after, prev_before = database.get_pets_with_owners(
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            limit=request.args.get("limit"),
+        )
+    except ValueError as e:
+        return error_page(f"Error: {e}", 400)
+    return render_template(
+        "list.html",
+        pets=pets,
+        next_after=next_after,
+        prev_before=prev_before,
+        limit=request.args.get("limit") or database.DEFAULT_PAGE_SIZE,
+    )
 
 
-@app.route("/create", methods=["GET"])
+@pages.route("/create", methods=["GET"])
 def get_create():
-    owners = database.get_owners()
+    owners = database.get_owners(fields=OWNER_CHOICE_FIELDS)
     return render_template("create.html", owners=owners)
 
 
-@app.route("/create", methods=["POST"])
+@pages.route("/create", methods=["POST"])
 def post_create():
     data = dict(request.form)
     try:
         database.create_pet(data)
-        return redirect(url_for("get_list"))
+        return redirect(url_for(".get_list"))
     except (ValueError, database.ConstraintError) as e:
         return error_page(f"Error: {e}", 400)
     except Exception as e:
         return error_page(f"Unexpected error creating pet: {e}", 500)
 
 
-@app.route("/delete/<id>", methods=["GET"])
+@pages.route("/delete/<id>", methods=["GET"])
 def get_delete(id):
     try:
         database.delete_pet(id)
-        return redirect(url_for("get_list"))
+        return redirect(url_for(".get_list"))
     except ValueError as e:
         return error_page(f"Error: {e}", 400)
     except database.NotFoundError as e:
@@ -52,13 +73,13 @@ def get_delete(id):
         return error_page(f"Unexpected error deleting pet: {e}", 500)
 
 
-@app.route("/update/<id>", methods=["GET"])
+@pages.route("/update/<id>", methods=["GET"])
 def get_update(id):
     try:
         data = database.get_pet(id)
         if data is None:
             return error_page("Error: pet not found.", 404)
-        owners = database.get_owners()
+        owners = database.get_owners(fields=OWNER_CHOICE_FIELDS)
         return render_template("update.html", data=data, owners=owners)
     except ValueError as e:
         return error_page(f"Error: {e}", 400)
@@ -66,12 +87,12 @@ def get_update(id):
         return error_page(f"Unexpected error loading pet: {e}", 500)
 
 
-@app.route("/update/<id>", methods=["POST"])
+@pages.route("/update/<id>", methods=["POST"])
 def post_update(id):
     data = dict(request.form)
     try:
         database.update_pet(id, data)
-        return redirect(url_for("get_list"))
+        return redirect(url_for(".get_list"))
     except (ValueError, database.ConstraintError) as e:
         return error_page(f"Error: {e}", 400)
     except database.NotFoundError as e:
@@ -80,34 +101,47 @@ def post_update(id):
         return error_page(f"Unexpected error updating pet: {e}", 500)
 
 
-@app.route("/owners", methods=["GET"])
+@pages.route("/owners", methods=["GET"])
 def get_owners_list():
-    owners = database.get_owners()
-    return render_template("owner_list.html", owners=owners)
+    try:
+        owners, next_after, prev_before = database.get_owners_page(
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            limit=request.args.get("limit"),
+        )
+    except ValueError as e:
+        return error_page(f"Error: {e}", 400)
+    return render_template(
+        "owner_list.html",
+        owners=owners,
+        next_after=next_after,
+        prev_before=prev_before,
+        limit=request.args.get("limit") or database.DEFAULT_PAGE_SIZE,
+    )
 
 
-@app.route("/owner/create", methods=["GET"])
+@pages.route("/owner/create", methods=["GET"])
 def get_owner_create():
     return render_template("owner_create.html")
 
 
-@app.route("/owner/create", methods=["POST"])
+@pages.route("/owner/create", methods=["POST"])
 def post_owner_create():
     data = dict(request.form)
     try:
         database.create_owner(data)
-        return redirect(url_for("get_owners_list"))
+        return redirect(url_for(".get_owners_list"))
     except ValueError as e:
         return error_page(f"Error: {e}", 400)
     except Exception as e:
         return error_page(f"Unexpected error creating owner: {e}", 500)
 
 
-@app.route("/owner/delete/<id>", methods=["GET"])
+@pages.route("/owner/delete/<id>", methods=["GET"])
 def get_owner_delete(id):
     try:
         database.delete_owner(id)
-        return redirect(url_for("get_owners_list"))
+        return redirect(url_for(".get_owners_list"))
     except ValueError as e:
         return error_page(f"Error: {e}", 400)
     except database.NotFoundError as e:
@@ -118,7 +152,7 @@ def get_owner_delete(id):
         return error_page(f"Unexpected error deleting owner: {e}", 500)
 
 
-@app.route("/owner/update/<id>", methods=["GET"])
+@pages.route("/owner/update/<id>", methods=["GET"])
 def get_owner_update(id):
     try:
         data = database.get_owner(id)
@@ -131,12 +165,12 @@ def get_owner_update(id):
         return error_page(f"Unexpected error loading owner: {e}", 500)
 
 
-@app.route("/owner/update/<id>", methods=["POST"])
+@pages.route("/owner/update/<id>", methods=["POST"])
 def post_owner_update(id):
     data = dict(request.form)
     try:
         database.update_owner(id, data)
-        return redirect(url_for("get_owners_list"))
+        return redirect(url_for(".get_owners_list"))
     except ValueError as e:
         return error_page(f"Error: {e}", 400)
     except database.NotFoundError as e:
@@ -145,11 +179,112 @@ def post_owner_update(id):
         return error_page(f"Unexpected error updating owner: {e}", 500)
 
 
-@app.route("/health", methods=["GET"])
+@pages.route("/health", methods=["GET"])
 def health():
     try:
-        database.get_pets()
-        database.get_owners()
+        database.ping()
         return error_page("ok", 200)
     except Exception as e:
         return error_page(f"Error checking health: {e}", 500)
+
+
+@pages.route("/stats", methods=["GET"])
+def stats():
+    try:
+        return jsonify(database.get_stats())
+    except Exception as e:
+        return error_page(f"Unexpected error reading stats: {e}", 500)
+
+
+@pages.route("/stats/id-filters", methods=["GET"])
+def id_filter_stats():
+    try:
+        return jsonify(database.get_id_filter_stats())
+    except Exception as e:
+        return error_page(f"Unexpected error reading id filter stats: {e}", 500)
+
+
+@pages.route("/ready", methods=["GET"])
+def ready():
+    try:
+        counts = database.get_counts()
+        return jsonify({"status": "ready", **counts})
+    except Exception as e:
+        return error_page(f"Error checking readiness: {e}", 503)
+
+
+@pages.route("/search", methods=["GET"])
+def search():
+    try:
+        results = database.search(request.args.get("q", ""), limit=request.args.get("limit"))
+        return jsonify(results)
+    except ValueError as e:
+        return error_page(f"Error: {e}", 400)
+    except Exception as e:
+        return error_page(f"Unexpected error searching: {e}", 500)
+
+
+@pages.route("/api/changes", methods=["GET"])
+def api_changes():
+    try:
+        changes = database.changes_since(
+            request.args.get("since"), limit=request.args.get("limit")
+        )
+        return jsonify({"changes": changes, "position": database.oplog_position()})
+    except database.OplogTruncatedError as e:
+        return error_page(f"Error: {e}", 410)
+    except ValueError as e:
+        return error_page(f"Error: {e}", 400)
+    except Exception as e:
+        return error_page(f"Unexpected error reading changes: {e}", 500)
+
+
+def ndjson_response(collection_name, documents):
+    # The revision is read before the stream starts, so a write that lands
+    # mid-stream changes the next ETag and the client fetches again.
+    etag = database.get_revision(collection_name)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        lines = (json.dumps(document) + "\n" for document in documents)
+        response = Response(lines, mimetype="application/x-ndjson")
+    response.set_etag(etag)
+    return response
+
+
+@pages.route("/api/pets", methods=["GET"])
+def api_pets():
+    try:
+        filter = database.pet_filter(**{arg: request.args.get(arg) for arg in PET_FILTER_ARGS})
+        return ndjson_response("pets", database.iter_pets(filter))
+    except ValueError as e:
+        return error_page(f"Error: {e}", 400)
+    except Exception as e:
+        return error_page(f"Unexpected error listing pets: {e}", 500)
+
+
+@pages.route("/api/owners", methods=["GET"])
+def api_owners():
+    try:
+        filter = database.owner_filter(**{arg: request.args.get(arg) for arg in OWNER_FILTER_ARGS})
+        return ndjson_response("owners", database.iter_owners(filter))
+    except Exception as e:
+        return error_page(f"Unexpected error listing owners: {e}", 500)
+
+
+def create_app(database_name="pets", client_factory=MongitaClientDisk):
+    """
+    Build the Flask app.
+
+    Importing this module and calling create_app() never open the database;
+    the first request that reads or writes does (see database.configure()).
+    `flask --app app run` finds this factory.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(pages)
+    database.configure(database_name, client_factory=client_factory)
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run()
@@ -0,0 +1,66 @@
+"""
+Compare create_pet throughput on MongitaClientDisk with and without write
+batching.
+
+    python3 bench_write_batching.py --pets 2000 --threads 8
+"""
+
+import argparse
+import functools
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mongita import MongitaClientDisk
+
+import database
+
+
+def run(pets, durability=None, threads=1):
+    """Insert `pets` pets one create_pet() call at a time and return ops/sec."""
+    with tempfile.TemporaryDirectory() as path:
+        database.setup_database(
+            "bench", client_factory=functools.partial(MongitaClientDisk, path)
+        )
+        owner_ids, _ = database.create_owners([{"name": f"owner{i}"} for i in range(10)])
+        if durability is not None:
+            database.enable_write_batching(durability=durability)
+
+        def create(i):
+            database.create_pet(
+                {"name": f"pet{i}", "type": "cat", "age": i % 20, "owner_id": owner_ids[i % 10]}
+            )
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(create, range(pets)))
+        database.flush()
+        elapsed = time.perf_counter() - start
+
+        if durability is not None:
+            database.disable_write_batching()
+        assert database.get_counts()["pets"] == pets
+        database.close_connection()
+    return pets / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pets", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    for threads in sorted({1, args.threads}):
+        print(f"{threads} writer thread(s), {args.pets} pets:")
+        unbatched = run(args.pets, threads=threads)
+        print(f"  unbatched:              {unbatched:10.0f} ops/sec")
+        for durability in database.WRITE_BATCH_DURABILITY:
+            batched = run(args.pets, durability, threads)
+            print(
+                f"  batched ({durability + '):':14}  {batched:10.0f} ops/sec"
+                f"  ({batched / unbatched:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
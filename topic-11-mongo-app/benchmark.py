@@ -0,0 +1,216 @@
+"""
+Latency benchmark for the data layer in database.py.
+
+For every backend and size, a fresh database is seeded with N owners and M
+pets and each operation is timed call by call. The report has p50/p95/p99
+latency, throughput and the process's peak RSS per operation. Each
+backend/size pair runs in its own process so the RSS numbers don't mix.
+
+    python3 benchmark.py --sizes 1000,100000 --output results.json
+    python3 benchmark.py --sizes 1000 --baseline results.json
+
+--baseline compares the new run with an earlier JSON report.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from mongita import MongitaClientDisk, MongitaClientMemory
+
+import database
+from sqlite_store import SQLiteClient
+
+BACKENDS = ["memory", "disk", "sqlite"]
+
+OPERATIONS = ["create_pet", "get_pet", "get_pets", "update_pet", "delete_owner"]
+
+
+def _client_factory(backend, path):
+    if backend == "memory":
+        return MongitaClientMemory
+    if backend == "disk":
+        return functools.partial(MongitaClientDisk, path)
+    if backend == "sqlite":
+        return functools.partial(SQLiteClient, os.path.join(path, "bench.db"))
+    raise ValueError(f"unknown backend {backend!r}")
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _seed(owners, pets):
+    owner_ids, _ = database.create_owners(
+        {"name": f"owner{i}", "city": "Kent", "type_of_home": "house"} for i in range(owners)
+    )
+    pet_ids, _ = database.create_pets(
+        {
+            "name": f"pet{i}",
+            "type": ("dog", "cat", "fish")[i % 3],
+            "age": i % 20,
+            "owner_id": owner_ids[i % owners],
+        }
+        for i in range(pets)
+    )
+    return owner_ids, pet_ids
+
+
+def _time_calls(call, arguments):
+    latencies = []
+    started = time.perf_counter()
+    for argument in arguments:
+        start = time.perf_counter()
+        call(argument)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else None,
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+def run_case(backend, owners, pets, iterations, scan_iterations, seed=0):
+    """Seed one database and return a result row per operation."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as path:
+        database.setup_database("benchmark", client_factory=_client_factory(backend, path))
+        try:
+            seed_start = time.perf_counter()
+            owner_ids, pet_ids = _seed(owners, pets)
+            seed_seconds = time.perf_counter() - seed_start
+
+            measured = {}
+            measured["create_pet"] = _time_calls(
+                lambda i: database.create_pet(
+                    {"name": f"new{i}", "type": "cat", "age": 1, "owner_id": rng.choice(owner_ids)}
+                ),
+                range(iterations),
+            )
+            sample = [rng.choice(pet_ids) for _ in range(iterations)]
+            measured["get_pet"] = _time_calls(database.get_pet, sample)
+            measured["get_pets"] = _time_calls(lambda _: database.get_pets(), range(scan_iterations))
+            measured["update_pet"] = _time_calls(
+                lambda id: database.update_pet(
+                    id, {"name": "updated", "type": "dog", "age": 2, "owner_id": rng.choice(owner_ids)}
+                ),
+                sample,
+            )
+            # Only owners without pets can be deleted, so make some first.
+            empty_owners, _ = database.create_owners({"name": f"empty{i}"} for i in range(iterations))
+            measured["delete_owner"] = _time_calls(database.delete_owner, empty_owners)
+        finally:
+            database.close_connection()
+
+    return [
+        {
+            "backend": backend,
+            "owners": owners,
+            "pets": pets,
+            "operation": operation,
+            "seed_seconds": seed_seconds,
+            **measured[operation],
+        }
+        for operation in OPERATIONS
+    ]
+
+
+def _run_case_in_child(arguments, queue):
+    queue.put(run_case(*arguments))
+
+
+def run_isolated(*arguments):
+    """Run run_case() in a fresh process so peak RSS belongs to this case."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_case_in_child, args=(arguments, queue))
+    process.start()
+    rows = queue.get()
+    process.join()
+    return rows
+
+
+def compare(results, baseline):
+    """Yield a line per result that also appears in the baseline report."""
+    previous = {
+        (row["backend"], row["pets"], row["operation"]): row for row in baseline["results"]
+    }
+    for row in results:
+        old = previous.get((row["backend"], row["pets"], row["operation"]))
+        if old is None:
+            continue
+        p50_change = (row["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0.0
+        yield (
+            f"{row['backend']:7} {row['pets']:>9} {row['operation']:13} "
+            f"p50 {old['p50_ms']:9.3f} -> {row['p50_ms']:9.3f} ms ({p50_change:+6.1f}%)"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the topic-11 data layer.")
+    parser.add_argument("--sizes", default="1000", help="comma separated pet counts")
+    parser.add_argument("--owners-per-pet", type=float, default=0.1)
+    parser.add_argument("--backends", default="memory,disk")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--scan-iterations", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for backend in args.backends.split(","):
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend!r}; choose from {', '.join(BACKENDS)}")
+        for pets in (int(size) for size in args.sizes.split(",")):
+            owners = max(1, int(pets * args.owners_per_pet))
+            rows = run_isolated(backend, owners, pets, args.iterations, args.scan_iterations)
+            for row in rows:
+                print(
+                    f"{backend:7} {pets:>9} {row['operation']:13} "
+                    f"p50 {row['p50_ms']:9.3f} p95 {row['p95_ms']:9.3f} p99 {row['p99_ms']:9.3f} ms "
+                    f"{row['ops_per_sec']:10.1f} ops/s  rss {row['peak_rss_kb']} KB"
+                )
+            results.extend(rows)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"compared with {args.baseline}:")
+        for line in compare(results, baseline):
+            print(line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
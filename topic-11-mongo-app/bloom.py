@@ -0,0 +1,69 @@
+"""
+A Bloom filter of string keys, used by database.py to skip lookups of _ids
+that cannot exist.
+
+A Bloom filter answers "definitely not present" or "maybe present". Keys are
+hashed to `hashes` positions in a bit array; a key is maybe present when all
+of its bits are set. There are no false negatives, and the false-positive
+rate depends on how full the bit array is. Keys cannot be removed, so a
+filter over a collection that sees deletes has to be rebuilt now and then.
+"""
+
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Size the filter so that `capacity` keys give about `error_rate`
+        false positives.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1.")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._set_bits = 0
+        self._count = 0
+
+    def __len__(self):
+        """Number of add() calls, counting repeated keys."""
+        return self._count
+
+    def _positions(self, key):
+        # Double hashing: the two 32-bit halves of the key's 64-bit hash give
+        # every position. str hashes are salted per process, which is fine
+        # for a filter that never leaves it.
+        hashed = hash(key) & 0xFFFFFFFFFFFFFFFF
+        size = self.size
+        position = (hashed & 0xFFFFFFFF) % size
+        step = (hashed >> 32) % size or 1
+        for _ in range(self.hashes):
+            yield position
+            position += step
+            if position >= size:
+                position -= size
+
+    def add(self, key):
+        bits = self._bits
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                self._set_bits += 1
+        self._count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def false_positive_rate(self):
+        """Estimate the current false-positive rate from the bits set."""
+        return (self._set_bits / self.size) ** self.hashes
@@ -1,3 +1,14 @@
+import argparse
+import bisect
+import functools
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from itertools import groupby, islice
+
 from bson.objectid import ObjectId
 from mongita import MongitaClientDisk
 
@@ -6,15 +17,237 @@ try:
 except ImportError:  # pragma: no cover - some mongita installs may omit this helper
     MongitaClientMemory = None
 
-try:
-    import pytest
-except ImportError:  # pragma: no cover - only needed when running the tests
-    pytest = None
+from bloom import BloomFilter
+from sqlite_store import SQLiteClient, SQLiteClientMemory
+from text_index import InvertedIndex
 
 client = None
 db = None
+# (database_name, client_factory) saved by configure() until first use.
+_deferred_setup = None
 owners_collection = None
 pets_collection = None
+stats_collection = None
+oplog_collection = None
+
+# Serializes read-modify-write updates of the counters in stats_collection.
+_counter_lock = threading.Lock()
+
+# Owner ids known to exist, oldest first, so that creating or updating a pet
+# rarely has to query owners. create_owner(s) and successful lookups add to
+# it; delete_owner(), lookups that miss and close_connection() remove from
+# it. _known_owners_revision is the owners revision it is valid at, kept
+# current by this process's writes like the _id filters: when it moves,
+# another process wrote owners and the cache is dropped.
+OWNER_CACHE_SIZE = 10000
+_known_owners = {}
+_known_owners_revision = None
+
+# Bloom filters of the pet and owner _ids, keyed by collection name (see
+# _IdFilter). Each is built by the first lookup that needs it, so opening a
+# database never lists its ids; lookups of an id a filter rules out never
+# reach the client. A filter that has missed writes by another process is
+# rebuilt by the read that notices, under _id_filter_lock, since reads only
+# hold the read lock.
+_id_filters = {}
+_id_filter_lock = threading.Lock()
+
+# The search index and the revisions it reflects (see search()). Searches
+# only hold the read lock, so they share _search_lock to build the index.
+_search_index = None
+_search_revisions = None
+_search_lock = threading.Lock()
+
+
+class _ReadWriteLock:
+    """
+    Many readers or one writer, with waiting writers served first.
+
+    The thread holding the write side may re-enter either side, so
+    setup_database() can call initialize(), which calls close_connection().
+    A thread that already reads may read again without queueing behind a
+    waiting writer.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._readers = 0
+        self._waiting_writers = 0
+        self._writer = None
+        self._depth = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        held = getattr(self._local, "reads", 0)
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return
+            if not held:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+            self._readers += 1
+        self._local.reads = held + 1
+
+    def release_read(self):
+        with self._condition:
+            if self._writer == threading.get_ident():
+                self._depth -= 1
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+        self._local.reads -= 1
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._depth -= 1
+            if self._depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    def held(self):
+        """Return True if the calling thread holds either side."""
+        return self._writer == threading.get_ident() or getattr(self._local, "reads", 0) > 0
+
+
+# Guards the client globals. Reads share it; writes, initialize() and
+# close_connection() take it exclusively, so no request ever sees a
+# half-swapped client and Mongita never indexes while another thread reads.
+_client_lock = _ReadWriteLock()
+
+
+def _reset_locks_after_fork():
+    # A lock held by another thread at fork time would never be released in
+    # the child, so each forked worker starts with fresh locks.
+    global _client_lock, _counter_lock, _search_lock, _id_filter_lock
+    _client_lock = _ReadWriteLock()
+    _counter_lock = threading.Lock()
+    _search_lock = threading.Lock()
+    _id_filter_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def _reads(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _setup_if_deferred()
+        lock = _client_lock
+        # Queued writes are flushed first so reads always see them.
+        if _write_batch is not None and _write_batch.pending() and not lock.held():
+            flush()
+        lock.acquire_read()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            lock.release_read()
+
+    return wrapper
+
+
+def _exclusive(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        lock = _client_lock
+        batch = _write_batch
+        if batch is not None:
+            batch.writer_started()
+        try:
+            lock.acquire_write()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                lock.release_write()
+            if batch is not None and not lock.held():
+                batch.wait_until_durable()
+            return result
+        finally:
+            if batch is not None:
+                batch.writer_finished()
+
+    return wrapper
+
+
+def _writes(function):
+    exclusive = _exclusive(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _setup_if_deferred()
+        return exclusive(*args, **kwargs)
+
+    return wrapper
+
+
+def _setup_if_deferred():
+    # A thread holding the lock is already inside a data layer call.
+    if _deferred_setup is not None and client is None and not _client_lock.held():
+        _run_deferred_setup()
+
+# Secondary indexes that setup_database() makes sure exist on the pets
+# collection. Mongita keeps them current on every insert/update/delete.
+PET_INDEXES = ["owner_id"]
+
+# Rows normalized, validated and written per insert_many by the bulk API.
+BULK_CHUNK_SIZE = 1000
+
+# Page sizes accepted by get_pets_page() and get_owners_page().
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Defaults for enable_write_batching().
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_DELAY = 0.05
+WRITE_BATCH_DURABILITY = ("batched", "group_commit")
+
+# Bumped whenever the set of maintained counters changes; setup_database()
+# rebuilds the stats collection when the stored version differs.
+STATS_VERSION = 5
+
+# Documents read per lock acquisition by iter_pets() and iter_owners().
+STREAM_CHUNK_SIZE = 500
+
+# The oplog keeps at least OPLOG_RETENTION entries; writes compact it once
+# it has grown OPLOG_COMPACT_EVERY entries past that.
+OPLOG_RETENTION = 10000
+OPLOG_COMPACT_EVERY = 1000
+
+# Collections written by dump() and read back by restore(), in that order.
+DUMP_COLLECTIONS = ["owners", "pets", "stats", "oplog"]
+RESTORE_CHUNK_SIZE = 10000
+# Dumps favour speed over size; level 1 is several times faster than 9.
+DUMP_COMPRESSLEVEL = 1
+
+# Indexed fields and their weights for search().
+PET_SEARCH_FIELDS = {"name": 3, "type": 1}
+OWNER_SEARCH_FIELDS = {"name": 3, "city": 1}
+
+# The _id filters hold ID_FILTER_HEADROOM times the documents present when
+# they are built (at least ID_FILTER_MIN_CAPACITY) at ID_FILTER_ERROR_RATE.
+# A deleted _id stays in its filter, so a filter is rebuilt once the deletes
+# since it was built reach ID_FILTER_REBUILD_FRACTION of its capacity, or
+# once inserts fill it.
+ID_FILTER_ERROR_RATE = 0.01
+ID_FILTER_HEADROOM = 2
+ID_FILTER_MIN_CAPACITY = 1024
+ID_FILTER_REBUILD_FRACTION = 0.25
 
 
 class NotFoundError(LookupError):
@@ -25,12 +258,21 @@ class ConstraintError(ValueError):
     pass
 
 
+class OplogTruncatedError(LookupError):
+    """The requested oplog position has already been compacted away."""
+
+
+@_exclusive
 def initialize(database_name="pets", client_factory=MongitaClientDisk):
-    global client, db, owners_collection, pets_collection
+    """
+    Open a client and bind the module's collections.
+
+    client_factory is called with no arguments. MongitaClientDisk,
+    MongitaClientMemory, SQLiteClient and SQLiteClientMemory all work.
+    """
+    global client, db, owners_collection, pets_collection, stats_collection, oplog_collection
 
     if client_factory is MongitaClientMemory and MongitaClientMemory is None:
-        if pytest is not None:
-            pytest.skip("MongitaClientMemory is not available in this environment.")
         raise RuntimeError("MongitaClientMemory is not available in this environment.")
 
     close_connection()
@@ -39,43 +281,82 @@ def initialize(database_name="pets", client_factory=MongitaClientDisk):
     db = client[database_name]
     owners_collection = db.owners
     pets_collection = db.pets
+    stats_collection = db["stats"]
+    oplog_collection = db["oplog"]
 
 
-def test_initialize_sets_globals():
-    initialize("pytest_initialize", client_factory=MongitaClientMemory)
-    assert client is not None
-    assert db is not None
-    assert owners_collection is not None
-    assert pets_collection is not None
-    close_connection()
-
-
+@_exclusive
 def setup_database(database_name="pets", client_factory=MongitaClientDisk):
     """
     Prepare the Mongo database and ensure the collections exist.
 
     Mongita creates collections lazily when they are accessed, so touching the
     collection attributes here is enough to initialize a fresh database.
+    Any secondary index that is missing (new database, or one created before
+    the index existed) is rebuilt from the current documents, and so are the
+    counters used by get_counts() and get_stats(). Otherwise only the index
+    metadata and the counters document are read, whatever the size of the
+    database; the _id filters and the search index are built on first use.
     """
 
     initialize(database_name, client_factory=client_factory)
-    owners_collection.count_documents({})
-    pets_collection.count_documents({})
+    _ensure_indexes()
+    _ensure_counters()
 
 
-def test_setup_database_creates_collections():
-    setup_database("pytest_setup", client_factory=MongitaClientMemory)
-    assert owners_collection is not None
-    assert pets_collection is not None
-    assert owners_collection.count_documents({}) == 0
-    assert pets_collection.count_documents({}) == 0
+@_exclusive
+def configure(database_name="pets", client_factory=MongitaClientDisk):
+    """
+    Defer setup_database() until the data layer is first used.
+
+    Any open client is closed. The first read or write then opens the
+    database, so importing and configuring never touch storage.
+    close_connection() cancels a setup that has not run yet.
+    """
+    global _deferred_setup
+
     close_connection()
+    _deferred_setup = (database_name, client_factory)
+
 
+@_exclusive
+def _run_deferred_setup():
+    global _deferred_setup
+
+    # Another thread may have run it while this one waited for the lock.
+    if _deferred_setup is None or client is not None:
+        return
+    database_name, client_factory = _deferred_setup
+    try:
+        setup_database(database_name, client_factory=client_factory)
+    except BaseException:
+        # initialize() cleared it; let the next call try again.
+        _deferred_setup = (database_name, client_factory)
+        raise
 
+
+def _index_names(collection):
+    names = set()
+    for info in collection.index_information():
+        names.update(info.keys())
+    return names
+
+
+def _ensure_indexes():
+    existing = _index_names(pets_collection)
+    for key in PET_INDEXES:
+        if f"{key}_1" not in existing:
+            pets_collection.create_index(key)
+
+
+@_exclusive
 def close_connection():
-    global client, db, owners_collection, pets_collection
+    global client, db, owners_collection, pets_collection, stats_collection, oplog_collection
+    global _search_index, _search_revisions, _deferred_setup, _known_owners_revision
 
+    _deferred_setup = None
     if client is not None:
+        _flush_batch()
         try:
             client.close()
         except Exception:
@@ -84,15 +365,753 @@ def close_connection():
     db = None
     owners_collection = None
     pets_collection = None
+    stats_collection = None
+    oplog_collection = None
+    _known_owners.clear()
+    _known_owners_revision = None
+    _id_filters.clear()
+    _search_index = None
+    _search_revisions = None
 
 
-def test_close_connection_resets_globals():
-    initialize("pytest_close", client_factory=MongitaClientMemory)
-    close_connection()
-    assert client is None
-    assert db is None
-    assert owners_collection is None
-    assert pets_collection is None
+@_reads
+def ping():
+    """
+    Check that the client is open without reading any documents.
+
+    Raises RuntimeError when the module has not been initialized.
+    """
+    if client is None:
+        raise RuntimeError("database is not initialized.")
+    client.list_database_names()
+    return True
+
+
+# The counters live in a single {"_id": "counters", "counts": {key: n}}
+# document in the stats collection, so a write function reads and replaces
+# one document however many counters it changes. find_one and replace_one on
+# an _id are direct lookups in Mongita and never scan a collection.
+# Besides the "owners" and "pets" totals there is one counter per pet type,
+# removed when it drops to zero. The pets per owner are each owner's
+# pet_count field, which is what delete_owner() checks; counter deltas keyed
+# OWNER_COUNTER_PREFIX + owner id are applied to that field.
+COUNTERS_ID = "counters"
+TYPE_COUNTER_PREFIX = "pets.type:"
+OWNER_COUNTER_PREFIX = "pets.owner:"
+
+# Revision counters are bumped by every write to their collection and, with
+# the random "epoch" chosen whenever the counters are rebuilt, make up the
+# tokens returned by get_revision(). A pet write that changes an owner's
+# pet_count bumps the owners revision too, since owner_to_dict() shows it.
+# They are not derived from the documents, so _rebuild_counters() leaves
+# them out of its drift report.
+PETS_REVISION = "pets.revision"
+OWNERS_REVISION = "owners.revision"
+
+# The last oplog sequence number handed out and the last one compacted
+# away. Unlike the other counters these survive _rebuild_counters(), since
+# consumers hold on to sequence numbers.
+OPLOG_SEQ = "oplog.seq"
+OPLOG_TRUNCATED = "oplog.truncated"
+_KEPT_COUNTERS = (OPLOG_SEQ, OPLOG_TRUNCATED)
+_UNCOUNTED_COUNTERS = ("version", "epoch", PETS_REVISION, OWNERS_REVISION) + _KEPT_COUNTERS
+
+
+def _read_counters():
+    document = stats_collection.find_one({"_id": COUNTERS_ID})
+    return {} if document is None else document["counts"]
+
+
+def _get_counter(key):
+    return _read_counters().get(key)
+
+
+def _write_counter_deltas(deltas, oplog_entries=()):
+    """
+    Add deltas to the stored counters and pet_counts, and insert oplog_entries.
+
+    Every pet_count that changes is logged after oplog_entries as an owners
+    update. The caller holds _counter_lock.
+    """
+    counts = _read_counters()
+    entries = list(oplog_entries)
+    for key, amount in deltas.items():
+        if amount == 0 or key.startswith(OWNER_COUNTER_PREFIX):
+            continue
+        counts[key] = counts.get(key, 0) + amount
+        if counts[key] == 0 and key.startswith(TYPE_COUNTER_PREFIX):
+            del counts[key]
+    for key, amount in deltas.items():
+        if amount == 0 or not key.startswith(OWNER_COUNTER_PREFIX):
+            continue
+        owner_id = ObjectId(key[len(OWNER_COUNTER_PREFIX):])
+        pet_count = _add_to_pet_count(owner_id, amount)
+        if pet_count is not None:
+            counts[OPLOG_SEQ] = counts.get(OPLOG_SEQ, 0) + 1
+            fields = {"pet_count": pet_count}
+            entries.append(_oplog_entry(counts[OPLOG_SEQ], "owners", "update", owner_id, fields))
+    if entries:
+        oplog_collection.insert_many(entries)
+    if entries or any(deltas.values()):
+        stats_collection.replace_one({"_id": COUNTERS_ID}, {"counts": counts}, upsert=True)
+
+
+def _add_to_pet_count(owner_id, amount):
+    """Add amount to an owner's pet_count; returns the new count, or None if the owner is gone."""
+    # find_one + replace_one stay direct _id lookups; update_one would scan.
+    owner = owners_collection.find_one({"_id": owner_id})
+    if owner is None:
+        return None
+    owner["pet_count"] = owner.get("pet_count", 0) + amount
+    owners_collection.replace_one({"_id": owner_id}, owner)
+    return owner["pet_count"]
+
+
+def _set_pet_count(owner_id, count):
+    owner = owners_collection.find_one({"_id": owner_id})
+    if owner is not None and owner.get("pet_count") != count:
+        owner["pet_count"] = count
+        owners_collection.replace_one({"_id": owner_id}, owner)
+
+
+def _apply_counter_deltas(deltas, oplog_entries=()):
+    if _write_batch is not None:
+        for key, amount in deltas.items():
+            if amount:
+                _write_batch.add_to_counter(key, amount)
+        if oplog_entries:
+            _write_batch.add_oplog_entries(oplog_entries)
+        return
+    with _counter_lock:
+        _write_counter_deltas(deltas, oplog_entries)
+
+
+def _increment_counter(key, amount=1):
+    _apply_counter_deltas({key: amount})
+
+
+def _add_pet_to_counters(deltas, pet, amount):
+    for key in (
+        "pets",
+        TYPE_COUNTER_PREFIX + pet["type"],
+        OWNER_COUNTER_PREFIX + str(pet["owner_id"]),
+    ):
+        deltas[key] = deltas.get(key, 0) + amount
+    return deltas
+
+
+def _count_from_collections():
+    """Return the counters as the collections have them, pets per owner included."""
+    counts = {"owners": owners_collection.count_documents({}), "pets": 0}
+    for pet in pets_collection.find():
+        _add_pet_to_counters(counts, pet, 1)
+    return counts
+
+
+def _rebuild_counters():
+    """Recount everything and return {key: (stored, actual)} for each drift."""
+    actual = _count_from_collections()
+    pet_counts = {
+        ObjectId(key[len(OWNER_COUNTER_PREFIX):]): actual.pop(key)
+        for key in list(actual)
+        if key.startswith(OWNER_COUNTER_PREFIX)
+    }
+    counts = _read_counters()
+    stored = {key: count for key, count in counts.items() if key not in _UNCOUNTED_COUNTERS}
+    drift = {
+        key: (stored.get(key), actual.get(key, 0))
+        for key in set(stored) | set(actual)
+        if stored.get(key) != actual.get(key, 0)
+    }
+
+    kept = {key: counts.get(key) for key in _KEPT_COUNTERS}
+    for key in _KEPT_COUNTERS:
+        # Before STATS_VERSION 5 every counter was its own {"_id": key} document.
+        if kept[key] is None:
+            kept[key] = (stats_collection.find_one({"_id": key}) or {}).get("count")
+    counts = {key: count for key, count in actual.items() if count}
+    counts.update({key: count for key, count in kept.items() if count is not None})
+    counts["version"] = STATS_VERSION
+    counts["epoch"] = random.getrandbits(32)
+    stats_collection.delete_many({})
+    stats_collection.insert_one({"_id": COUNTERS_ID, "counts": counts})
+    # Repaired after the new counters exist, since the repairs are logged.
+    for owner_id, owner_drift in _compare_pet_counts(pet_counts, repair=True).items():
+        drift[OWNER_COUNTER_PREFIX + owner_id] = owner_drift
+    return drift
+
+
+def _compare_pet_counts(actual, repair):
+    drift = {}
+    deltas = {}
+    for owner in owners_collection.find():
+        stored = owner.get("pet_count")
+        count = actual.get(owner["_id"], 0)
+        if stored == count:
+            continue
+        drift[str(owner["_id"])] = (stored, count)
+        if count == (stored or 0):
+            # Only the field is missing; there is no change to log.
+            if repair:
+                _set_pet_count(owner["_id"], count)
+        else:
+            deltas[OWNER_COUNTER_PREFIX + str(owner["_id"])] = count - (stored or 0)
+    if repair and deltas:
+        deltas[OWNERS_REVISION] = 1
+        _write_counter_deltas(deltas)
+    return drift
+
+
+def _check_pet_counts(repair):
+    actual = {}
+    for pet in pets_collection.find():
+        actual[pet["owner_id"]] = actual.get(pet["owner_id"], 0) + 1
+    return _compare_pet_counts(actual, repair)
+
+
+def _ensure_counters():
+    with _counter_lock:
+        if _get_counter("version") != STATS_VERSION:
+            _rebuild_counters()
+
+
+@_reads
+def get_counts():
+    """Return the number of owners and pets from the maintained counters."""
+    counts = _read_counters()
+    return {"owners": counts.get("owners", 0), "pets": counts.get("pets", 0)}
+
+
+@_reads
+def get_stats():
+    """
+    Return the totals plus pets per type and pets per owner.
+
+    The totals and types come from the counters document and the pets per
+    owner from each owner's pet_count, so the cost depends on the number of
+    owners, never on the number of pets.
+    """
+    counts = _read_counters()
+    stats = {
+        "owners": counts.get("owners", 0),
+        "pets": counts.get("pets", 0),
+        "pets_by_type": {
+            key[len(TYPE_COUNTER_PREFIX):]: count
+            for key, count in counts.items()
+            if key.startswith(TYPE_COUNTER_PREFIX)
+        },
+        "pets_by_owner": {},
+    }
+    for owner in owners_collection.find():
+        if owner.get("pet_count"):
+            stats["pets_by_owner"][str(owner["_id"])] = owner["pet_count"]
+    return stats
+
+
+@_reads
+def get_revision(collection_name):
+    """
+    Return a token that changes whenever a collection is written.
+
+    `collection_name` is "pets" or "owners". The token is read from the
+    counters document, so it is cheap enough to compute on every request;
+    the API routes use it as their ETag.
+    """
+    if collection_name not in ("pets", "owners"):
+        raise ValueError(f"unknown collection {collection_name!r}.")
+    counts = _read_counters()
+    return f"{counts.get('epoch', 0):x}-{counts.get(f'{collection_name}.revision', 0)}"
+
+
+@_writes
+def check_pet_counts(repair=True):
+    """
+    Compare every owner's pet_count with the pets that reference it.
+
+    Returns {owner_id: (stored, actual)} for each owner that was wrong, and
+    fixes those owners unless repair=False. Run it after a crash that may
+    have interrupted a write between the pet and its owner.
+    """
+    _flush_batch()
+    with _counter_lock:
+        return _check_pet_counts(repair)
+
+
+@_writes
+def rebuild_stats():
+    """
+    Recompute every counter from the collections.
+
+    Returns {key: (stored, actual)} for each counter that had drifted; an
+    empty dict means the maintained counters were correct.
+    """
+    _flush_batch()
+    with _counter_lock:
+        return _rebuild_counters()
+
+
+# search() answers from an in-memory InvertedIndex over pet name/type and
+# owner name/city. It is built from the collections on first use and the
+# write functions below keep it current. The index remembers the revision
+# counters it reflects; when they show a write it did not see (another
+# process, or a rebuild_stats()), the next search rebuilds it.
+def _search_revisions_now():
+    counts = _read_counters()
+    return {
+        "epoch": counts.get("epoch"),
+        "pets": counts.get(PETS_REVISION, 0),
+        "owners": counts.get(OWNERS_REVISION, 0),
+    }
+
+
+def _search_texts(document, fields):
+    return [(document.get(field), weight) for field, weight in fields.items()]
+
+
+def _build_search_index():
+    global _search_index, _search_revisions, _known_owners_revision
+
+    index = InvertedIndex()
+    for pet in pets_collection.find():
+        index.add(("pets", str(pet["_id"])), _search_texts(pet, PET_SEARCH_FIELDS))
+    for owner in owners_collection.find():
+        index.add(("owners", str(owner["_id"])), _search_texts(owner, OWNER_SEARCH_FIELDS))
+    _search_index = index
+    _search_revisions = _search_revisions_now()
+
+
+def _update_search(collection_name, changes):
+    """
+    Apply one write function's changes to the search index.
+
+    `changes` is [(object_id, document or None to remove), ...].
+    """
+    if _search_index is None:
+        return
+    fields = PET_SEARCH_FIELDS if collection_name == "pets" else OWNER_SEARCH_FIELDS
+    with _search_lock:
+        for object_id, document in changes:
+            key = (collection_name, str(object_id))
+            if document is None:
+                _search_index.remove(key)
+            else:
+                _search_index.add(key, _search_texts(document, fields))
+
+
+@_reads
+def search(query, limit=None):
+    """
+    Return the pets and owners that match every word of `query`, best first.
+
+    Words match as prefixes of indexed words, and name matches outrank the
+    other fields. Each result is a pet_to_dict() or owner_to_dict() dict
+    plus "kind" ("pet" or "owner") and "score". `limit` is checked like a
+    page size.
+    """
+    limit = _normalize_limit(limit)
+    with _search_lock:
+        if _search_index is None or _search_revisions != _search_revisions_now():
+            _build_search_index()
+        hits = _search_index.search(query, limit)
+
+    results = []
+    for (collection_name, id), score in hits:
+        if collection_name == "pets":
+            pet = pets_collection.find_one({"_id": ObjectId(id)})
+            if pet is not None:
+                results.append({"kind": "pet", "score": score, **pet_to_dict(pet)})
+        else:
+            owner = owners_collection.find_one({"_id": ObjectId(id)})
+            if owner is not None:
+                results.append({"kind": "owner", "score": score, **owner_to_dict(owner)})
+    return results
+
+
+@_writes
+def rebuild_search_index():
+    """Rebuild the search index from the collections; returns its size."""
+    _flush_batch()
+    with _search_lock:
+        _build_search_index()
+        return len(_search_index)
+
+
+# Every create/update/delete appends one entry per document to the oplog
+# collection: {"_id": zero-padded seq, "seq", "op", "collection", "id",
+# "fields"}. Inserts carry the new document, updates the fields they set and
+# deletes no fields. A pet write that changes an owner's pet_count is
+# followed by an owners update carrying the new pet_count, so consumers
+# never have to recount. Sequence numbers are contiguous, so changes_since()
+# fetches entries one _id at a time instead of scanning the log. They are
+# handed out from the counters already read for the write (or held by the
+# write batch) and stored with the other counters.
+def _oplog_id(seq):
+    return f"{seq:012d}"
+
+
+def _oplog_entry(seq, collection_name, op, object_id, document):
+    entry = {"_id": _oplog_id(seq), "seq": seq, "op": op, "collection": collection_name}
+    entry["id"] = str(object_id)
+    if document is not None:
+        entry["fields"] = {key: value for key, value in document.items() if key != "_id"}
+    return entry
+
+
+def _pending_counters():
+    # The stored counters plus any increments still queued in a write batch.
+    if _write_batch is not None:
+        return _write_batch.pending_counters()
+    return _read_counters()
+
+
+def _pending_counter(key):
+    return _pending_counters().get(key, 0)
+
+
+def _log_changes(collection_name, op, changes, counts, deltas):
+    """Return the oplog entries for changes, numbered after counts[OPLOG_SEQ]."""
+    first_seq = counts.get(OPLOG_SEQ, 0) + 1
+    entries = [
+        _oplog_entry(seq, collection_name, op, object_id, document)
+        for seq, (object_id, document) in enumerate(changes, start=first_seq)
+    ]
+    deltas[OPLOG_SEQ] = deltas.get(OPLOG_SEQ, 0) + len(entries)
+    return entries
+
+
+def _compact_oplog(keep):
+    truncated = _pending_counter(OPLOG_TRUNCATED)
+    new_truncated = max(truncated, _pending_counter(OPLOG_SEQ) - keep)
+    for seq in range(truncated + 1, new_truncated + 1):
+        _delete(oplog_collection, {"_id": _oplog_id(seq)})
+    _increment_counter(OPLOG_TRUNCATED, new_truncated - truncated)
+    return new_truncated - truncated
+
+
+def _advance_revisions(collection_name):
+    global _known_owners_revision
+    # The search index, the _id filters and the owner cache each remember
+    # the revisions they reflect. Writes made here keep them current, so advance those too and
+    # leave a mismatch to mean another process wrote the collection.
+    if _search_index is not None:
+        with _search_lock:
+            _search_revisions[collection_name] += 1
+    id_filter = _id_filters.get(collection_name)
+    if id_filter is not None:
+        epoch, revision = id_filter.revision
+        id_filter.revision = (epoch, revision + 1)
+    if collection_name == "owners" and _known_owners_revision is not None:
+        epoch, revision = _known_owners_revision
+        _known_owners_revision = (epoch, revision + 1)
+
+
+def _record_changes(collection_name, op, changes, deltas=None):
+    """
+    Finish one write function: count, log and index its changes.
+
+    `deltas` holds the write's counter changes (see _add_pet_to_counters());
+    the revisions and oplog sequence are added to them, and they are all
+    written with a single read and replace of the counters document.
+    """
+    deltas = dict(deltas or {})
+    deltas[f"{collection_name}.revision"] = 1
+    _advance_revisions(collection_name)
+    if any(key.startswith(OWNER_COUNTER_PREFIX) and amount for key, amount in deltas.items()):
+        deltas[OWNERS_REVISION] = deltas.get(OWNERS_REVISION, 0) + 1
+        _advance_revisions("owners")
+    counts = _pending_counters()
+    entries = _log_changes(collection_name, op, changes, counts, deltas)
+    _apply_counter_deltas(deltas, entries)
+    last_seq = counts.get(OPLOG_SEQ, 0) + len(entries)
+    if last_seq - counts.get(OPLOG_TRUNCATED, 0) > OPLOG_RETENTION + OPLOG_COMPACT_EVERY:
+        _compact_oplog(OPLOG_RETENTION)
+    _update_search(collection_name, changes)
+    _update_id_filter(collection_name, op, changes)
+
+
+def _entry_to_dict(entry):
+    change = {key: entry[key] for key in ("seq", "op", "collection", "id")}
+    if "fields" in entry:
+        change["fields"] = {
+            key: str(value) if isinstance(value, ObjectId) else value
+            for key, value in entry["fields"].items()
+        }
+    return change
+
+
+@_reads
+def oplog_position():
+    """Return the sequence number of the newest oplog entry (0 if none)."""
+    return _get_counter(OPLOG_SEQ) or 0
+
+
+@_reads
+def changes_since(seq, limit=None):
+    """
+    Return up to `limit` oplog entries after sequence number `seq`, oldest first.
+
+    A consumer stores the last "seq" it applied and passes it back to catch
+    up. Start from oplog_position() taken before a full read of the
+    collections. Raises OplogTruncatedError when entries after `seq` have
+    been compacted away; the consumer then has to resync from scratch.
+    `limit` is checked like a page size.
+    """
+    seq = _optional_int(seq, "seq") or 0
+    limit = _normalize_limit(limit)
+    if seq < (_get_counter(OPLOG_TRUNCATED) or 0):
+        raise OplogTruncatedError(f"oplog entries after {seq} have been compacted.")
+    last = min(_get_counter(OPLOG_SEQ) or 0, seq + limit)
+    changes = []
+    for next_seq in range(seq + 1, last + 1):
+        entry = oplog_collection.find_one({"_id": _oplog_id(next_seq)})
+        if entry is not None:
+            changes.append(_entry_to_dict(entry))
+    return changes
+
+
+@_writes
+def compact_oplog(keep=OPLOG_RETENTION):
+    """Drop all but the newest `keep` oplog entries; returns how many went."""
+    _flush_batch()
+    return _compact_oplog(keep)
+
+
+# Opt-in write batching (group commit). While enabled, inserts, updates,
+# deletes and counter changes are queued and applied together: consecutive
+# inserts into a collection become one insert_many, and each counter is
+# written once per batch. A batch is flushed when it reaches max_batch
+# operations, when max_delay seconds have passed since its first write, on
+# flush(), before any read through this module, before a write that has to
+# read a collection with queued changes, and on close_connection().
+_write_batch = None
+
+
+class _WriteBatch:
+    def __init__(self, max_batch, max_delay, durability):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durability = durability
+        self.operations = []
+        self.counter_deltas = {}
+        self.oplog_entries = []
+        # The stored counters, read once per batch by pending_counters().
+        self.stored_counters = None
+        self.timer = None
+        self.generation = 0
+        self.flushed_generation = -1
+        self.flushing = False
+        self.active_writers = 0
+        self.waiting_writers = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    def pending(self):
+        return bool(self.operations or self.counter_deltas or self.oplog_entries)
+
+    def touches(self, collections):
+        # Queued pet_count deltas are changes to owner documents too.
+        if owners_collection in collections and any(
+            key.startswith(OWNER_COUNTER_PREFIX) for key in self.counter_deltas
+        ):
+            return True
+        return any(operation[0] in collections for operation in self.operations)
+
+    def _queued(self):
+        self.local.ticket = self.generation
+        if self.timer is None:
+            self.timer = threading.Timer(self.max_delay, flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def add(self, collection, kind, argument):
+        self.operations.append((collection, kind, argument))
+        self._queued()
+        if len(self.operations) >= self.max_batch:
+            _flush_batch()
+
+    def add_to_counter(self, key, amount):
+        self.counter_deltas[key] = self.counter_deltas.get(key, 0) + amount
+        self._queued()
+
+    def pending_counters(self):
+        if self.stored_counters is None:
+            self.stored_counters = _read_counters()
+        counts = dict(self.stored_counters)
+        for key, amount in self.counter_deltas.items():
+            counts[key] = counts.get(key, 0) + amount
+        return counts
+
+    def add_oplog_entries(self, entries):
+        # Kept apart from operations so they neither split runs of inserts
+        # nor count towards max_batch.
+        self.oplog_entries.extend(entries)
+        self._queued()
+
+    def take(self):
+        """
+        Detach the queued work.
+
+        Returns (operations, counter_deltas, oplog_entries, generation).
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        taken = (self.operations, self.counter_deltas, self.oplog_entries, self.generation)
+        self.operations = []
+        self.counter_deltas = {}
+        self.oplog_entries = []
+        self.stored_counters = None
+        self.generation += 1
+        return taken
+
+    def mark_flushed(self, generation):
+        with self.condition:
+            self.flushed_generation = generation
+            self.condition.notify_all()
+
+    def writer_started(self):
+        with self.condition:
+            self.active_writers += 1
+
+    def writer_finished(self):
+        with self.condition:
+            self.active_writers -= 1
+            self.condition.notify_all()
+
+    def _writers_still_queueing(self):
+        # Writers that are running but not yet waiting for a flush.
+        return self.active_writers - self.waiting_writers > 0
+
+    def wait_until_durable(self):
+        """
+        In group_commit mode, block until this thread's last write is flushed.
+
+        The first waiting writer becomes the leader. While other writers are
+        still running it gives them up to max_delay to queue their writes,
+        then flushes once for all of them.
+        """
+        ticket = getattr(self.local, "ticket", None)
+        self.local.ticket = None
+        if self.durability != "group_commit" or ticket is None:
+            return
+        with self.condition:
+            self.waiting_writers += 1
+            self.condition.notify_all()
+        try:
+            while True:
+                with self.condition:
+                    if self.flushed_generation >= ticket:
+                        return
+                    if self.flushing:
+                        self.condition.wait(self.max_delay)
+                        continue
+                    self.flushing = True
+                    deadline = time.monotonic() + self.max_delay
+                    while self._writers_still_queueing() and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+                try:
+                    flush()
+                finally:
+                    with self.condition:
+                        self.flushing = False
+                        self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.waiting_writers -= 1
+
+
+def _flush_batch():
+    """Apply the queued writes. The caller holds the write lock."""
+    batch = _write_batch
+    if batch is None or not batch.pending():
+        return
+    operations, counter_deltas, oplog_entries, generation = batch.take()
+    try:
+        # Before the operations, which may include compaction deletes.
+        if oplog_entries:
+            oplog_collection.insert_many(oplog_entries)
+        for (collection, kind), group in groupby(operations, key=lambda op: op[:2]):
+            arguments = [argument for _, _, argument in group]
+            if kind == "insert":
+                collection.insert_many(arguments)
+            elif kind == "replace":
+                for document in arguments:
+                    collection.replace_one({"_id": document["_id"]}, document)
+            else:
+                for filter in arguments:
+                    collection.delete_one(filter)
+        with _counter_lock:
+            _write_counter_deltas(counter_deltas)
+    finally:
+        batch.mark_flushed(generation)
+
+
+def _barrier(*collections):
+    """Flush before a write reads a collection that has queued changes."""
+    if _write_batch is not None and _write_batch.touches(collections):
+        _flush_batch()
+
+
+def _insert(collection, document):
+    if _write_batch is None:
+        return collection.insert_one(document).inserted_id
+    document["_id"] = ObjectId()
+    _write_batch.add(collection, "insert", document)
+    return document["_id"]
+
+
+# _replace and _delete return the matched/deleted count, or None when the
+# write was queued and its outcome is not known yet. A count of 0 means
+# another process deleted the document after the write function looked it
+# up: the write functions then raise NotFoundError without recording any
+# changes, since that process has already counted the delete.
+def _replace(collection, document):
+    # Unlike update_one, replace_one on an _id is a direct lookup in Mongita.
+    if _write_batch is None:
+        return collection.replace_one({"_id": document["_id"]}, document).matched_count
+    _write_batch.add(collection, "replace", document)
+
+
+def _delete(collection, filter):
+    if _write_batch is None:
+        return collection.delete_one(filter).deleted_count
+    _write_batch.add(collection, "delete", filter)
+
+
+@_writes
+def enable_write_batching(
+    max_batch=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY, durability="batched"
+):
+    """
+    Queue writes and apply them in batches.
+
+    durability="batched" acknowledges a write as soon as it is queued, so a
+    crash can lose up to max_batch writes or max_delay seconds of work.
+    durability="group_commit" makes each write call wait until the batch
+    holding it has been applied; concurrent writers share one flush.
+    """
+    global _write_batch
+
+    if durability not in WRITE_BATCH_DURABILITY:
+        raise ValueError(f"durability must be one of {', '.join(WRITE_BATCH_DURABILITY)}.")
+    if max_batch < 1 or max_delay <= 0:
+        raise ValueError("max_batch and max_delay must be positive.")
+    _flush_batch()
+    _write_batch = _WriteBatch(max_batch, max_delay, durability)
+
+
+@_writes
+def disable_write_batching():
+    global _write_batch
+
+    _flush_batch()
+    _write_batch = None
+
+
+@_writes
+def flush():
+    """Apply any queued writes now."""
+    _flush_batch()
 
 
 def _normalize_age(value):
@@ -102,8 +1121,13 @@ def _normalize_age(value):
         return 0
 
 
+def _text(value):
+    # Form posts send strings, but bulk rows may hold numbers or ObjectIds.
+    return "" if value is None else str(value).strip()
+
+
 def _require_text(value, field_name):
-    text = (value or "").strip()
+    text = _text(value)
     if text == "":
         raise ValueError(f"{field_name} is required.")
     return text
@@ -116,17 +1140,210 @@ def _to_object_id(value, field_name="id"):
         raise ValueError(f"{field_name} must be a valid ObjectId string.") from exc
 
 
+def _check_known_owners():
+    """Drop the owner cache if another process has written owners since it was checked."""
+    global _known_owners_revision
+    revision = _id_filter_revision("owners")
+    if revision != _known_owners_revision:
+        _known_owners.clear()
+        _known_owners_revision = revision
+
+
+def _remember_owner(object_id):
+    _known_owners[object_id] = True
+    if len(_known_owners) > OWNER_CACHE_SIZE:
+        del _known_owners[next(iter(_known_owners))]
+
+
+class _IdFilter:
+    """
+    A BloomFilter of one collection's _ids, with counts of how it did.
+
+    checks counts lookups, rejected the ones it answered without the client
+    and false_positives the ones it let through for an id that was missing.
+    Reads update the counts without a lock, so they are approximate.
+    revision is the (epoch, collection revision) the ids were read at.
+
+    sorted_ids holds the same ids as hex strings in _id order, which
+    _seek_page() bisects. Unlike the Bloom filter it drops deleted ids.
+    """
+
+    def __init__(self, ids, count, revision):
+        self.revision = revision
+        capacity = max(ID_FILTER_MIN_CAPACITY, ID_FILTER_HEADROOM * count)
+        self.bloom = BloomFilter(capacity, ID_FILTER_ERROR_RATE)
+        self.sorted_ids = sorted(str(id) for id in ids)
+        for id in self.sorted_ids:
+            self.bloom.add(id)
+        self.deletes = 0
+        self.checks = 0
+        self.rejected = 0
+        self.false_positives = 0
+
+    def may_contain(self, object_id):
+        self.checks += 1
+        if str(object_id) in self.bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, object_id):
+        key = str(object_id)
+        self.bloom.add(key)
+        ids = self.sorted_ids
+        if not ids or ids[-1] < key:
+            ids.append(key)  # New ObjectIds usually sort last.
+            return
+        position = bisect.bisect_left(ids, key)
+        if position == len(ids) or ids[position] != key:
+            ids.insert(position, key)
+
+    def discard(self, object_id):
+        key = str(object_id)
+        ids = self.sorted_ids
+        position = bisect.bisect_left(ids, key)
+        if position < len(ids) and ids[position] == key:
+            del ids[position]
+        self.deletes += 1
+
+    def needs_rebuild(self):
+        capacity = self.bloom.capacity
+        return len(self.bloom) > capacity or self.deletes >= ID_FILTER_REBUILD_FRACTION * capacity
+
+    def stats(self):
+        missing = self.rejected + self.false_positives
+        return {
+            "ids": len(self.bloom),
+            "capacity": self.bloom.capacity,
+            "bits": self.bloom.size,
+            "hashes": self.bloom.hashes,
+            "deletes_since_build": self.deletes,
+            "estimated_false_positive_rate": self.bloom.false_positive_rate(),
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "false_positives": self.false_positives,
+            "observed_false_positive_rate": self.false_positives / missing if missing else None,
+        }
+
+
+def _collection_named(collection_name):
+    return pets_collection if collection_name == "pets" else owners_collection
+
+
+def _scan_ids(collection):
+    # Mongita lists its _ids without reading any document.
+    engine = getattr(collection, "_engine", None)
+    if engine is None:
+        return [document["_id"] for document in collection.find()]
+    return engine.list_ids(collection.full_name)
+
+
+def _id_filter_revision(collection_name):
+    counts = _pending_counters()
+    return counts.get("epoch"), counts.get(f"{collection_name}.revision", 0)
+
+
+def _build_id_filter(collection_name):
+    """Build one _id filter; a writer flushes the collection's queued changes first."""
+    # The revision is read first, so a write that lands during the scan
+    # shows up as a newer revision.
+    revision = _id_filter_revision(collection_name)
+    ids = _scan_ids(_collection_named(collection_name))
+    id_filter = _IdFilter(ids, len(ids), revision)
+    _id_filters[collection_name] = id_filter
+    return id_filter
+
+
+def _build_id_filters():
+    for collection_name in ("pets", "owners"):
+        _build_id_filter(collection_name)
+
+
+def _id_filter(collection_name, id_filter=None):
+    """Return a current _id filter, building it if it is missing or behind the revision."""
+    with _id_filter_lock:
+        current = _id_filters.get(collection_name)
+        if current is not id_filter and current is not None:
+            return current  # Another thread has just built it.
+        if current is None or current.revision != _id_filter_revision(collection_name):
+            current = _build_id_filter(collection_name)
+        return current
+
+
+def _update_id_filter(collection_name, op, changes):
+    id_filter = _id_filters.get(collection_name)
+    if id_filter is None:
+        return
+    if op == "insert":
+        for object_id, _ in changes:
+            id_filter.add(object_id)
+    elif op == "delete":
+        for object_id, _ in changes:
+            id_filter.discard(object_id)
+    if id_filter.needs_rebuild():
+        _barrier(_collection_named(collection_name))
+        _build_id_filter(collection_name)
+
+
+def _ruled_out(collection_name, object_id):
+    """
+    Return True if object_id is certainly not in the collection.
+
+    Builds the filter on first use. A writer calls it only once the
+    collection has no queued changes.
+    """
+    id_filter = _id_filters.get(collection_name)
+    if id_filter is None:
+        return not _id_filter(collection_name).may_contain(object_id)
+    if id_filter.may_contain(object_id):
+        return False
+    # Only this process's writes reach the filter. If the revision has moved
+    # past the one it was built at, another process wrote the collection:
+    # rebuild the filter before trusting a "no".
+    if id_filter.revision == _id_filter_revision(collection_name):
+        return True
+    return not _id_filter(collection_name, id_filter).may_contain(object_id)
+
+
+def _count_false_positive(collection_name):
+    id_filter = _id_filters.get(collection_name)
+    if id_filter is not None:
+        id_filter.false_positives += 1
+
+
+def _find_by_id(collection_name, object_id):
+    """
+    find_one by _id, unless the collection's _id filter rules it out.
+
+    Reads call it under the read lock, so it never flushes; a write that
+    may have queued changes to the collection calls _barrier() first.
+    """
+    if _ruled_out(collection_name, object_id):
+        document = None
+    else:
+        document = _collection_named(collection_name).find_one({"_id": object_id})
+        if document is None:
+            _count_false_positive(collection_name)
+    if document is None and collection_name == "owners":
+        _known_owners.pop(object_id, None)
+    return document
+
+
 def _require_owner(owner_id):
     object_id = _to_object_id(owner_id, "owner_id")
-    owner = owners_collection.find_one({"_id": object_id})
-    if owner is None:
+    _check_known_owners()
+    if object_id in _known_owners:
+        return object_id
+    _barrier(owners_collection)
+    if _find_by_id("owners", object_id) is None:
         raise ConstraintError("owner_id does not reference an existing owner.")
+    _remember_owner(object_id)
     return object_id
 
 
 def _require_existing_pet(id):
     object_id = _to_object_id(id, "pet id")
-    pet = pets_collection.find_one({"_id": object_id})
+    pet = _find_by_id("pets", object_id)
     if pet is None:
         raise NotFoundError("pet not found.")
     return object_id, pet
@@ -134,33 +1351,137 @@ def _require_existing_pet(id):
 
 def _require_existing_owner(id):
     object_id = _to_object_id(id, "owner id")
-    owner = owners_collection.find_one({"_id": object_id})
+    owner = _find_by_id("owners", object_id)
     if owner is None:
         raise NotFoundError("owner not found.")
     return object_id, owner
 
 
-def _normalize_pet_data(data):
-    owner_id = data.get("owner_id")
-    if (owner_id or "").strip() == "":
+@_reads
+def get_id_filter_stats():
+    """
+    Return {collection: stats} for the pets and owners _id filters.
+
+    estimated_false_positive_rate comes from how full the filter is;
+    observed_false_positive_rate is the share of lookups for missing ids
+    that the filter let through to the client (None before any).
+    """
+    return {name: _id_filter(name, _id_filters.get(name)).stats() for name in ("pets", "owners")}
+
+
+@_writes
+def rebuild_id_filters():
+    """Rebuild the _id filters now, dropping the ids of deleted documents."""
+    _flush_batch()
+    _build_id_filters()
+    return get_id_filter_stats()
+
+
+def _normalize_pet_fields(data):
+    """Validate a pet without checking that its owner exists."""
+    owner_id = _text(data.get("owner_id"))
+    if owner_id == "":
         raise ValueError("owner_id is required.")
 
     return {
         "name": _require_text(data.get("name"), "name"),
         "type": _require_text(data.get("type"), "type"),
         "age": _normalize_age(data.get("age")),
-        "owner_id": _require_owner(owner_id),
+        "owner_id": _to_object_id(owner_id, "owner_id"),
     }
 
 
+def _normalize_pet_data(data):
+    pet = _normalize_pet_fields(data)
+    _require_owner(pet["owner_id"])
+    return pet
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_insert(collection, rows, normalize, chunk_size, check_chunk=None, inserted=None):
+    """
+    Normalize and insert rows one chunk at a time.
+
+    Returns (inserted_ids, errors). inserted_ids lines up with the input rows
+    and holds None for every row that was rejected; errors is a list of
+    (row_index, message) pairs. A bad row never aborts the rest of the batch,
+    whatever its normalization raises. inserted, if given, is called with
+    each chunk's written documents and their ids, before the next chunk is
+    read.
+    """
+    inserted_ids = []
+    errors = []
+    offset = 0
+    for chunk in _chunks(rows, chunk_size):
+        documents = []
+        positions = []
+        for position, row in enumerate(chunk, start=offset):
+            try:
+                documents.append(normalize(row))
+                positions.append(position)
+            except Exception as e:
+                errors.append((position, str(e)))
+        if check_chunk is not None:
+            documents, positions = check_chunk(documents, positions, errors)
+
+        chunk_ids = [None] * len(chunk)
+        if documents:
+            result = collection.insert_many(documents)
+            if inserted is not None:
+                inserted(documents, result.inserted_ids)
+            for position, object_id in zip(positions, result.inserted_ids):
+                chunk_ids[position - offset] = str(object_id)
+        inserted_ids.extend(chunk_ids)
+        offset += len(chunk)
+
+    errors.sort()
+    return inserted_ids, errors
+
+
+def _check_pet_owners(pets, positions, errors):
+    owner_ids = {pet["owner_id"] for pet in pets}
+    _check_known_owners()
+    # A local set: _remember_owner() may evict ids this chunk relies on.
+    found = owner_ids & _known_owners.keys()
+    missing = [owner_id for owner_id in owner_ids - found if not _ruled_out("owners", owner_id)]
+    if missing:
+        for owner in owners_collection.find({"_id": {"$in": missing}}):
+            found.add(owner["_id"])
+            _remember_owner(owner["_id"])
+    kept_pets = []
+    kept_positions = []
+    for pet, position in zip(pets, positions):
+        if pet["owner_id"] in found:
+            kept_pets.append(pet)
+            kept_positions.append(position)
+        else:
+            errors.append((position, "owner_id does not reference an existing owner."))
+    return kept_pets, kept_positions
+
+
 def _normalize_owner_data(data):
     return {
         "name": _require_text(data.get("name"), "name"),
-        "city": (data.get("city") or "").strip() or None,
-        "type_of_home": (data.get("type_of_home") or "").strip() or None,
+        "city": _text(data.get("city")) or None,
+        "type_of_home": _text(data.get("type_of_home")) or None,
     }
 
 
+def _new_owner_data(data):
+    # pet_count is only ever changed through the per-owner counters.
+    return {**_normalize_owner_data(data), "pet_count": 0}
+
+
 def pet_to_dict(pet):
     return {
         "id": str(pet["_id"]),
@@ -171,20 +1492,193 @@ def pet_to_dict(pet):
     }
 
 
-def test_pet_to_dict():
-    sample = {
-        "_id": ObjectId("67d8c61b5180a31695e90744"),
-        "name": "meercat",
-        "type": "mammal",
-        "age": 2,
-        "owner_id": ObjectId("67d8c61b5180a31695e90745"),
-    }
-    converted = pet_to_dict(sample)
-    assert converted["id"] == "67d8c61b5180a31695e90744"
-    assert converted["owner_id"] == "67d8c61b5180a31695e90745"
-    assert converted["name"] == "meercat"
-    assert converted["type"] == "mammal"
-    assert converted["age"] == 2
+def _normalize_limit(limit):
+    if limit is None or limit == "":
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except Exception as exc:
+        raise ValueError("limit must be a number.") from exc
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return limit
+
+
+def _seek_page(collection_name, cursor, direction, count):
+    """
+    Read up to `count` documents past `cursor` in _id order.
+
+    Mongita has no ordered index on _id: a find() with a sort decodes and
+    sorts every document in the collection. Instead this bisects the
+    _id filter's sorted ids and fetches each document by _id, so a page
+    costs O(log n + count) whatever the collection size.
+    """
+    ids = _id_filter(collection_name, _id_filters.get(collection_name)).sorted_ids
+    if direction < 0:
+        positions = range(bisect.bisect_left(ids, str(cursor)) - 1, -1, -1)
+    else:
+        start = 0 if cursor is None else bisect.bisect_right(ids, str(cursor))
+        positions = range(start, len(ids))
+    collection = _collection_named(collection_name)
+    documents = []
+    for position in positions:
+        document = collection.find_one({"_id": ObjectId(ids[position])})
+        # Another process may delete a document after the revision check.
+        if document is not None:
+            documents.append(document)
+            if len(documents) == count:
+                break
+    return documents
+
+
+def _find_page(collection_name, after=None, before=None, limit=None):
+    """
+    Return one page of documents ordered by _id, plus the page tokens.
+
+    Pages are keyed on _id instead of skip offsets: `after` continues forward
+    from a next-page token and `before` walks back from a previous-page
+    token. Returns (documents, next_after, prev_before), where a token is None
+    when there is no page in that direction.
+
+    Mongita pages are read with _seek_page(). SQLite keeps _id as its
+    primary key, so a range query with a sort and limit reads only the page.
+    """
+    limit = _normalize_limit(limit)
+    if after and before:
+        raise ValueError("use either after or before, not both.")
+
+    if before:
+        cursor, direction = _to_object_id(before, "before"), -1
+    elif after:
+        cursor, direction = _to_object_id(after, "after"), 1
+    else:
+        cursor, direction = None, 1
+
+    # Fetch one extra document to learn whether another page exists.
+    collection = _collection_named(collection_name)
+    if getattr(collection, "_engine", None) is not None:
+        documents = _seek_page(collection_name, cursor, direction, limit + 1)
+    else:
+        filter = {} if cursor is None else {"_id": {"$lt" if before else "$gt": cursor}}
+        documents = list(collection.find(filter, sort=[("_id", direction)], limit=limit + 1))
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+
+    if before:
+        documents.reverse()
+        has_next = True
+        has_prev = has_more
+    else:
+        has_next = has_more
+        has_prev = bool(after)
+
+    if not documents:
+        return documents, (before or None), (after or None)
+    next_after = str(documents[-1]["_id"]) if has_next else None
+    prev_before = str(documents[0]["_id"]) if has_prev else None
+    return documents, next_after, prev_before
+
+
+@_reads
+def _open_stream(collection_name, filter):
+    if client is None:
+        raise RuntimeError("database is not initialized.")
+    collection = pets_collection if collection_name == "pets" else owners_collection
+    return client, iter(collection.find(filter))
+
+
+@_reads
+def _read_stream_chunk(opened_by, cursor, chunk_size):
+    if client is not opened_by:
+        raise RuntimeError("database was closed while streaming.")
+    return list(islice(cursor, chunk_size))
+
+
+def _stream(collection_name, filter, convert, chunk_size):
+    """
+    Yield converted documents from one find() cursor.
+
+    The read lock is taken per chunk of `chunk_size` documents and never
+    held across a yield, so a slow consumer cannot block writers, and only
+    one chunk is in memory at a time. Documents written while the stream is
+    running may or may not be included.
+    """
+    opened_by, cursor = _open_stream(collection_name, filter)
+    while True:
+        chunk = _read_stream_chunk(opened_by, cursor, chunk_size)
+        if not chunk:
+            return
+        for document in chunk:
+            yield convert(document)
+
+
+def _optional_int(value, field_name):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except Exception as exc:
+        raise ValueError(f"{field_name} must be a number.") from exc
+
+
+def pet_filter(type=None, owner_id=None, min_age=None, max_age=None):
+    """
+    Build a find() filter for iter_pets() from optional request arguments.
+
+    Empty values are ignored; the age bounds are inclusive.
+    """
+    filter = {}
+    if type:
+        filter["type"] = type
+    if owner_id:
+        filter["owner_id"] = _to_object_id(owner_id, "owner_id")
+    age = {}
+    min_age = _optional_int(min_age, "min_age")
+    max_age = _optional_int(max_age, "max_age")
+    if min_age is not None:
+        age["$gte"] = min_age
+    if max_age is not None:
+        age["$lte"] = max_age
+    if age:
+        filter["age"] = age
+    return filter
+
+
+def owner_filter(name=None, city=None, type_of_home=None):
+    """Build a find() filter for iter_owners(); empty values are ignored."""
+    fields = {"name": name, "city": city, "type_of_home": type_of_home}
+    return {field: value for field, value in fields.items() if value}
+
+
+# Per-field readers used to build converters for reduced field sets, so a
+# caller asking for ("id", "name") never pays for the other fields.
+_PET_FIELD_READERS = {
+    "id": lambda pet: str(pet["_id"]),
+    "name": lambda pet: pet["name"],
+    "type": lambda pet: pet["type"],
+    "age": lambda pet: pet["age"],
+    "owner_id": lambda pet: str(pet["owner_id"]),
+}
+
+_OWNER_FIELD_READERS = {
+    "id": lambda owner: str(owner["_id"]),
+    "name": lambda owner: owner["name"],
+    "city": lambda owner: owner.get("city"),
+    "type_of_home": lambda owner: owner.get("type_of_home"),
+    "pet_count": lambda owner: owner.get("pet_count", 0),
+}
+
+
+def _make_converter(readers, fields):
+    unknown = [field for field in fields if field not in readers]
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)}.")
+    selected = [(field, readers[field]) for field in fields]
+
+    def convert(document):
+        return {field: read(document) for field, read in selected}
+
+    return convert
 
 
 def owner_to_dict(owner):
@@ -193,346 +1687,403 @@ def owner_to_dict(owner):
         "name": owner["name"],
         "city": owner.get("city"),
         "type_of_home": owner.get("type_of_home"),
+        "pet_count": owner.get("pet_count", 0),
     }
 
 
-def test_owner_to_dict():
-    sample = {
-        "_id": ObjectId("67d8c61b5180a31695e90746"),
-        "name": "greg",
-        "city": "Portland",
-        "type_of_home": "condo",
-    }
-    converted = owner_to_dict(sample)
-    assert converted["id"] == "67d8c61b5180a31695e90746"
-    assert converted["name"] == "greg"
-    assert converted["city"] == "Portland"
-    assert converted["type_of_home"] == "condo"
-
-
-def _seed_test_database(database_name="pytest_seed"):
-    setup_database(database_name, client_factory=MongitaClientMemory)
-
-    owners_collection.delete_many({})
-    pets_collection.delete_many({})
-
-    owners = [
-        {"name": "greg", "city": "Portland", "type_of_home": "condo"},
-        {"name": "david", "city": "Seattle", "type_of_home": "farm"},
-    ]
-    owner_ids = {}
-    for owner in owners:
-        owner_id = create_owner(owner)
-        owner_ids[owner["name"]] = owner_id
+@_reads
+def get_pets(fields=None):
+    """
+    Return every pet as a dict.
 
-    pets = [
-        {"name": "dorothy", "type": "dog", "age": 9, "owner_id": owner_ids["greg"]},
-        {"name": "suzy", "type": "mouse", "age": 9, "owner_id": owner_ids["greg"]},
-        {"name": "casey", "type": "dog", "age": 9, "owner_id": owner_ids["greg"]},
-        {"name": "heidi", "type": "cat", "age": 15, "owner_id": owner_ids["david"]},
-    ]
-    for pet in pets:
-        create_pet(pet)
+    Pass `fields` (e.g. ["id", "name"]) to convert only those fields.
+    """
+    convert = pet_to_dict if fields is None else _make_converter(_PET_FIELD_READERS, fields)
+    return [convert(pet) for pet in pets_collection.find()]
 
-    return owner_ids
 
+@_reads
+def get_pets_page(after=None, before=None, limit=None):
+    """Return (pets, next_after, prev_before); see _find_page()."""
+    pets, next_after, prev_before = _find_page("pets", after, before, limit)
+    return [pet_to_dict(pet) for pet in pets], next_after, prev_before
 
-def get_pets():
-    return [pet_to_dict(pet) for pet in pets_collection.find()]
 
+@_reads
+def get_pets_with_owners(after=None, before=None, limit=None):
+    """
+    Return a page of pets with each pet's owner_name filled in.
 
-def test_get_pets():
-    owner_ids = _seed_test_database()
-    pets = get_pets()
-    assert type(pets) is list
-    assert len(pets) >= 1
-    assert type(pets[0]) is dict
-    for key in ["id", "name", "type", "age", "owner_id"]:
-        assert key in pets[0]
-    assert type(pets[0]["id"]) is str
-    assert type(pets[0]["owner_id"]) is str
-    assert pets[0]["owner_id"] in owner_ids.values()
+    The distinct owners on the page are read with one $in query on SQLite,
+    where _id is the primary key. Mongita answers an $in on _id by scanning
+    the collection, so there each owner is read by _id instead. Returns
+    (pets, next_after, prev_before) like get_pets_page().
+    """
+    pets, next_after, prev_before = _find_page("pets", after, before, limit)
+    owner_ids = list({pet["owner_id"] for pet in pets})
+    if not owner_ids:
+        owners = []
+    elif isinstance(client, SQLiteClient):
+        owners = owners_collection.find({"_id": {"$in": owner_ids}})
+    else:
+        owners = filter(None, (_find_by_id("owners", owner_id) for owner_id in owner_ids))
+    owner_names = {owner["_id"]: owner["name"] for owner in owners}
+
+    rows = []
+    for pet in pets:
+        row = pet_to_dict(pet)
+        row["owner_name"] = owner_names.get(pet["owner_id"])
+        rows.append(row)
+    return rows, next_after, prev_before
 
 
+@_reads
 def get_pet(id):
     object_id = _to_object_id(id, "pet id")
-    pet = pets_collection.find_one({"_id": object_id})
+    pet = _find_by_id("pets", object_id)
     if pet is None:
         return None
     return pet_to_dict(pet)
 
 
-def test_get_pet():
-    owner_ids = _seed_test_database()
-    pet = get_pets()[0]
-    fetched = get_pet(pet["id"])
-    assert fetched is not None
-    assert fetched["id"] == pet["id"]
-    assert fetched["owner_id"] in owner_ids.values()
+@_reads
+def get_pets_by_owner(owner_id):
+    object_id = _to_object_id(owner_id, "owner_id")
+    return [pet_to_dict(pet) for pet in pets_collection.find({"owner_id": object_id})]
 
 
-def test_get_pet_missing_returns_none():
-    _seed_test_database()
-    assert get_pet("67d8c61b5180a31695e907ff") is None
+def iter_pets(filter=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream the pets matching `filter` (see pet_filter()) as dicts."""
+    return _stream("pets", filter or {}, pet_to_dict, chunk_size)
 
 
+@_writes
 def create_pet(data):
     pet = _normalize_pet_data(data)
-    result = pets_collection.insert_one(pet)
-    return str(result.inserted_id)
-
-
-def test_create_pet_and_get_pet():
-    owner_ids = _seed_test_database()
-    new_id = create_pet(
-        {
-            "name": "walter",
-            "age": "2",
-            "type": "mouse",
-            "owner_id": owner_ids["greg"],
-        }
-    )
-    assert type(new_id) is str
-    pet = get_pet(new_id)
-    assert pet is not None
-    assert pet["id"] == new_id
-    assert pet["name"] == "walter"
-    assert pet["age"] == 2
-    assert pet["type"] == "mouse"
-    assert pet["owner_id"] == owner_ids["greg"]
-
-
-def test_create_pet_requires_name():
-    owner_ids = _seed_test_database()
-    with pytest.raises(ValueError, match="name is required"):
-        create_pet(
-            {
-                "name": "",
-                "age": 1,
-                "type": "cat",
-                "owner_id": owner_ids["greg"],
-            }
-        )
-
-
-def test_create_pet_requires_type():
-    owner_ids = _seed_test_database()
-    with pytest.raises(ValueError, match="type is required"):
-        create_pet(
-            {
-                "name": "no-type",
-                "age": 1,
-                "type": "",
-                "owner_id": owner_ids["greg"],
-            }
-        )
-
-
-def test_create_pet_requires_owner():
-    _seed_test_database()
-    with pytest.raises(ValueError, match="owner_id is required"):
-        create_pet({"name": "ghost", "age": 1, "type": "cat", "owner_id": ""})
+    pet_id = _insert(pets_collection, pet)
+    _record_changes("pets", "insert", [(pet_id, pet)], _add_pet_to_counters({}, pet, 1))
+    return str(pet_id)
 
 
-def test_create_pet_rejects_unknown_owner():
-    _seed_test_database()
-    with pytest.raises(ConstraintError, match="owner_id"):
-        create_pet(
-            {
-                "name": "ghost",
-                "age": 1,
-                "type": "cat",
-                "owner_id": "000000000000000000000000",
-            }
-        )
-
+@_writes
+def create_pets(rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert many pets with one owner lookup and one insert_many per chunk.
 
-def test_invalid_pet_id_rejected():
-    _seed_test_database()
-    with pytest.raises(ValueError, match="ObjectId"):
-        get_pet("not-an-object-id")
+    Returns (inserted_ids, errors) as described in _bulk_insert().
+    """
+    _flush_batch()
+
+    def inserted(pets, pet_ids):
+        # Recorded per chunk, so the chunks already written stay counted if
+        # a later one fails.
+        deltas = {}
+        for pet in pets:
+            _add_pet_to_counters(deltas, pet, 1)
+        _record_changes("pets", "insert", list(zip(pet_ids, pets)), deltas)
+
+    return _bulk_insert(
+        pets_collection,
+        rows,
+        _normalize_pet_fields,
+        chunk_size,
+        check_chunk=_check_pet_owners,
+        inserted=inserted,
+    )
 
 
+@_writes
 def update_pet(id, data):
-    object_id, _ = _require_existing_pet(id)
+    # The old pet is read once for the counter deltas; the owner check is
+    # usually answered by _known_owners, and replace_one writes by _id.
+    _barrier(pets_collection)
+    object_id, old_pet = _require_existing_pet(id)
     pet = _normalize_pet_data(data)
-    pets_collection.update_one({"_id": object_id}, {"$set": pet})
-
-
-def test_update_pet():
-    owner_ids = _seed_test_database()
-    pet = get_pets()[0]
-    update_pet(
-        pet["id"],
-        {"name": "updated", "age": "8", "type": "dog", "owner_id": owner_ids["david"]},
-    )
-    updated = get_pet(pet["id"])
-    assert updated is not None
-    assert updated["name"] == "updated"
-    assert updated["age"] == 8
-    assert updated["type"] == "dog"
-    assert updated["owner_id"] == owner_ids["david"]
-
-
-def test_update_pet_rejects_missing_pet():
-    owner_ids = _seed_test_database()
-    with pytest.raises(NotFoundError, match="pet not found"):
-        update_pet(
-            "67d8c61b5180a31695e907ff",
-            {"name": "updated", "age": 8, "type": "dog", "owner_id": owner_ids["greg"]},
-        )
+    if _replace(pets_collection, {"_id": object_id, **pet}) == 0:
+        raise NotFoundError("pet not found.")
+    deltas = _add_pet_to_counters(_add_pet_to_counters({}, old_pet, -1), pet, 1)
+    _record_changes("pets", "update", [(object_id, pet)], deltas)
 
 
+@_writes
 def delete_pet(id):
-    object_id, _ = _require_existing_pet(id)
-    pets_collection.delete_one({"_id": object_id})
-
-
-def test_delete_pet():
-    owner_ids = _seed_test_database()
-    new_id = create_pet(
-        {"name": "delete_me", "age": 3, "type": "fish", "owner_id": owner_ids["greg"]}
-    )
-    delete_pet(new_id)
-    assert get_pet(new_id) is None
-
+    _barrier(pets_collection)
+    object_id, pet = _require_existing_pet(id)
+    if _delete(pets_collection, {"_id": object_id}) == 0:
+        raise NotFoundError("pet not found.")
+    _record_changes("pets", "delete", [(object_id, None)], _add_pet_to_counters({}, pet, -1))
 
-def test_delete_missing_pet_raises_not_found():
-    _seed_test_database()
-    with pytest.raises(NotFoundError, match="pet not found"):
-        delete_pet("000000000000000000000000")
 
+@_reads
+def get_owners(fields=None):
+    """
+    Return every owner as a dict.
 
-def get_owners():
-    return [owner_to_dict(owner) for owner in owners_collection.find()]
+    Pass `fields` (e.g. ["id", "name"]) to convert only those fields.
+    """
+    if fields is None:
+        convert = owner_to_dict
+    else:
+        convert = _make_converter(_OWNER_FIELD_READERS, fields)
+    return [convert(owner) for owner in owners_collection.find()]
 
 
-def test_get_owners():
-    _seed_test_database()
-    owners = get_owners()
-    assert type(owners) is list
-    assert len(owners) == 2
-    assert type(owners[0]) is dict
-    for key in ["id", "name", "city", "type_of_home"]:
-        assert key in owners[0]
+@_reads
+def get_owners_page(after=None, before=None, limit=None):
+    """Return (owners, next_after, prev_before); see _find_page()."""
+    owners, next_after, prev_before = _find_page("owners", after, before, limit)
+    return [owner_to_dict(owner) for owner in owners], next_after, prev_before
 
 
+@_reads
 def get_owner(id):
     object_id = _to_object_id(id, "owner id")
-    owner = owners_collection.find_one({"_id": object_id})
+    owner = _find_by_id("owners", object_id)
     if owner is None:
         return None
     return owner_to_dict(owner)
 
 
-def test_get_owner():
-    owner_ids = _seed_test_database()
-    owner = get_owner(owner_ids["greg"])
-    assert owner is not None
-    assert owner["id"] == owner_ids["greg"]
-    assert owner["name"] == "greg"
-    assert owner["city"] == "Portland"
-
-
-def test_get_owner_missing_returns_none():
-    _seed_test_database()
-    assert get_owner("67d8c61b5180a31695e907ff") is None
+def iter_owners(filter=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream the owners matching `filter` (see owner_filter()) as dicts."""
+    return _stream("owners", filter or {}, owner_to_dict, chunk_size)
 
 
+@_writes
 def create_owner(data):
-    owner = _normalize_owner_data(data)
-    result = owners_collection.insert_one(owner)
-    return str(result.inserted_id)
+    owner = _new_owner_data(data)
+    owner_id = _insert(owners_collection, owner)
+    _record_changes("owners", "insert", [(owner_id, owner)], {"owners": 1})
+    _remember_owner(owner_id)
+    return str(owner_id)
+
 
+@_writes
+def create_owners(rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert many owners with one insert_many per chunk.
 
-def test_create_owner_and_get_owner():
-    _seed_test_database()
-    new_id = create_owner({"name": "solo", "city": "Akron", "type_of_home": "house"})
-    assert type(new_id) is str
-    owner = get_owner(new_id)
-    assert owner is not None
-    assert owner["id"] == new_id
-    assert owner["name"] == "solo"
-    assert owner["city"] == "Akron"
-    assert owner["type_of_home"] == "house"
+    Returns (inserted_ids, errors) as described in _bulk_insert().
+    """
+    _flush_batch()
 
+    def inserted(owners, owner_ids):
+        for owner_id in owner_ids:
+            _remember_owner(owner_id)
+        _record_changes("owners", "insert", list(zip(owner_ids, owners)), {"owners": len(owners)})
 
-def test_create_owner_requires_name():
-    _seed_test_database()
-    with pytest.raises(ValueError, match="name is required"):
-        create_owner({"name": "", "city": "Akron", "type_of_home": "house"})
+    return _bulk_insert(owners_collection, rows, _new_owner_data, chunk_size, inserted=inserted)
 
 
+@_writes
 def update_owner(id, data):
-    object_id, _ = _require_existing_owner(id)
+    # The owner is read by _id to keep its pet_count and then replaced by
+    # _id; Mongita answers both directly, where update_one would scan.
     owner = _normalize_owner_data(data)
-    owners_collection.update_one({"_id": object_id}, {"$set": owner})
-
-
-def test_update_owner():
-    owner_ids = _seed_test_database()
-    update_owner(
-        owner_ids["greg"],
-        {"name": "gregory", "city": "Salem", "type_of_home": "cabin"},
-    )
-    updated = get_owner(owner_ids["greg"])
-    assert updated is not None
-    assert updated["name"] == "gregory"
-    assert updated["city"] == "Salem"
-    assert updated["type_of_home"] == "cabin"
-
-
-def test_update_owner_rejects_missing_owner():
-    _seed_test_database()
-    with pytest.raises(NotFoundError, match="owner not found"):
-        update_owner(
-            "67d8c61b5180a31695e907ff",
-            {"name": "missing", "city": "Nowhere", "type_of_home": "house"},
-        )
+    _barrier(owners_collection)
+    object_id, old_owner = _require_existing_owner(id)
+    if _replace(owners_collection, {**old_owner, **owner}) == 0:
+        raise NotFoundError("owner not found.")
+    _record_changes("owners", "update", [(object_id, owner)])
 
 
+@_writes
 def delete_owner(id):
-    object_id, _ = _require_existing_owner(id)
-    pet = pets_collection.find_one({"owner_id": object_id})
-    if pet is not None:
+    _barrier(owners_collection, pets_collection)
+    object_id, owner = _require_existing_owner(id)
+    if owner.get("pet_count", 0) > 0:
         raise ConstraintError(
             "Cannot delete this owner because they have pets. Please delete their pets first."
         )
 
-    owners_collection.delete_one({"_id": object_id})
+    deleted = _delete(owners_collection, {"_id": object_id})
+    _known_owners.pop(object_id, None)
+    if deleted == 0:
+        raise NotFoundError("owner not found.")
+    _record_changes("owners", "delete", [(object_id, None)], {"owners": -1})
 
 
-def test_delete_owner_restricted():
-    owner_ids = _seed_test_database()
-    with pytest.raises(ConstraintError, match="have pets"):
-        delete_owner(owner_ids["greg"])
+def _encode_for_dump(value):
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"cannot dump {type(value).__name__} values.")
 
 
-def test_delete_owner_then_pet_succeeds():
-    _seed_test_database()
-    owner_id = create_owner({"name": "solo", "city": "Akron", "type_of_home": "house"})
-    pet_id = create_pet(
-        {"name": "onepet", "age": 3, "type": "cat", "owner_id": owner_id}
-    )
+def _decode_from_dump(value):
+    if len(value) == 1 and "$oid" in value:
+        return ObjectId(value["$oid"])
+    return value
 
-    with pytest.raises(ConstraintError):
-        delete_owner(owner_id)
 
-    delete_pet(pet_id)
-    delete_owner(owner_id)
-    assert get_owner(owner_id) is None
+def _scan(collection):
+    """
+    Yield every document of a collection for read-only use.
+
+    Mongita's find() looks each document up twice and deep-copies it; under
+    the read lock nothing can change, so a dump reads the engine's documents
+    directly. Other clients go through find().
+    """
+    engine = getattr(collection, "_engine", None)
+    if engine is None:
+        yield from collection.find()
+        return
+    for doc_id in engine.list_ids(collection.full_name):
+        document = engine.get_doc(collection.full_name, doc_id)
+        if document is not None:
+            yield document
 
 
-def test_delete_missing_owner_raises_not_found():
-    _seed_test_database()
-    with pytest.raises(NotFoundError, match="owner not found"):
-        delete_owner("000000000000000000000000")
+def _dump_path(directory, name):
+    return os.path.join(directory, f"{name}.ndjson.gz")
+
+
+@_reads
+def dump(directory, compresslevel=DUMP_COMPRESSLEVEL):
+    """
+    Write each collection to <directory>/<name>.ndjson.gz, one document per line.
+
+    Documents are streamed from the cursor straight into gzip, so memory
+    stays flat whatever the size of the database. ObjectIds are written as
+    {"$oid": "..."}. Holding the read lock for the whole dump keeps the
+    collections consistent with each other. Returns {name: {"rows": n,
+    "seconds": s}}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    encode = json.JSONEncoder(default=_encode_for_dump, separators=(",", ":")).encode
+    report = {}
+    for name in DUMP_COLLECTIONS:
+        start = time.perf_counter()
+        rows = 0
+        path = _dump_path(directory, name)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=compresslevel) as f:
+            for document in _scan(db[name]):
+                f.write(encode(document))
+                f.write("\n")
+                rows += 1
+        os.replace(path + ".tmp", path)
+        report[name] = {"rows": rows, "seconds": time.perf_counter() - start}
+    return report
+
+
+def _read_dump(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line, object_hook=_decode_from_dump)
+
+
+@_writes
+def restore(directory, chunk_size=RESTORE_CHUNK_SIZE, replace=False):
+    """
+    Load a dump() directory into the current database with insert_many.
+
+    owners, pets and oplog must be empty unless replace=True, which deletes
+    their documents first; the stats counters are always replaced.
+    Secondary indexes are dropped while loading and rebuilt once at the end,
+    since Mongita re-sorts an index on every insert_many.
+    Returns {name: {"rows": n, "seconds": s}}.
+    """
+    global _search_index, _search_revisions, _known_owners_revision
+
+    _flush_batch()
+    names = [name for name in DUMP_COLLECTIONS if os.path.exists(_dump_path(directory, name))]
+    if not names:
+        raise ValueError(f"{directory} does not contain a dump.")
+    if not replace:
+        for name in names:
+            if name != "stats" and db[name].count_documents({}):
+                raise ConstraintError(f"{name} is not empty; pass replace=True to overwrite it.")
+
+    for key in PET_INDEXES:
+        if f"{key}_1" in _index_names(pets_collection):
+            pets_collection.drop_index(f"{key}_1")
+    report = {}
+    for name in names:
+        start = time.perf_counter()
+        collection = db[name]
+        if replace or name == "stats":
+            collection.delete_many({})
+        rows = 0
+        for documents in _chunks(_read_dump(_dump_path(directory, name)), chunk_size):
+            collection.insert_many(documents)
+            rows += len(documents)
+        report[name] = {"rows": rows, "seconds": time.perf_counter() - start}
+    _ensure_indexes()
+    _ensure_counters()
+    _known_owners.clear()
+    _known_owners_revision = None
+    _id_filters.clear()
+    _search_index = None
+    _search_revisions = None
+    return report
+
+
+def _insert_sample_data():
+    """Create the two owners and four pets the examples use; returns {name: owner id}."""
+    owners = [
+        {"name": "greg", "city": "Portland", "type_of_home": "condo"},
+        {"name": "david", "city": "Seattle", "type_of_home": "farm"},
+    ]
+    inserted_ids, errors = create_owners(owners)
+    assert errors == []
+    owner_ids = {owner["name"]: id for owner, id in zip(owners, inserted_ids)}
+
+    pets = [
+        {"name": "dorothy", "type": "dog", "age": 9, "owner_id": owner_ids["greg"]},
+        {"name": "suzy", "type": "mouse", "age": 9, "owner_id": owner_ids["greg"]},
+        {"name": "casey", "type": "dog", "age": 9, "owner_id": owner_ids["greg"]},
+        {"name": "heidi", "type": "cat", "age": 15, "owner_id": owner_ids["david"]},
+    ]
+    _, errors = create_pets(pets)
+    assert errors == []
+    return owner_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump or restore the pets database.")
+    parser.add_argument("--database", default="pets")
+    parser.add_argument("--path", help="Mongita storage directory (default: Mongita's)")
+    commands = parser.add_subparsers(dest="command")
+    dump_parser = commands.add_parser("dump", help="write every collection to DIRECTORY")
+    dump_parser.add_argument("directory")
+    dump_parser.add_argument("--compresslevel", type=int, default=DUMP_COMPRESSLEVEL)
+    restore_parser = commands.add_parser("restore", help="load a dump from DIRECTORY")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--chunk-size", type=int, default=RESTORE_CHUNK_SIZE)
+    restore_parser.add_argument("--replace", action="store_true")
+    commands.add_parser("seed", help="seed a throwaway in-memory database (the default)")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, "seed"):
+        setup_database("manual_seed", client_factory=MongitaClientMemory)
+        owner_ids = _insert_sample_data()
+        assert len(get_pets()) == 4
+        assert len(get_owners()) == 2
+        assert get_owner(owner_ids["greg"]) is not None
+        close_connection()
+        print("done.")
+        return
+
+    if args.path:
+        client_factory = functools.partial(MongitaClientDisk, args.path)
+        setup_database(args.database, client_factory=client_factory)
+    else:
+        setup_database(args.database)
+    try:
+        if args.command == "dump":
+            report = dump(args.directory, compresslevel=args.compresslevel)
+        else:
+            report = restore(args.directory, chunk_size=args.chunk_size, replace=args.replace)
+    except (ValueError, ConstraintError) as e:
+        parser.exit(1, f"{args.command} failed: {e}\n")
+    finally:
+        close_connection()
+    for name, result in report.items():
+        rate = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+        print(
+            f"{args.command} {name:7} {result['rows']:>9} rows "
+            f"in {result['seconds']:7.2f}s ({rate:,.0f} rows/s)"
+        )
 
 
 if __name__ == "__main__":
-    owner_ids = _seed_test_database("manual_seed")
-    assert len(get_pets()) == 4
-    assert len(get_owners()) == 2
-    assert get_owner(owner_ids["greg"]) is not None
-    close_connection()
-    print("done.")
+    main()
@@ -0,0 +1,141 @@
+"""
+Snapshots of in-memory clients, used to reset test databases quickly.
+
+capture(client) freezes the state of a MongitaClientMemory (or
+SQLiteClientMemory) once. snapshot.restore() then builds a new client with
+that state and can be passed to setup_database() as the client_factory.
+
+For Mongita the restore is copy-on-write: the new client reads documents
+and metadata from the frozen snapshot and only decodes its own copy of a
+document or a collection's metadata the first time it is touched, so
+restoring costs the same whatever the size of the snapshot.
+
+_CopyOnWriteEngine overrides MemoryEngine's private _cache and _metadata
+dicts, which is why requirements.txt pins mongita to 1.2.0. Check this
+module again before moving the pin.
+"""
+
+import collections
+
+import bson
+from mongita import MongitaClientMemory
+from mongita.common import MetaStorageObject
+from mongita.engines.memory_engine import MemoryEngine
+
+from sqlite_store import SQLiteClient, SQLiteClientMemory
+
+
+class _CopyOnWriteEngine(MemoryEngine):
+    """A MemoryEngine layered over a frozen MongitaSnapshot."""
+
+    def __init__(self, snapshot):
+        super().__init__(strict=False)
+        self._base_documents = snapshot.documents
+        self._base_metadata = snapshot.metadata
+        self._deleted = collections.defaultdict(set)
+        self._dropped = set()
+
+    def _base(self, collection):
+        if collection in self._dropped:
+            return {}
+        return self._base_documents.get(collection, {})
+
+    def put_doc(self, collection, doc, no_overwrite=False):
+        if no_overwrite and self.doc_exists(collection, doc["_id"]):
+            return False
+        return super().put_doc(collection, doc)
+
+    def get_doc(self, collection, doc_id):
+        doc_id = str(doc_id)
+        doc = self._cache[collection].get(doc_id)
+        if doc is None and doc_id not in self._deleted[collection]:
+            encoded = self._base(collection).get(doc_id)
+            if encoded is not None:
+                doc = bson.decode(encoded)
+                self._cache[collection][doc_id] = doc
+        return doc
+
+    def doc_exists(self, collection, doc_id):
+        doc_id = str(doc_id)
+        if doc_id in self._cache[collection]:
+            return True
+        return doc_id not in self._deleted[collection] and doc_id in self._base(collection)
+
+    def list_ids(self, collection, limit=None):
+        copied = self._cache.get(collection, {})
+        deleted = self._deleted.get(collection, set())
+        ids = [
+            doc_id
+            for doc_id in self._base(collection)
+            if doc_id not in copied and doc_id not in deleted
+        ]
+        ids.extend(copied.keys())
+        return ids if limit is None else ids[:limit]
+
+    def delete_doc(self, collection, doc_id):
+        self._deleted[collection].add(str(doc_id))
+        return super().delete_doc(collection, doc_id)
+
+    def delete_dir(self, collection):
+        with self.lock:
+            self._dropped.add(collection)
+            return super().delete_dir(collection)
+
+    def get_metadata(self, collection):
+        metadata = super().get_metadata(collection)
+        if metadata is None and collection not in self._dropped:
+            encoded = self._base_metadata.get(collection)
+            if encoded is not None:
+                metadata = MetaStorageObject.from_storage(encoded, from_bson=True)
+                self._metadata[collection] = metadata
+        return metadata
+
+    def close(self):
+        super().close()
+        self._base_documents = {}
+        self._base_metadata = {}
+
+
+class MongitaSnapshot:
+    """Frozen state of a Mongita memory engine, stored as BSON bytes."""
+
+    def __init__(self, engine):
+        with engine.lock:
+            names = set(engine._cache) | set(getattr(engine, "_base_documents", {}))
+            self.documents = {
+                name: {
+                    doc_id: bson.encode(engine.get_doc(name, doc_id))
+                    for doc_id in engine.list_ids(name)
+                }
+                for name in names
+            }
+            names = set(engine._metadata) | set(getattr(engine, "_base_metadata", {}))
+            self.metadata = {}
+            for name in names:
+                metadata = engine.get_metadata(name)
+                if metadata is not None:
+                    self.metadata[name] = MetaStorageObject(metadata).to_storage(as_bson=True)
+
+    def restore(self):
+        client = MongitaClientMemory()
+        client.engine = _CopyOnWriteEngine(self)
+        return client
+
+
+class SQLiteSnapshot:
+    """Serialized image of an SQLiteClientMemory database."""
+
+    def __init__(self, client):
+        self.image = client.serialize()
+
+    def restore(self):
+        return SQLiteClientMemory.from_image(self.image)
+
+
+def capture(client):
+    """Freeze the current state of an in-memory client."""
+    if isinstance(client, SQLiteClient):
+        return SQLiteSnapshot(client)
+    if isinstance(client, MongitaClientMemory):
+        return MongitaSnapshot(client.engine)
+    raise TypeError(f"cannot snapshot {client!r}; use an in-memory client.")
@@ -0,0 +1,456 @@
+"""
+A small document store with the same interface as the Mongita clients.
+
+Documents are kept as JSON text in SQLite tables (one table per collection)
+and queried with the JSON1 functions. Unlike MongitaClientDisk, an index
+created with create_index() is a real SQLite B-tree index on the field's
+json_extract() expression, `_id` is the table's primary key, and every write
+runs inside a transaction.
+
+Only the parts of the Mongita/pymongo API that database.py uses are
+implemented.
+"""
+
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+
+from bson.objectid import ObjectId
+from mongita.errors import DuplicateKeyError, MongitaError, OperationFailure
+from mongita.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+DEFAULT_STORAGE_PATH = os.path.join(pathlib.Path.home(), ".mongita_sqlite.db")
+
+# ObjectIds are stored inside the JSON as "$oid:<hex>" strings. They keep
+# ObjectId ordering when compared as text, so range queries and indexes work.
+# A string that already starts with either prefix gets STR_PREFIX in front,
+# so it can never be read back as an ObjectId.
+OID_PREFIX = "$oid:"
+STR_PREFIX = "$str:"
+
+# Rows pulled from SQLite per round trip while iterating a cursor.
+FETCH_SIZE = 500
+
+_FIELD_NAME = re.compile(r"^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$")
+
+_COMPARISONS = {
+    "$eq": "=",
+    "$ne": "IS NOT",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+
+def _encode_value(value):
+    if isinstance(value, ObjectId):
+        return OID_PREFIX + str(value)
+    if isinstance(value, str) and value.startswith((OID_PREFIX, STR_PREFIX)):
+        return STR_PREFIX + value
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, str) and value.startswith(OID_PREFIX):
+        return ObjectId(value[len(OID_PREFIX):])
+    if isinstance(value, str) and value.startswith(STR_PREFIX):
+        return value[len(STR_PREFIX):]
+    if isinstance(value, dict):
+        return {key: _decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    return value
+
+
+def _dumps(document):
+    body = {key: value for key, value in document.items() if key != "_id"}
+    return json.dumps(_encode_value(body), separators=(",", ":"))
+
+
+def _loads(encoded_id, body):
+    document = {"_id": _decode_value(encoded_id)}
+    document.update(_decode_value(json.loads(body)))
+    return document
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _field_expression(field):
+    """
+    Return the SQL expression for a document field.
+
+    The JSON path is written into the SQL text (not bound as a parameter) so
+    SQLite can match it against the expression indexes from create_index().
+    """
+    if field == "_id":
+        return "_id"
+    if not _FIELD_NAME.match(field):
+        raise MongitaError(f"Unsupported field name {field!r}.")
+    path = "$" + "".join(f'."{part}"' for part in field.split("."))
+    return f"json_extract(doc, '{path}')"
+
+
+def _where_clause(filter):
+    clauses = []
+    params = []
+    for field, condition in (filter or {}).items():
+        expression = _field_expression(field)
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            for op, value in condition.items():
+                if op in _COMPARISONS:
+                    clauses.append(f"{expression} {_COMPARISONS[op]} ?")
+                    params.append(_encode_value(value))
+                elif op in ("$in", "$nin"):
+                    if not isinstance(value, (list, tuple, set)):
+                        raise MongitaError(f"'{op}' requires an iterable")
+                    values = [_encode_value(item) for item in value]
+                    if not values:
+                        clauses.append("0" if op == "$in" else "1")
+                        continue
+                    marks = ", ".join("?" for _ in values)
+                    negate = "NOT " if op == "$nin" else ""
+                    clauses.append(f"{expression} {negate}IN ({marks})")
+                    params.extend(values)
+                else:
+                    raise MongitaError(f"Unsupported filter operator {op!r}.")
+        elif condition is None:
+            clauses.append(f"{expression} IS NULL")
+        else:
+            clauses.append(f"{expression} = ?")
+            params.append(_encode_value(condition))
+    if not clauses:
+        return "", params
+    return " WHERE " + " AND ".join(clauses), params
+
+
+def _order_clause(sort):
+    if not sort:
+        return ""
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    terms = []
+    for field, direction in sort:
+        if direction not in (1, -1):
+            raise MongitaError("Sort direction must be 1 or -1.")
+        terms.append(f"{_field_expression(field)} {'ASC' if direction == 1 else 'DESC'}")
+    return " ORDER BY " + ", ".join(terms)
+
+
+def _apply_update(document, update):
+    for op, fields in update.items():
+        if op == "$set":
+            for field, value in fields.items():
+                document[field] = value
+        elif op == "$inc":
+            for field, amount in fields.items():
+                document[field] = document.get(field, 0) + amount
+        else:
+            raise MongitaError(f"Unsupported update operator {op!r}.")
+    return document
+
+
+class Cursor:
+    """Lazily runs a find() and streams the matching documents."""
+
+    def __init__(self, collection, filter, sort=None, limit=None, skip=None):
+        self._collection = collection
+        self._filter = filter
+        self._sort = sort
+        self._limit = limit
+        self._skip = skip
+
+    def sort(self, key_or_list, direction=None):
+        if direction is not None:
+            key_or_list = [(key_or_list, direction)]
+        self._sort = key_or_list
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def __iter__(self):
+        return self._collection._iter_documents(
+            self._filter, self._sort, self._limit, self._skip
+        )
+
+
+class Collection:
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.full_name = f"{database.name}.{name}"
+        self._table = _quote(self.full_name)
+        self._client = database.client
+        with self._client._lock, self._client._connection as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(_id TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+            )
+
+    def __repr__(self):
+        return f"Collection({self.database!r}, {self.name!r})"
+
+    def _execute(self, sql, params=()):
+        with self._client._lock:
+            return self._client._connection.execute(sql, params).fetchall()
+
+    def _iter_documents(self, filter, sort=None, limit=None, skip=None):
+        where, params = _where_clause(filter)
+        sql = f"SELECT _id, doc FROM {self._table}{where}{_order_clause(sort)}"
+        if limit or skip:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit or -1, skip or 0]
+        with self._client._lock:
+            cursor = self._client._connection.execute(sql, params)
+        while True:
+            with self._client._lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for encoded_id, body in rows:
+                yield _loads(encoded_id, body)
+
+    def _first_row(self, connection, filter):
+        where, params = _where_clause(filter)
+        return connection.execute(
+            f"SELECT _id, doc FROM {self._table}{where} LIMIT 1", params
+        ).fetchone()
+
+    def insert_one(self, document):
+        document = dict(document)
+        document["_id"] = document.get("_id") or ObjectId()
+        with self._client._lock, self._client._connection as connection:
+            self._insert(connection, document)
+        return InsertOneResult(document["_id"])
+
+    def insert_many(self, documents, ordered=True):
+        ready = []
+        for document in documents:
+            document = dict(document)
+            document["_id"] = document.get("_id") or ObjectId()
+            ready.append(document)
+        with self._client._lock, self._client._connection as connection:
+            for document in ready:
+                self._insert(connection, document)
+        return InsertManyResult(ready)
+
+    def _insert(self, connection, document):
+        try:
+            connection.execute(
+                f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)",
+                (_encode_value(document["_id"]), _dumps(document)),
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"Document {document['_id']!r} already exists") from e
+
+    def find(self, filter=None, sort=None, limit=None, skip=None):
+        return Cursor(self, filter or {}, sort, limit, skip)
+
+    def find_one(self, filter=None, sort=None, skip=None):
+        for document in self._iter_documents(filter or {}, sort, 1, skip):
+            return document
+        return None
+
+    def count_documents(self, filter):
+        where, params = _where_clause(filter)
+        return self._execute(f"SELECT count(*) FROM {self._table}{where}", params)[0][0]
+
+    def update_one(self, filter, update, upsert=False):
+        if upsert:
+            raise MongitaError("upsert is not supported on update_one. Use replace_one.")
+        with self._client._lock, self._client._connection as connection:
+            row = self._first_row(connection, filter)
+            if row is None:
+                return UpdateResult(0, 0)
+            document = _apply_update(_loads(*row), update)
+            connection.execute(
+                f"UPDATE {self._table} SET doc = ? WHERE _id = ?", (_dumps(document), row[0])
+            )
+        return UpdateResult(1, 1)
+
+    def update_many(self, filter, update, upsert=False):
+        if upsert:
+            raise MongitaError("upsert is not supported on update_many. Use replace_one.")
+        where, params = _where_clause(filter)
+        with self._client._lock, self._client._connection as connection:
+            rows = connection.execute(f"SELECT _id, doc FROM {self._table}{where}", params).fetchall()
+            for row in rows:
+                document = _apply_update(_loads(*row), update)
+                connection.execute(
+                    f"UPDATE {self._table} SET doc = ? WHERE _id = ?", (_dumps(document), row[0])
+                )
+        return UpdateResult(len(rows), len(rows))
+
+    def replace_one(self, filter, replacement, upsert=False):
+        replacement = dict(replacement)
+        with self._client._lock, self._client._connection as connection:
+            row = self._first_row(connection, filter)
+            if row is None:
+                if not upsert:
+                    return UpdateResult(0, 0)
+                replacement["_id"] = replacement.get("_id") or filter.get("_id") or ObjectId()
+                self._insert(connection, replacement)
+                return UpdateResult(0, 1, replacement["_id"])
+            connection.execute(
+                f"UPDATE {self._table} SET doc = ? WHERE _id = ?", (_dumps(replacement), row[0])
+            )
+        return UpdateResult(1, 1)
+
+    def delete_one(self, filter):
+        with self._client._lock, self._client._connection as connection:
+            row = self._first_row(connection, filter)
+            if row is None:
+                return DeleteResult(0)
+            connection.execute(f"DELETE FROM {self._table} WHERE _id = ?", (row[0],))
+        return DeleteResult(1)
+
+    def delete_many(self, filter):
+        where, params = _where_clause(filter)
+        with self._client._lock, self._client._connection as connection:
+            cursor = connection.execute(f"DELETE FROM {self._table}{where}", params)
+        return DeleteResult(cursor.rowcount)
+
+    def _index_prefix(self):
+        return f"{self.full_name}$"
+
+    def create_index(self, keys, background=False):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        if len(keys) != 1:
+            raise MongitaError("Only single key indexes are supported.")
+        field, direction = keys[0]
+        name = f"{field}_{direction}"
+        order = "ASC" if direction == 1 else "DESC"
+        with self._client._lock, self._client._connection as connection:
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(self._index_prefix() + name)} "
+                f"ON {self._table} ({_field_expression(field)} {order})"
+            )
+        return name
+
+    def drop_index(self, index_or_name):
+        if isinstance(index_or_name, (list, tuple)):
+            field, direction = index_or_name[0]
+            index_or_name = f"{field}_{direction}"
+        if index_or_name not in self._own_index_names():
+            raise OperationFailure(f"Index not found with name {index_or_name!r}")
+        with self._client._lock, self._client._connection as connection:
+            connection.execute(f"DROP INDEX {_quote(self._index_prefix() + index_or_name)}")
+
+    def _own_index_names(self):
+        rows = self._execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (self.full_name,),
+        )
+        prefix = self._index_prefix()
+        return [name[len(prefix):] for (name,) in rows if name.startswith(prefix)]
+
+    def index_information(self):
+        information = [{"_id_": {"key": [("_id", 1)]}}]
+        for name in self._own_index_names():
+            field, direction = name.rsplit("_", 1)
+            information.append({name: {"key": [(field, int(direction))]}})
+        return information
+
+
+class Database:
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self._collections = {}
+
+    def __repr__(self):
+        return f"Database({self.client!r}, {self.name!r})"
+
+    def __getitem__(self, name):
+        with self.client._lock:
+            if name not in self._collections:
+                self._collections[name] = Collection(name, self)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        prefix = f"{self.name}."
+        rows = self.client._connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        return [name[len(prefix):] for (name,) in rows if name.startswith(prefix)]
+
+
+class SQLiteClient:
+    """Stores every database in one SQLite file (WAL mode)."""
+
+    def __init__(self, path=DEFAULT_STORAGE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._databases = {}
+
+    def __repr__(self):
+        return f"SQLiteClient(path={self.path})"
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = Database(name, self)
+            return self._databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_database_names(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).fetchall()
+        return sorted({name.split(".", 1)[0] for (name,) in rows if "." in name})
+
+    def serialize(self):
+        """Return the whole database file as bytes (see snapshot.py)."""
+        with self._lock:
+            return self._connection.serialize()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SQLiteClientMemory(SQLiteClient):
+    """An SQLiteClient whose data lives only as long as the client."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+
+    def __repr__(self):
+        return "SQLiteClientMemory()"
+
+    @classmethod
+    def from_image(cls, image):
+        """Build an in-memory client from SQLiteClient.serialize() output."""
+        client = cls()
+        client._connection.deserialize(image)
+        return client
@@ -0,0 +1,28 @@
+import pytest
+
+from bloom import BloomFilter
+
+
+def test_sizing():
+    bloom = BloomFilter(1000, 0.01)
+    assert bloom.size == 9586
+    assert bloom.hashes == 7
+    with pytest.raises(ValueError, match="capacity"):
+        BloomFilter(0)
+
+
+def test_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"present{i}")
+    assert len(bloom) == 1000
+    assert all(f"present{i}" in bloom for i in range(1000))
+    false_positives = sum(f"absent{i}" in bloom for i in range(10000))
+    assert false_positives < 200
+    assert 0.005 < bloom.false_positive_rate() < 0.02
+
+
+def test_empty_filter_contains_nothing():
+    bloom = BloomFilter(10)
+    assert "anything" not in bloom
+    assert bloom.false_positive_rate() == 0
@@ -0,0 +1,1459 @@
+import functools
+import threading
+import time
+
+import pytest
+from bson.objectid import ObjectId
+from mongita import MongitaClientDisk
+
+import database
+import snapshot
+from sqlite_store import SQLiteClientMemory
+
+if database.MongitaClientMemory is None:
+    pytest.skip(
+        "MongitaClientMemory is not available in this environment.", allow_module_level=True
+    )
+
+
+# database_name -> (snapshot of the seeded client, owner ids by name)
+_seed_snapshots = {}
+
+
+def _seed_test_database(database_name="pytest_seed"):
+    """
+    Give the calling test a freshly seeded in-memory database.
+
+    The data is inserted once per database name; every later call restores
+    a copy-on-write snapshot of that state, which takes constant time.
+    """
+    if database_name in _seed_snapshots:
+        seeded, owner_ids = _seed_snapshots[database_name]
+        database.setup_database(database_name, client_factory=seeded.restore)
+        return dict(owner_ids)
+
+    database.setup_database(database_name, client_factory=database.MongitaClientMemory)
+    owner_ids = database._insert_sample_data()
+    _seed_snapshots[database_name] = (snapshot.capture(database.client), owner_ids)
+    return dict(owner_ids)
+
+
+class _CountingCollection:
+    """Test helper that counts the calls made on a wrapped collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = 0
+
+    def __getattr__(self, name):
+        self.calls += 1
+        return getattr(self.collection, name)
+
+
+def test_initialize_sets_globals():
+    database.initialize("pytest_initialize", client_factory=database.MongitaClientMemory)
+    assert database.client is not None
+    assert database.db is not None
+    assert database.owners_collection is not None
+    assert database.pets_collection is not None
+    database.close_connection()
+
+
+def test_sqlite_client_runs_data_layer():
+    database.setup_database("pytest_sqlite", client_factory=SQLiteClientMemory)
+    assert "owner_id_1" in database._index_names(database.pets_collection)
+    owner_id = database.create_owner({"name": "greg", "city": "Portland"})
+    pet_id = database.create_pet({"name": "dorothy", "age": 9, "type": "dog", "owner_id": owner_id})
+    assert database.get_pets_by_owner(owner_id)[0]["id"] == pet_id
+    assert [pet["id"] for pet in database.get_pets_page(limit=5)[0]] == [pet_id]
+    database.owners_collection = _CountingCollection(database.owners_collection)
+    try:
+        [pet], _, _ = database.get_pets_with_owners()
+        assert (pet["owner_name"], database.owners_collection.calls) == ("greg", 1)
+    finally:
+        database.owners_collection = database.owners_collection.collection
+    with pytest.raises(database.ConstraintError, match="have pets"):
+        database.delete_owner(owner_id)
+    assert database.get_counts() == {"owners": 1, "pets": 1}
+    database.close_connection()
+
+
+def test_configure_defers_setup():
+    database.configure("pytest_configure", client_factory=database.MongitaClientMemory)
+    assert database.client is None
+    assert database.get_counts() == {"owners": 0, "pets": 0}
+    assert database.client is not None
+    assert "owner_id_1" in database._index_names(database.pets_collection)
+    database.close_connection()
+
+    database.configure("pytest_configure", client_factory=database.MongitaClientMemory)
+    database.close_connection()
+    with pytest.raises(RuntimeError, match="not initialized"):
+        database.ping()
+
+
+def test_deferred_setup_retries_after_a_failure():
+    attempts = []
+
+    def flaky_client():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("storage is not ready")
+        return database.MongitaClientMemory()
+
+    database.configure("pytest_configure", client_factory=flaky_client)
+    with pytest.raises(OSError, match="not ready"):
+        database.get_counts()
+    database.create_owner({"name": "greg"})
+    assert database.get_counts() == {"owners": 1, "pets": 0}
+    assert len(attempts) == 2
+    database.close_connection()
+
+
+def test_setup_database_creates_collections():
+    database.setup_database("pytest_setup", client_factory=database.MongitaClientMemory)
+    assert database.owners_collection is not None
+    assert database.pets_collection is not None
+    assert database.owners_collection.count_documents({}) == 0
+    assert database.pets_collection.count_documents({}) == 0
+    assert "owner_id_1" in database._index_names(database.pets_collection)
+    database.close_connection()
+
+
+def test_setup_database_rebuilds_missing_index():
+    database.setup_database("pytest_setup_index", client_factory=database.MongitaClientMemory)
+    database.pets_collection.drop_index("owner_id_1")
+    assert "owner_id_1" not in database._index_names(database.pets_collection)
+    database._ensure_indexes()
+    assert "owner_id_1" in database._index_names(database.pets_collection)
+    database.close_connection()
+
+
+def test_close_connection_resets_globals():
+    database.initialize("pytest_close", client_factory=database.MongitaClientMemory)
+    database.close_connection()
+    assert database.client is None
+    assert database.db is None
+    assert database.owners_collection is None
+    assert database.pets_collection is None
+    assert database.stats_collection is None
+
+
+def test_ping():
+    database.initialize("pytest_ping", client_factory=database.MongitaClientMemory)
+    assert database.ping() is True
+    database.close_connection()
+    with pytest.raises(RuntimeError, match="not initialized"):
+        database.ping()
+
+
+def test_get_revision_changes_on_writes():
+    owner_ids = _seed_test_database()
+    pets_before = database.get_revision("pets")
+    owners_before = database.get_revision("owners")
+
+    # The new pet changes greg's pet_count, which the owners show.
+    pet_id = database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["greg"]})
+    assert database.get_revision("pets") != pets_before
+    assert database.get_revision("owners") != owners_before
+
+    pets_before = database.get_revision("pets")
+    owners_before = database.get_revision("owners")
+    database.update_owner(owner_ids["david"], {"name": "dave"})
+    assert database.get_revision("owners") != owners_before
+    assert database.get_revision("pets") == pets_before
+
+    # Renaming a pet leaves every pet_count alone.
+    owners_before = database.get_revision("owners")
+    database.update_pet(pet_id, {"name": "walt", "type": "cat", "owner_id": owner_ids["greg"]})
+    assert database.get_revision("pets") != pets_before
+    assert database.get_revision("owners") == owners_before
+
+    pets_before = database.get_revision("pets")
+    database.delete_pet(pet_id)
+    assert database.get_revision("owners") != owners_before
+    assert database.get_revision("pets") != pets_before
+
+    # A rebuild picks a new epoch, so old tokens never come back.
+    pets_before = database.get_revision("pets")
+    database.rebuild_stats()
+    assert database.get_revision("pets") != pets_before
+    with pytest.raises(ValueError, match="unknown collection"):
+        database.get_revision("stats")
+
+
+def test_check_pet_counts_repairs_drift():
+    owner_ids = _seed_test_database()
+    assert database.check_pet_counts() == {}
+
+    greg = ObjectId(owner_ids["greg"])
+    database.owners_collection.replace_one({"_id": greg}, {"name": "greg", "pet_count": 7})
+    assert database.check_pet_counts(repair=False) == {owner_ids["greg"]: (7, 3)}
+    position = database.oplog_position()
+    assert database.check_pet_counts() == {owner_ids["greg"]: (7, 3)}
+    assert database.get_owner(owner_ids["greg"])["pet_count"] == 3
+    [change] = database.changes_since(position)
+    assert (change["id"], change["fields"]) == (owner_ids["greg"], {"pet_count": 3})
+    assert database.check_pet_counts() == {}
+
+
+def test_search_ranks_names_first():
+    _seed_test_database()
+    results = database.search("d")
+    assert [(result["kind"], result["name"]) for result in results] == [
+        ("owner", "david"),
+        ("pet", "dorothy"),
+        ("pet", "casey"),
+    ]
+    assert database.search("dog dor")[0]["name"] == "dorothy"
+    assert [result["name"] for result in database.search("portland")] == ["greg"]
+    assert database.search("zebra") == []
+    assert database.search("   ") == []
+
+
+def test_search_follows_writes():
+    owner_ids = _seed_test_database()
+    database.search("warm up")
+    pet_id = database.create_pet(
+        {"name": "Walter White", "type": "cat", "owner_id": owner_ids["david"]}
+    )
+    database.create_pets([{"name": "waldo", "type": "cat", "owner_id": owner_ids["david"]}])
+    assert [result["name"] for result in database.search("wal")] == ["Walter White", "waldo"]
+
+    database.update_pet(
+        pet_id, {"name": "heisenberg", "type": "cat", "owner_id": owner_ids["david"]}
+    )
+    assert [result["name"] for result in database.search("wal")] == ["waldo"]
+    database.delete_pet(pet_id)
+    assert database.search("heisenberg") == []
+
+    owner_id = database.create_owner({"name": "solo", "city": "Akron"})
+    database.update_owner(owner_id, {"name": "solo", "city": "Kent"})
+    assert [result["id"] for result in database.search("kent")] == [owner_id]
+    database.delete_owner(owner_id)
+    assert database.search("solo") == []
+
+
+def test_search_rebuilds_after_outside_writes():
+    owner_ids = _seed_test_database()
+    assert database.search("walter") == []
+    # Written behind this module's back, as another process would.
+    database.pets_collection.insert_one(
+        {"name": "walter", "type": "cat", "age": 1, "owner_id": ObjectId(owner_ids["greg"])}
+    )
+    database._increment_counter(database.PETS_REVISION)
+    assert [result["name"] for result in database.search("walter")] == ["walter"]
+
+
+def test_oplog_records_every_write():
+    owner_ids = _seed_test_database()
+    start = database.oplog_position()
+    owner_id = database.create_owner({"name": "solo", "city": "Akron"})
+    pet_id = database.create_pet({"name": "walter", "type": "cat", "age": 2, "owner_id": owner_id})
+    database.update_pet(
+        pet_id, {"name": "walt", "type": "cat", "age": 3, "owner_id": owner_ids["greg"]}
+    )
+    database.delete_pet(pet_id)
+    database.update_owner(owner_id, {"name": "solo", "city": "Kent"})
+    database.delete_owner(owner_id)
+    database.create_pets([{"name": "a", "type": "cat", "owner_id": owner_id}, {"name": ""}])
+
+    changes = database.changes_since(start)
+    assert [change["seq"] for change in changes] == list(range(start + 1, start + 11))
+    # Each pet write is followed by the pet_count changes it caused.
+    assert [(change["collection"], change["op"], change["id"]) for change in changes] == [
+        ("owners", "insert", owner_id),
+        ("pets", "insert", pet_id),
+        ("owners", "update", owner_id),
+        ("pets", "update", pet_id),
+        ("owners", "update", owner_id),
+        ("owners", "update", owner_ids["greg"]),
+        ("pets", "delete", pet_id),
+        ("owners", "update", owner_ids["greg"]),
+        ("owners", "update", owner_id),
+        ("owners", "delete", owner_id),
+    ]
+    assert changes[1]["fields"] == {"name": "walter", "type": "cat", "age": 2, "owner_id": owner_id}
+    assert [changes[i]["fields"] for i in (2, 4, 5, 7)] == [
+        {"pet_count": 1},
+        {"pet_count": 0},
+        {"pet_count": 4},
+        {"pet_count": 3},
+    ]
+    assert changes[3]["fields"]["owner_id"] == owner_ids["greg"]
+    assert "fields" not in changes[6]
+    assert changes[8]["fields"]["city"] == "Kent"
+    assert database.oplog_position() == start + 10
+
+    # Tailing picks up where the last call stopped.
+    changes = database.changes_since(start, limit=2)
+    assert [change["seq"] for change in changes] == [start + 1, start + 2]
+    assert database.changes_since(database.oplog_position()) == []
+
+
+def test_oplog_compaction():
+    owner_ids = _seed_test_database()
+    for i in range(5):
+        database.create_pet({"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]})
+    last = database.oplog_position()
+    assert database.compact_oplog(keep=2) == last - 2
+    assert [change["seq"] for change in database.changes_since(last - 2)] == [last - 1, last]
+    with pytest.raises(database.OplogTruncatedError):
+        database.changes_since(last - 3)
+    assert database.oplog_collection.count_documents({}) == 2
+
+    # Sequence numbers outlive a counter rebuild.
+    database.rebuild_stats()
+    assert database.oplog_position() == last
+    database.create_owner({"name": "next"})
+    assert database.changes_since(last)[0]["seq"] == last + 1
+
+
+def test_oplog_with_write_batching():
+    owner_ids = _seed_test_database("pytest_batch")
+    start = database.oplog_position()
+    database.enable_write_batching(max_batch=3, max_delay=60)
+    database.stats_collection = _CountingCollection(database.stats_collection)
+    try:
+        for i in range(5):
+            database.create_pet({"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]})
+        # Sequence numbers come from memory: the counters are read once per
+        # batch (two batches here) and read and replaced once by the flush.
+        assert database.stats_collection.calls == 4
+        database.stats_collection = database.stats_collection.collection
+        changes = database.changes_since(start)
+    finally:
+        if isinstance(database.stats_collection, _CountingCollection):
+            database.stats_collection = database.stats_collection.collection
+        database.disable_write_batching()
+    assert [change["seq"] for change in changes] == list(range(start + 1, start + len(changes) + 1))
+    pets = [change["fields"]["name"] for change in changes if change["collection"] == "pets"]
+    assert pets == [f"pet{i}" for i in range(5)]
+    # pet_count is logged once per flushed batch, not once per pet.
+    pet_counts = [change["fields"] for change in changes if change["collection"] == "owners"]
+    assert len(pet_counts) == 2
+    assert pet_counts[-1] == {"pet_count": 8}
+
+
+def test_oplog_compacts_itself():
+    owner_ids = _seed_test_database()
+    database.OPLOG_RETENTION, database.OPLOG_COMPACT_EVERY = 3, 2
+    try:
+        for i in range(10):
+            database.create_pet({"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]})
+    finally:
+        database.OPLOG_RETENTION, database.OPLOG_COMPACT_EVERY = 10000, 1000
+    assert database.oplog_collection.count_documents({}) <= 3 + 2
+    changes = database.changes_since(database.oplog_position() - 3)
+    assert changes[-1]["fields"] == {"pet_count": 13}
+    assert changes[-2]["fields"]["name"] == "pet9"
+
+
+def test_id_filters_skip_missing_ids():
+    owner_ids = _seed_test_database()
+    missing = "67d8c61b5180a31695e907ff"
+    database.get_id_filter_stats()  # Builds the filters before counting.
+    database.owners_collection = _CountingCollection(database.owners_collection)
+    database.pets_collection = _CountingCollection(database.pets_collection)
+    try:
+        assert database.get_pet(missing) is None
+        assert database.get_owner(missing) is None
+        with pytest.raises(database.NotFoundError, match="pet not found"):
+            database.delete_pet(missing)
+        with pytest.raises(database.NotFoundError, match="owner not found"):
+            database.update_owner(missing, {"name": "missing"})
+        with pytest.raises(database.ConstraintError, match="existing owner"):
+            database.create_pet({"name": "orphan", "type": "cat", "owner_id": missing})
+        _, errors = database.create_pets([{"name": "orphan", "type": "cat", "owner_id": missing}])
+        assert errors == [(0, "owner_id does not reference an existing owner.")]
+        assert database.pets_collection.calls == 0
+        assert database.owners_collection.calls == 0
+    finally:
+        database.owners_collection = database.owners_collection.collection
+        database.pets_collection = database.pets_collection.collection
+    assert database.get_owner(owner_ids["greg"])["name"] == "greg"
+    stats = database.get_id_filter_stats()
+    assert stats["pets"]["ids"] == 4
+    assert stats["owners"]["rejected"] == 4
+    assert stats["owners"]["observed_false_positive_rate"] == 0
+
+
+def test_find_by_id_never_flushes_under_the_read_lock():
+    owner_ids = _seed_test_database("pytest_batch")
+    pet_id = database.get_pets_by_owner(owner_ids["greg"])[0]["id"]
+    database.enable_write_batching(max_batch=10, max_delay=60)
+    flush_batch = database._flush_batch
+
+    def flush_under_read_lock():
+        raise AssertionError("flushed while only holding the read lock")
+
+    try:
+        database.create_pet({"name": "queued", "type": "cat", "owner_id": owner_ids["greg"]})
+        # A reader that already holds the read lock skips the flush in
+        # _reads, so the lookup itself must not flush either.
+        database._flush_batch = flush_under_read_lock
+        database._client_lock.acquire_read()
+        try:
+            assert database.get_pet(pet_id)["id"] == pet_id
+            assert database.get_owner(owner_ids["greg"])["name"] == "greg"
+        finally:
+            database._client_lock.release_read()
+            database._flush_batch = flush_batch
+    finally:
+        database.disable_write_batching()
+    assert database.get_counts()["pets"] == 5
+
+
+def test_id_filters_follow_writes_and_rebuild():
+    owner_ids = _seed_test_database()
+    pet_id = database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["david"]})
+    assert database.get_pet(pet_id)["name"] == "walter"
+    database.delete_pet(pet_id)
+    # The deleted id is still in the filter, so its lookup reaches the client.
+    assert database.get_pet(pet_id) is None
+    assert database.get_id_filter_stats()["pets"]["false_positives"] == 1
+    assert database.rebuild_id_filters()["pets"]["ids"] == 4
+    assert database.get_pet(pet_id) is None
+    assert database.get_id_filter_stats()["pets"]["rejected"] == 1
+
+    old_capacity = database.ID_FILTER_MIN_CAPACITY
+    database.ID_FILTER_MIN_CAPACITY = 4
+    try:
+        database.rebuild_id_filters()
+        owner_id = database.create_owner({"name": "solo"})
+        database.delete_owner(owner_id)
+        # 1 delete reaches a quarter of the capacity, so the filter rebuilt.
+        stats = database.get_id_filter_stats()["owners"]
+        assert (stats["ids"], stats["deletes_since_build"]) == (2, 0)
+        inserted_ids, _ = database.create_owners({"name": f"owner{i}"} for i in range(10))
+        # Overfilled, so rebuilt with room for twice as many owners.
+        assert database.get_id_filter_stats()["owners"]["capacity"] == 24
+        assert all(database.get_owner(id) is not None for id in inserted_ids)
+    finally:
+        database.ID_FILTER_MIN_CAPACITY = old_capacity
+
+
+def test_setup_after_a_restore_reads_no_documents():
+    _seed_test_database()
+    _seed_test_database()
+    copied = {name for name, documents in database.client.engine._cache.items() if documents}
+    assert copied == {"pytest_seed.stats"}
+    assert database._id_filters == {}
+    assert database.get_id_filter_stats()["pets"]["ids"] == database.pets_collection.count_documents({})
+
+
+def test_id_filters_rebuild_after_outside_writes():
+    owner_ids = _seed_test_database()
+    database.get_id_filter_stats()
+    pets_filter = database._id_filters["pets"]
+    # Writes through this module keep the filter current without a rebuild.
+    pet_id = database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["greg"]})
+    database.update_owner(owner_ids["greg"], {"name": "greg"})
+    assert database.get_pet(str(ObjectId())) is None
+    assert database.get_owner(str(ObjectId())) is None
+    assert database._id_filters["pets"] is pets_filter
+    assert database.get_pet(pet_id)["name"] == "walter"
+
+    # Written behind this module's back, as another process would.
+    result = database.pets_collection.insert_one(
+        {"name": "rex", "type": "dog", "age": 1, "owner_id": ObjectId(owner_ids["greg"])}
+    )
+    database._increment_counter(database.PETS_REVISION)
+    assert database.get_pet(str(result.inserted_id))["name"] == "rex"
+    assert database._id_filters["pets"] is not pets_filter
+
+
+def test_owner_cache_drops_owners_deleted_elsewhere():
+    owner_ids = _seed_test_database()
+    gone, missed = (database.create_owner({"name": name}) for name in ("gone", "missed"))
+    for owner_id in (gone, missed):
+        database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_id})
+        database.delete_pet(database.get_pets_by_owner(owner_id)[0]["id"])
+
+    # Deleted behind this module's back, as another process would.
+    database.owners_collection.delete_one({"_id": ObjectId(gone)})
+    database._increment_counter(database.OWNERS_REVISION)
+    with pytest.raises(database.ConstraintError, match="existing owner"):
+        database.create_pet({"name": "walter", "type": "cat", "owner_id": gone})
+
+    # Without a revision bump, a lookup that misses still evicts the owner.
+    database.owners_collection.delete_one({"_id": ObjectId(missed)})
+    assert database.get_owner(missed) is None
+    with pytest.raises(database.ConstraintError, match="existing owner"):
+        database.create_pet({"name": "walter", "type": "cat", "owner_id": missed})
+    assert database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["greg"]})
+
+
+def test_pet_to_dict():
+    sample = {
+        "_id": ObjectId("67d8c61b5180a31695e90744"),
+        "name": "meercat",
+        "type": "mammal",
+        "age": 2,
+        "owner_id": ObjectId("67d8c61b5180a31695e90745"),
+    }
+    converted = database.pet_to_dict(sample)
+    assert converted["id"] == "67d8c61b5180a31695e90744"
+    assert converted["owner_id"] == "67d8c61b5180a31695e90745"
+    assert converted["name"] == "meercat"
+    assert converted["type"] == "mammal"
+    assert converted["age"] == 2
+
+
+def test_pet_filter():
+    assert database.pet_filter() == {}
+    assert database.pet_filter(type="", min_age="") == {}
+    assert database.pet_filter(type="dog", min_age="2", max_age=9) == {
+        "type": "dog",
+        "age": {"$gte": 2, "$lte": 9},
+    }
+    owner_id = "67d8c61b5180a31695e90746"
+    assert database.pet_filter(owner_id=owner_id) == {"owner_id": ObjectId(owner_id)}
+    with pytest.raises(ValueError, match="min_age"):
+        database.pet_filter(min_age="old")
+    with pytest.raises(ValueError, match="owner_id"):
+        database.pet_filter(owner_id="nope")
+
+
+def test_make_converter():
+    sample = {
+        "_id": ObjectId("67d8c61b5180a31695e90746"),
+        "name": "greg",
+        "city": "Portland",
+    }
+    convert = database._make_converter(database._OWNER_FIELD_READERS, ["id", "name"])
+    assert convert(sample) == {"id": "67d8c61b5180a31695e90746", "name": "greg"}
+    with pytest.raises(ValueError, match="unknown field"):
+        database._make_converter(database._OWNER_FIELD_READERS, ["id", "password"])
+
+
+def test_owner_to_dict():
+    sample = {
+        "_id": ObjectId("67d8c61b5180a31695e90746"),
+        "name": "greg",
+        "city": "Portland",
+        "type_of_home": "condo",
+    }
+    converted = database.owner_to_dict(sample)
+    assert converted["id"] == "67d8c61b5180a31695e90746"
+    assert converted["name"] == "greg"
+    assert converted["city"] == "Portland"
+    assert converted["type_of_home"] == "condo"
+
+
+def test_get_pets():
+    owner_ids = _seed_test_database()
+    pets = database.get_pets()
+    assert type(pets) is list
+    assert len(pets) >= 1
+    assert type(pets[0]) is dict
+    for key in ["id", "name", "type", "age", "owner_id"]:
+        assert key in pets[0]
+    assert type(pets[0]["id"]) is str
+    assert type(pets[0]["owner_id"]) is str
+    assert pets[0]["owner_id"] in owner_ids.values()
+
+
+def test_get_pets_page():
+    _seed_test_database()
+    all_ids = sorted(pet["id"] for pet in database.get_pets())
+
+    pets, next_after, prev_before = database.get_pets_page(limit=3)
+    assert [pet["id"] for pet in pets] == all_ids[:3]
+    assert next_after == all_ids[2]
+    assert prev_before is None
+
+    pets, next_after, prev_before = database.get_pets_page(after=next_after, limit=3)
+    assert [pet["id"] for pet in pets] == all_ids[3:]
+    assert next_after is None
+    assert prev_before == all_ids[3]
+
+    pets, next_after, prev_before = database.get_pets_page(before=prev_before, limit=3)
+    assert [pet["id"] for pet in pets] == all_ids[:3]
+    assert next_after == all_ids[2]
+    assert prev_before is None
+
+
+def test_get_pets_page_validates_arguments():
+    _seed_test_database()
+    with pytest.raises(ValueError, match="limit"):
+        database.get_pets_page(limit="0")
+    with pytest.raises(ValueError, match="limit"):
+        database.get_pets_page(limit="lots")
+    with pytest.raises(ValueError, match="ObjectId"):
+        database.get_pets_page(after="not-an-id")
+
+
+def test_get_pets_page_seeks_instead_of_sorting():
+    owner_ids = _seed_test_database()
+    new_ids = [
+        database.create_pet({"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]})
+        for i in range(3)
+    ]
+    database.delete_pet(new_ids[1])
+    all_ids = sorted(pet["id"] for pet in database.get_pets())
+
+    class _NoFind(_CountingCollection):
+        def __getattr__(self, name):
+            assert name != "find", "a page should not sort the collection"
+            return super().__getattr__(name)
+
+    database.pets_collection = _NoFind(database.pets_collection)
+    try:
+        seen, after = [], None
+        while True:
+            pets, after, prev_before = database.get_pets_page(after=after, limit=2)
+            seen.extend(pet["id"] for pet in pets)
+            if after is None:
+                break
+        assert seen == all_ids
+
+        pets, _, _ = database.get_pets_page(before=prev_before, limit=2)
+        assert [pet["id"] for pet in pets] == all_ids[-4:-2]
+    finally:
+        database.pets_collection = database.pets_collection.collection
+
+
+def test_get_pets_with_owners():
+    owner_ids = _seed_test_database()
+    names = {id: name for name, id in owner_ids.items()}
+    database.get_id_filter_stats()  # Builds the filters before counting.
+    database.owners_collection = _CountingCollection(database.owners_collection)
+    try:
+        pets, next_after, _ = database.get_pets_with_owners(limit=3)
+        first_calls = len({pet["owner_id"] for pet in pets})
+        assert database.owners_collection.calls == first_calls
+        assert len(pets) == 3
+        for pet in pets:
+            assert pet["owner_name"] == names[pet["owner_id"]]
+
+        pets, _, _ = database.get_pets_with_owners(after=next_after, limit=3)
+        assert database.owners_collection.calls == first_calls + 1
+        assert [pet["owner_name"] for pet in pets] == [names[pets[0]["owner_id"]]]
+    finally:
+        database.owners_collection = database.owners_collection.collection
+
+
+def test_iter_pets():
+    owner_ids = _seed_test_database()
+    dogs = list(database.iter_pets(database.pet_filter(type="dog")))
+    assert sorted(pet["name"] for pet in dogs) == ["casey", "dorothy"]
+    older = list(database.iter_pets(database.pet_filter(min_age=10)))
+    assert [pet["name"] for pet in older] == ["heidi"]
+    gregs = list(database.iter_pets(database.pet_filter(owner_id=owner_ids["greg"], max_age=9)))
+    assert len(gregs) == 3
+    assert len(list(database.iter_pets())) == 4
+
+
+def test_iter_pets_does_not_hold_the_lock_between_chunks():
+    owner_ids = _seed_test_database()
+    stream = database.iter_pets(chunk_size=2)
+    first = next(stream)
+    assert not database._client_lock.held()
+    # Writers are free to run while the consumer is between chunks.
+    database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["david"]})
+    rest = list(stream)
+    assert len(rest) >= 3
+    assert first["id"] not in [pet["id"] for pet in rest]
+
+
+def test_iter_pets_stops_when_closed():
+    _seed_test_database()
+    stream = database.iter_pets(chunk_size=2)
+    next(stream)
+    next(stream)
+    database.close_connection()
+    with pytest.raises(RuntimeError, match="closed while streaming"):
+        next(stream)
+
+
+def test_get_counts_tracks_writes():
+    owner_ids = _seed_test_database()
+    assert database.get_counts() == {"owners": 2, "pets": 4}
+
+    owner_id = database.create_owner({"name": "solo"})
+    pet_id = database.create_pet({"name": "onepet", "age": 3, "type": "cat", "owner_id": owner_id})
+    database.create_pets(
+        [{"name": "two", "type": "cat", "owner_id": owner_ids["greg"]}, {"name": ""}]
+    )
+    assert database.get_counts() == {"owners": 3, "pets": 6}
+
+    database.delete_pet(pet_id)
+    database.delete_owner(owner_id)
+    assert database.get_counts() == {"owners": 2, "pets": 5}
+    assert database.get_counts()["pets"] == database.pets_collection.count_documents({})
+
+
+def test_counters_rebuilt_when_missing():
+    _seed_test_database()
+    database.stats_collection.delete_many({})
+    database._ensure_counters()
+    assert database.get_counts() == {"owners": 2, "pets": 4}
+
+
+def test_get_stats_tracks_writes():
+    owner_ids = _seed_test_database()
+    assert database.get_stats() == {
+        "owners": 2,
+        "pets": 4,
+        "pets_by_type": {"dog": 2, "mouse": 1, "cat": 1},
+        "pets_by_owner": {owner_ids["greg"]: 3, owner_ids["david"]: 1},
+    }
+
+    heidi = database.get_pets_by_owner(owner_ids["david"])[0]
+    database.update_pet(
+        heidi["id"], {"name": "heidi", "type": "dog", "owner_id": owner_ids["greg"]}
+    )
+    mouse = [pet for pet in database.get_pets() if pet["type"] == "mouse"][0]
+    database.delete_pet(mouse["id"])
+    database.create_pets([{"name": "nemo", "type": "fish", "owner_id": owner_ids["david"]}])
+
+    stats = database.get_stats()
+    assert stats["pets"] == 4
+    assert stats["pets_by_type"] == {"dog": 3, "fish": 1}
+    assert stats["pets_by_owner"] == {owner_ids["greg"]: 3, owner_ids["david"]: 1}
+    assert database.rebuild_stats() == {}
+
+
+def test_rebuild_stats_reports_and_repairs_drift():
+    owner_ids = _seed_test_database()
+    database._increment_counter(database.TYPE_COUNTER_PREFIX + "dog", 5)
+    david = ObjectId(owner_ids["david"])
+    database.owners_collection.replace_one({"_id": david}, {"name": "david", "pet_count": 0})
+
+    drift = database.rebuild_stats()
+    assert drift == {
+        database.TYPE_COUNTER_PREFIX + "dog": (7, 2),
+        database.OWNER_COUNTER_PREFIX + owner_ids["david"]: (0, 1),
+    }
+    assert database.get_stats()["pets_by_type"]["dog"] == 2
+    assert database.get_stats()["pets_by_owner"][owner_ids["david"]] == 1
+    assert database.rebuild_stats() == {}
+
+
+def test_counters_upgrade_keeps_oplog_positions():
+    _seed_test_database()
+    position = database.oplog_position()
+    # Before STATS_VERSION 5 each counter was its own document.
+    database.stats_collection.delete_many({})
+    database.stats_collection.insert_many(
+        [{"_id": "version", "count": 4}, {"_id": database.OPLOG_SEQ, "count": position}]
+    )
+    database._ensure_counters()
+    assert database.oplog_position() == position
+    assert database.stats_collection.count_documents({}) == 1
+    assert database.get_counts() == {"owners": 2, "pets": 4}
+
+
+def test_get_pets_by_owner():
+    owner_ids = _seed_test_database()
+    pets = database.get_pets_by_owner(owner_ids["greg"])
+    assert sorted(pet["name"] for pet in pets) == ["casey", "dorothy", "suzy"]
+    assert all(pet["owner_id"] == owner_ids["greg"] for pet in pets)
+    assert [pet["name"] for pet in database.get_pets_by_owner(owner_ids["david"])] == ["heidi"]
+
+
+def test_get_pets_by_owner_follows_updates():
+    owner_ids = _seed_test_database()
+    pet = database.get_pets_by_owner(owner_ids["david"])[0]
+    database.update_pet(
+        pet["id"], {"name": "heidi", "age": 15, "type": "cat", "owner_id": owner_ids["greg"]}
+    )
+    assert database.get_pets_by_owner(owner_ids["david"]) == []
+    assert len(database.get_pets_by_owner(owner_ids["greg"])) == 4
+    database.delete_pet(pet["id"])
+    assert len(database.get_pets_by_owner(owner_ids["greg"])) == 3
+
+
+def test_get_pet():
+    owner_ids = _seed_test_database()
+    pet = database.get_pets()[0]
+    fetched = database.get_pet(pet["id"])
+    assert fetched is not None
+    assert fetched["id"] == pet["id"]
+    assert fetched["owner_id"] in owner_ids.values()
+
+
+def test_get_pet_missing_returns_none():
+    _seed_test_database()
+    assert database.get_pet("67d8c61b5180a31695e907ff") is None
+
+
+def test_create_pet_and_get_pet():
+    owner_ids = _seed_test_database()
+    new_id = database.create_pet(
+        {
+            "name": "walter",
+            "age": "2",
+            "type": "mouse",
+            "owner_id": owner_ids["greg"],
+        }
+    )
+    assert type(new_id) is str
+    pet = database.get_pet(new_id)
+    assert pet is not None
+    assert pet["id"] == new_id
+    assert pet["name"] == "walter"
+    assert pet["age"] == 2
+    assert pet["type"] == "mouse"
+    assert pet["owner_id"] == owner_ids["greg"]
+
+
+def test_create_pet_requires_name():
+    owner_ids = _seed_test_database()
+    with pytest.raises(ValueError, match="name is required"):
+        database.create_pet(
+            {
+                "name": "",
+                "age": 1,
+                "type": "cat",
+                "owner_id": owner_ids["greg"],
+            }
+        )
+
+
+def test_create_pet_requires_type():
+    owner_ids = _seed_test_database()
+    with pytest.raises(ValueError, match="type is required"):
+        database.create_pet(
+            {
+                "name": "no-type",
+                "age": 1,
+                "type": "",
+                "owner_id": owner_ids["greg"],
+            }
+        )
+
+
+def test_create_pet_requires_owner():
+    _seed_test_database()
+    with pytest.raises(ValueError, match="owner_id is required"):
+        database.create_pet({"name": "ghost", "age": 1, "type": "cat", "owner_id": ""})
+
+
+def test_create_pet_rejects_unknown_owner():
+    _seed_test_database()
+    with pytest.raises(database.ConstraintError, match="owner_id"):
+        database.create_pet(
+            {
+                "name": "ghost",
+                "age": 1,
+                "type": "cat",
+                "owner_id": "000000000000000000000000",
+            }
+        )
+
+
+def test_create_pets():
+    owner_ids = _seed_test_database()
+    rows = [
+        {"name": f"pet{i}", "age": str(i), "type": "fish", "owner_id": owner_ids["david"]}
+        for i in range(5)
+    ]
+    inserted_ids, errors = database.create_pets(rows, chunk_size=2)
+    assert errors == []
+    assert len(inserted_ids) == 5
+    for i, new_id in enumerate(inserted_ids):
+        pet = database.get_pet(new_id)
+        assert pet["name"] == f"pet{i}"
+        assert pet["age"] == i
+        assert pet["owner_id"] == owner_ids["david"]
+
+
+def test_create_pets_reports_bad_rows():
+    owner_ids = _seed_test_database()
+    rows = [
+        {"name": "good", "age": 1, "type": "cat", "owner_id": owner_ids["greg"]},
+        {"name": "", "age": 1, "type": "cat", "owner_id": owner_ids["greg"]},
+        {"name": "ghost", "age": 1, "type": "cat", "owner_id": "000000000000000000000000"},
+        {"name": "bad-id", "age": 1, "type": "cat", "owner_id": "nope"},
+        {"name": "also-good", "age": 2, "type": "dog", "owner_id": owner_ids["david"]},
+    ]
+    inserted_ids, errors = database.create_pets(rows, chunk_size=3)
+    assert inserted_ids[1:4] == [None, None, None]
+    assert database.get_pet(inserted_ids[0])["name"] == "good"
+    assert database.get_pet(inserted_ids[4])["name"] == "also-good"
+    assert [index for index, _ in errors] == [1, 2, 3]
+    assert "name is required" in errors[0][1]
+    assert "existing owner" in errors[1][1]
+    assert "ObjectId" in errors[2][1]
+
+
+def test_create_pets_reports_rows_of_any_shape():
+    owner_ids = _seed_test_database()
+    rows = [
+        {"name": 5, "age": 1, "type": "cat", "owner_id": owner_ids["greg"]},
+        {"name": "numeric-owner", "type": "cat", "owner_id": 12345},
+        None,
+        {"name": "oid-owner", "type": "dog", "owner_id": ObjectId(owner_ids["david"])},
+    ]
+    inserted_ids, errors = database.create_pets(rows, chunk_size=2)
+    assert database.get_pet(inserted_ids[0])["name"] == "5"
+    assert database.get_pet(inserted_ids[3])["owner_id"] == owner_ids["david"]
+    assert [index for index, _ in errors] == [1, 2]
+    assert "ObjectId" in errors[0][1]
+    assert database.get_counts()["pets"] == 6
+
+
+def test_create_pets_counts_chunks_written_before_a_failure():
+    owner_ids = _seed_test_database()
+    real_insert_many = database.pets_collection.insert_many
+    calls = []
+
+    def failing_insert_many(documents, *args, **kwargs):
+        calls.append(len(documents))
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return real_insert_many(documents, *args, **kwargs)
+
+    database.pets_collection.insert_many = failing_insert_many
+    try:
+        rows = [{"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]} for i in range(4)]
+        with pytest.raises(OSError, match="disk full"):
+            database.create_pets(rows, chunk_size=2)
+    finally:
+        del database.pets_collection.insert_many
+    assert database.get_counts()["pets"] == 6
+    assert database.get_owner(owner_ids["greg"])["pet_count"] == 5
+    assert database.check_pet_counts(repair=False) == {}
+
+
+def test_create_pets_keeps_cached_owners_the_chunk_relies_on():
+    owner_ids = _seed_test_database()
+    original_size = database.OWNER_CACHE_SIZE
+    database.OWNER_CACHE_SIZE = 2
+    try:
+        new_ids = [database.create_owner({"name": name}) for name in ("a", "b", "c")]
+        # The cache now holds b and c; looking up greg and david evicts both.
+        rows = [
+            {"name": f"pet{i}", "type": "cat", "owner_id": owner_id}
+            for i, owner_id in enumerate([new_ids[2], owner_ids["greg"], owner_ids["david"]])
+        ]
+        inserted_ids, errors = database.create_pets(rows)
+    finally:
+        database.OWNER_CACHE_SIZE = original_size
+    assert errors == []
+    assert None not in inserted_ids
+
+
+def test_invalid_pet_id_rejected():
+    _seed_test_database()
+    with pytest.raises(ValueError, match="ObjectId"):
+        database.get_pet("not-an-object-id")
+
+
+def test_update_pet():
+    owner_ids = _seed_test_database()
+    pet = database.get_pets()[0]
+    database.update_pet(
+        pet["id"],
+        {"name": "updated", "age": "8", "type": "dog", "owner_id": owner_ids["david"]},
+    )
+    updated = database.get_pet(pet["id"])
+    assert updated is not None
+    assert updated["name"] == "updated"
+    assert updated["age"] == 8
+    assert updated["type"] == "dog"
+    assert updated["owner_id"] == owner_ids["david"]
+
+
+def test_pet_writes_use_the_owner_cache():
+    owner_ids = _seed_test_database()
+    pet_id = database.create_pet({"name": "walter", "type": "cat", "owner_id": owner_ids["greg"]})
+    database.get_id_filter_stats()  # Builds the filters before counting.
+    database.owners_collection = _CountingCollection(database.owners_collection)
+    database.pets_collection = _CountingCollection(database.pets_collection)
+    try:
+        database.update_pet(pet_id, {"name": "walt", "type": "cat", "owner_id": owner_ids["greg"]})
+        database.create_pet({"name": "jesse", "type": "cat", "owner_id": owner_ids["greg"]})
+        # update_pet: find_one + replace_one; create_pet: insert_one.
+        assert database.pets_collection.calls == 3
+        # No existence checks, only create_pet's pet_count find_one + replace_one.
+        assert database.owners_collection.calls == 2
+    finally:
+        database.owners_collection = database.owners_collection.collection
+        database.pets_collection = database.pets_collection.collection
+
+
+def test_deleted_owner_leaves_the_cache():
+    _seed_test_database()
+    owner_id = database.create_owner({"name": "solo"})
+    database.delete_owner(owner_id)
+    with pytest.raises(database.ConstraintError, match="existing owner"):
+        database.create_pet({"name": "orphan", "type": "cat", "owner_id": owner_id})
+
+
+def test_update_pet_rejects_missing_pet():
+    owner_ids = _seed_test_database()
+    with pytest.raises(database.NotFoundError, match="pet not found"):
+        database.update_pet(
+            "67d8c61b5180a31695e907ff",
+            {"name": "updated", "age": 8, "type": "dog", "owner_id": owner_ids["greg"]},
+        )
+
+
+def test_delete_pet():
+    owner_ids = _seed_test_database()
+    new_id = database.create_pet(
+        {"name": "delete_me", "age": 3, "type": "fish", "owner_id": owner_ids["greg"]}
+    )
+    database.delete_pet(new_id)
+    assert database.get_pet(new_id) is None
+
+
+def test_delete_missing_pet_raises_not_found():
+    _seed_test_database()
+    with pytest.raises(database.NotFoundError, match="pet not found"):
+        database.delete_pet("000000000000000000000000")
+
+
+def test_get_owners():
+    _seed_test_database()
+    owners = database.get_owners()
+    assert type(owners) is list
+    assert len(owners) == 2
+    assert type(owners[0]) is dict
+    for key in ["id", "name", "city", "type_of_home"]:
+        assert key in owners[0]
+
+
+def test_get_owners_with_fields():
+    owner_ids = _seed_test_database()
+    owners = database.get_owners(fields=["id", "name"])
+    assert sorted(owners, key=lambda owner: owner["name"]) == [
+        {"id": owner_ids["david"], "name": "david"},
+        {"id": owner_ids["greg"], "name": "greg"},
+    ]
+
+
+def test_get_owners_page():
+    _seed_test_database()
+    all_ids = sorted(owner["id"] for owner in database.get_owners())
+
+    owners, next_after, prev_before = database.get_owners_page(limit=1)
+    assert [owner["id"] for owner in owners] == all_ids[:1]
+    assert next_after == all_ids[0]
+    assert prev_before is None
+
+    owners, next_after, prev_before = database.get_owners_page(after=next_after, limit=1)
+    assert [owner["id"] for owner in owners] == all_ids[1:]
+    assert next_after is None
+    assert prev_before == all_ids[1]
+
+
+def test_get_owner():
+    owner_ids = _seed_test_database()
+    owner = database.get_owner(owner_ids["greg"])
+    assert owner is not None
+    assert owner["id"] == owner_ids["greg"]
+    assert owner["name"] == "greg"
+    assert owner["city"] == "Portland"
+
+
+def test_get_owner_missing_returns_none():
+    _seed_test_database()
+    assert database.get_owner("67d8c61b5180a31695e907ff") is None
+
+
+def test_iter_owners():
+    _seed_test_database()
+    owners = list(database.iter_owners(database.owner_filter(city="Seattle", name="")))
+    assert [owner["name"] for owner in owners] == ["david"]
+    assert len(list(database.iter_owners())) == 2
+
+
+def test_create_owner_and_get_owner():
+    _seed_test_database()
+    new_id = database.create_owner({"name": "solo", "city": "Akron", "type_of_home": "house"})
+    assert type(new_id) is str
+    owner = database.get_owner(new_id)
+    assert owner is not None
+    assert owner["id"] == new_id
+    assert owner["name"] == "solo"
+    assert owner["city"] == "Akron"
+    assert owner["type_of_home"] == "house"
+
+
+def test_create_owner_requires_name():
+    _seed_test_database()
+    with pytest.raises(ValueError, match="name is required"):
+        database.create_owner({"name": "", "city": "Akron", "type_of_home": "house"})
+
+
+def test_create_owners():
+    _seed_test_database()
+    rows = [
+        {"name": "ann", "city": "Akron", "type_of_home": "house"},
+        {"name": " ", "city": "Kent"},
+        {"name": "bob"},
+    ]
+    inserted_ids, errors = database.create_owners(rows, chunk_size=2)
+    assert inserted_ids[1] is None
+    assert errors == [(1, "name is required.")]
+    assert database.get_owner(inserted_ids[0])["city"] == "Akron"
+    assert database.get_owner(inserted_ids[2])["city"] is None
+    assert len(database.get_owners()) == 4
+
+
+def test_update_owner():
+    owner_ids = _seed_test_database()
+    database.get_id_filter_stats()  # Builds the filters before counting.
+    database.owners_collection = _CountingCollection(database.owners_collection)
+    try:
+        database.update_owner(
+            owner_ids["greg"],
+            {"name": "gregory", "city": "Salem", "type_of_home": "cabin"},
+        )
+        # One find_one and one replace_one by _id, never a scanning update_one.
+        assert database.owners_collection.calls == 2
+    finally:
+        database.owners_collection = database.owners_collection.collection
+    updated = database.get_owner(owner_ids["greg"])
+    assert updated is not None
+    assert updated["name"] == "gregory"
+    assert updated["city"] == "Salem"
+    assert updated["type_of_home"] == "cabin"
+    assert updated["pet_count"] == 3
+
+
+def test_update_owner_rejects_missing_owner_when_batching():
+    _seed_test_database("pytest_batch")
+    database.enable_write_batching(max_batch=10, max_delay=60)
+    try:
+        with pytest.raises(database.NotFoundError, match="owner not found"):
+            database.update_owner("67d8c61b5180a31695e907ff", {"name": "missing"})
+    finally:
+        database.disable_write_batching()
+
+
+def test_delete_owner_sees_batched_pet_counts():
+    _seed_test_database("pytest_batch")
+    owner_id = database.create_owner({"name": "new"})
+    database.enable_write_batching(max_batch=10, max_delay=60)
+    try:
+        database.create_pets([{"name": "walter", "type": "cat", "owner_id": owner_id}])
+        with pytest.raises(database.ConstraintError, match="have pets"):
+            database.delete_owner(owner_id)
+    finally:
+        database.disable_write_batching()
+    assert database.get_owner(owner_id)["pet_count"] == 1
+
+
+def test_update_owner_rejects_missing_owner():
+    _seed_test_database()
+    with pytest.raises(database.NotFoundError, match="owner not found"):
+        database.update_owner(
+            "67d8c61b5180a31695e907ff",
+            {"name": "missing", "city": "Nowhere", "type_of_home": "house"},
+        )
+
+
+class _DeletedAfterLookup(_CountingCollection):
+    """Deletes a document just before it is written, as another process could."""
+
+    def __init__(self, collection, object_id):
+        super().__init__(collection)
+        self.object_id = ObjectId(object_id)
+
+    def __getattr__(self, name):
+        if name in ("replace_one", "delete_one"):
+            self.collection.delete_one({"_id": self.object_id})
+        return super().__getattr__(name)
+
+
+def test_writes_detect_documents_deleted_after_their_lookup():
+    owner_ids = _seed_test_database()
+    pet_id = database.get_pets_by_owner(owner_ids["greg"])[0]["id"]
+    counts = database.get_counts()
+    position = database.oplog_position()
+    database.pets_collection = _DeletedAfterLookup(database.pets_collection, pet_id)
+    try:
+        with pytest.raises(database.NotFoundError, match="pet not found"):
+            database.delete_pet(pet_id)
+    finally:
+        database.pets_collection = database.pets_collection.collection
+    database.owners_collection = _DeletedAfterLookup(database.owners_collection, owner_ids["david"])
+    try:
+        with pytest.raises(database.NotFoundError, match="owner not found"):
+            database.update_owner(owner_ids["david"], {"name": "dave"})
+    finally:
+        database.owners_collection = database.owners_collection.collection
+    assert database.get_counts() == counts
+    assert database.oplog_position() == position
+
+
+def test_delete_owner_restricted():
+    owner_ids = _seed_test_database()
+    with pytest.raises(database.ConstraintError, match="have pets"):
+        database.delete_owner(owner_ids["greg"])
+
+
+def test_delete_owner_then_pet_succeeds():
+    _seed_test_database()
+    owner_id = database.create_owner({"name": "solo", "city": "Akron", "type_of_home": "house"})
+    pet_id = database.create_pet(
+        {"name": "onepet", "age": 3, "type": "cat", "owner_id": owner_id}
+    )
+
+    with pytest.raises(database.ConstraintError):
+        database.delete_owner(owner_id)
+
+    database.delete_pet(pet_id)
+    database.delete_owner(owner_id)
+    assert database.get_owner(owner_id) is None
+
+
+def test_pet_count_follows_pet_writes():
+    owner_ids = _seed_test_database()
+    assert database.get_owner(owner_ids["greg"])["pet_count"] == 3
+    assert database.get_owner(owner_ids["david"])["pet_count"] == 1
+
+    solo = database.create_owner({"name": "solo"})
+    assert database.get_owner(solo)["pet_count"] == 0
+    pet_id = database.create_pet({"name": "onepet", "type": "cat", "owner_id": solo})
+    database.create_pets([{"name": "twopet", "type": "cat", "owner_id": solo}])
+    assert database.get_owner(solo)["pet_count"] == 2
+
+    database.update_pet(pet_id, {"name": "moved", "type": "cat", "owner_id": owner_ids["david"]})
+    assert database.get_owner(solo)["pet_count"] == 1
+    assert database.get_owner(owner_ids["david"])["pet_count"] == 2
+
+    database.delete_pet(pet_id)
+    assert database.get_owner(owner_ids["david"])["pet_count"] == 1
+    assert database.check_pet_counts(repair=False) == {}
+
+    # The restrict check reads the owner document only.
+    database.pets_collection = _CountingCollection(database.pets_collection)
+    try:
+        with pytest.raises(database.ConstraintError, match="have pets"):
+            database.delete_owner(solo)
+        assert database.pets_collection.calls == 0
+    finally:
+        database.pets_collection = database.pets_collection.collection
+
+
+def test_delete_missing_owner_raises_not_found():
+    _seed_test_database()
+    with pytest.raises(database.NotFoundError, match="owner not found"):
+        database.delete_owner("000000000000000000000000")
+
+
+def test_write_batching_groups_inserts():
+    owner_ids = _seed_test_database("pytest_batch")
+    inserts = []
+    real_insert_many = database.pets_collection.insert_many
+
+    def counting_insert_many(documents, *args, **kwargs):
+        inserts.append(len(documents))
+        return real_insert_many(documents, *args, **kwargs)
+
+    database.pets_collection.insert_many = counting_insert_many
+    database.enable_write_batching(max_batch=4, max_delay=60)
+    try:
+        pet_ids = [
+            database.create_pet({"name": f"pet{i}", "type": "cat", "owner_id": owner_ids["greg"]})
+            for i in range(6)
+        ]
+        # The size threshold flushed the first four; two are still queued.
+        assert inserts == [4]
+        assert database.pets_collection.count_documents({}) == 8
+        # Reads through the module see the queued writes.
+        assert database.get_pet(pet_ids[-1])["name"] == "pet5"
+        assert inserts == [4, 2]
+        assert database.get_counts() == {"owners": 2, "pets": 10}
+    finally:
+        database.disable_write_batching()
+        del database.pets_collection.insert_many
+    database.close_connection()
+
+
+def test_write_batching_keeps_operation_order():
+    owner_ids = _seed_test_database("pytest_batch_order")
+    database.enable_write_batching(max_delay=60)
+    try:
+        owner_id = database.create_owner({"name": "solo"})
+        pet_id = database.create_pet({"name": "onepet", "type": "cat", "owner_id": owner_id})
+        database.update_pet(
+            pet_id, {"name": "renamed", "type": "dog", "owner_id": owner_ids["greg"]}
+        )
+        database.delete_owner(owner_id)
+        database.update_owner(owner_ids["david"], {"name": "dave"})
+        assert database._write_batch.pending()
+        database.flush()
+        assert not database._write_batch.pending()
+        renamed = database.pets_collection.find_one({"name": "renamed"})
+        assert renamed["owner_id"] == ObjectId(owner_ids["greg"])
+        assert database.owners_collection.find_one({"name": "solo"}) is None
+        assert database.owners_collection.find_one({"name": "dave"}) is not None
+        database.delete_pet(pet_id)
+    finally:
+        database.disable_write_batching()
+    assert database.get_counts() == {"owners": 2, "pets": 4}
+    database.close_connection()
+
+
+def test_write_batching_flushes_after_delay():
+    owner_ids = _seed_test_database("pytest_batch_delay")
+    database.enable_write_batching(max_delay=0.01)
+    try:
+        database.create_pet({"name": "late", "type": "cat", "owner_id": owner_ids["greg"]})
+        deadline = time.time() + 5
+        while database._write_batch.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        assert not database._write_batch.pending()
+        assert database.pets_collection.find_one({"name": "late"}) is not None
+    finally:
+        database.disable_write_batching()
+    database.close_connection()
+
+
+def test_group_commit_waits_for_flush():
+    from concurrent.futures import ThreadPoolExecutor
+
+    owner_ids = _seed_test_database("pytest_group_commit")
+    database.enable_write_batching(max_batch=1000, max_delay=0.02, durability="group_commit")
+    try:
+        def writer(n):
+            pet_id = database.create_pet(
+                {"name": f"pet{n}", "type": "cat", "owner_id": owner_ids["greg"]}
+            )
+            # Durable on return: the document is already in the collection.
+            return database.pets_collection.find_one({"_id": ObjectId(pet_id)}) is not None
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert all(executor.map(writer, range(16)))
+    finally:
+        database.disable_write_batching()
+    with pytest.raises(ValueError, match="durability"):
+        database.enable_write_batching(durability="maybe")
+    database.close_connection()
+
+
+def test_concurrent_crud_from_many_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    _seed_test_database("pytest_threads")
+
+    def worker(n):
+        owner_id = database.create_owner({"name": f"owner{n}", "city": "Kent"})
+        pet_ids = [
+            database.create_pet(
+                {"name": f"pet{n}-{i}", "age": i, "type": "cat", "owner_id": owner_id}
+            )
+            for i in range(10)
+        ]
+        for pet_id in pet_ids:
+            database.update_pet(
+                pet_id, {"name": "renamed", "age": 1, "type": "dog", "owner_id": owner_id}
+            )
+            assert database.get_pet(pet_id)["owner_id"] == owner_id
+            database.get_pets_page(limit=5)
+        assert len(database.get_pets_by_owner(owner_id)) == 10
+        for pet_id in pet_ids:
+            database.delete_pet(pet_id)
+        database.delete_owner(owner_id)
+        return n
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert sorted(executor.map(worker, range(32))) == list(range(32))
+
+    assert database.get_counts() == {"owners": 2, "pets": 4}
+    assert database.pets_collection.count_documents({}) == 4
+    database.close_connection()
+
+
+def test_initialize_is_atomic_for_concurrent_readers():
+    from concurrent.futures import ThreadPoolExecutor
+
+    database.setup_database("pytest_swap", client_factory=database.MongitaClientMemory)
+    stop = threading.Event()
+
+    def reader():
+        reads = 0
+        while not stop.is_set():
+            database.ping()
+            database.get_pets_page(limit=5)
+            database.get_counts()
+            reads += 1
+        return reads
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(reader) for _ in range(4)]
+        for _ in range(20):
+            database.setup_database("pytest_swap", client_factory=database.MongitaClientMemory)
+        stop.set()
+        assert all(future.result() > 0 for future in futures)
+    database.close_connection()
+
+
+def test_dump_and_restore_round_trip(tmp_path):
+    owner_ids = _seed_test_database()
+    database.create_pet({"name": "walter", "type": "cat", "age": 1, "owner_id": owner_ids["david"]})
+    pets_before = sorted(database.get_pets(), key=lambda pet: pet["id"])
+    stats_before = database.get_stats()
+    position = database.oplog_position()
+
+    report = database.dump(tmp_path)
+    assert report["pets"]["rows"] == 5
+    assert report["owners"]["rows"] == 2
+    assert (tmp_path / "pets.ndjson.gz").exists()
+
+    database.setup_database("pytest_restore", client_factory=database.MongitaClientMemory)
+    report = database.restore(tmp_path, chunk_size=2)
+    assert report["pets"]["rows"] == 5
+    assert sorted(database.get_pets(), key=lambda pet: pet["id"]) == pets_before
+    assert type(database.pets_collection.find_one({})["owner_id"]) is ObjectId
+    assert database.get_stats() == stats_before
+    assert database.oplog_position() == position
+    assert "owner_id_1" in database._index_names(database.pets_collection)
+    assert len(database.get_pets_by_owner(owner_ids["david"])) == 2
+    assert [result["name"] for result in database.search("walter")] == ["walter"]
+
+    with pytest.raises(database.ConstraintError, match="not empty"):
+        database.restore(tmp_path)
+    database.restore(tmp_path, replace=True)
+    assert database.get_counts() == {"owners": 2, "pets": 5}
+    database.close_connection()
+
+
+def test_dump_moves_data_between_backends(tmp_path):
+    _seed_test_database()
+    pets_before = sorted(database.get_pets(), key=lambda pet: pet["id"])
+    database.dump(tmp_path / "mongita")
+
+    database.setup_database("pytest_restore", client_factory=SQLiteClientMemory)
+    database.restore(tmp_path / "mongita")
+    assert sorted(database.get_pets(), key=lambda pet: pet["id"]) == pets_before
+    database.dump(tmp_path / "sqlite")
+
+    database.setup_database("pytest_restore", client_factory=database.MongitaClientMemory)
+    database.restore(tmp_path / "sqlite")
+    assert sorted(database.get_pets(), key=lambda pet: pet["id"]) == pets_before
+    database.close_connection()
+
+
+def test_restore_rejects_missing_dump(tmp_path):
+    database.setup_database("pytest_restore", client_factory=database.MongitaClientMemory)
+    with pytest.raises(ValueError, match="does not contain a dump"):
+        database.restore(tmp_path)
+    database.close_connection()
+
+
+def test_restore_command_reports_errors_in_one_line(tmp_path, capsys):
+    storage = str(tmp_path / "storage")
+    with pytest.raises(SystemExit) as exit_info:
+        database.main(["--path", storage, "restore", str(tmp_path / "missing")])
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().err.strip().splitlines() == [
+        f"restore failed: {tmp_path / 'missing'} does not contain a dump."
+    ]
+
+    database.setup_database("pets", client_factory=functools.partial(MongitaClientDisk, storage))
+    database.create_owner({"name": "greg"})
+    database.close_connection()
+    database.main(["--path", storage, "dump", str(tmp_path / "dump")])
+    with pytest.raises(SystemExit) as exit_info:
+        database.main(["--path", storage, "restore", str(tmp_path / "dump")])
+    assert exit_info.value.code == 1
+    assert "is not empty" in capsys.readouterr().err
+    assert database.client is None
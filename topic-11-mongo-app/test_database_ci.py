@@ -1,18 +1,28 @@
+import json
+import os
 import re
+import subprocess
+import sys
 
 import pytest
 
 import app as webapp
 import database
+import snapshot
 
 
-@pytest.fixture
-def client():
-    database.setup_database("pytest_ci", client_factory=database.MongitaClientMemory)
-    database.owners_collection.delete_many({})
-    database.pets_collection.delete_many({})
+# Client class -> snapshot of a freshly set up, empty "pytest_ci" database.
+_empty_snapshots = {}
 
-    with webapp.app.test_client() as test_client:
+
+@pytest.fixture(params=[database.MongitaClientMemory, database.SQLiteClientMemory])
+def client(request):
+    if request.param not in _empty_snapshots:
+        database.setup_database("pytest_ci", client_factory=request.param)
+        _empty_snapshots[request.param] = snapshot.capture(database.client)
+    app = webapp.create_app("pytest_ci", client_factory=_empty_snapshots[request.param].restore)
+
+    with app.test_client() as test_client:
         yield test_client
 
     database.close_connection()
@@ -97,6 +107,7 @@ def test_pet_crud_flow(client):
     body = response.get_data(as_text=True)
     assert response.status_code == 200
     assert "walter" in body
+    assert "<td>greg</td>" in body
     assert owner_ids["greg"] in body
 
     pet_id = extract_first_pet_id(body)
@@ -186,3 +197,245 @@ def test_create_and_update_owner_validation(client):
     )
     assert response.status_code == 400
     assert "name is required" in response.get_data(as_text=True)
+
+
+def test_pet_list_is_paginated(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    owner_id = get_owner_ids()["greg"]
+    for name in ["ada", "bo", "cy"]:
+        client.post(
+            "/create",
+            data={"name": name, "age": "1", "type": "cat", "owner_id": owner_id},
+        )
+
+    response = client.get("/list?limit=2")
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "ada" in body and "bo" in body and "cy" not in body
+    assert "Previous" not in body
+    match = re.search(r'/list\?after=([0-9a-f]{24})&amp;limit=2', body)
+    assert match is not None
+
+    response = client.get(f"/list?after={match.group(1)}&limit=2")
+    body = response.get_data(as_text=True)
+    assert "cy" in body and "ada" not in body
+    assert "Next" not in body
+    assert "/list?before=" in body
+
+
+def test_list_rejects_bad_page_arguments(client):
+    assert client.get("/list?limit=0").status_code == 400
+    assert client.get("/owners?after=nope").status_code == 400
+
+
+def test_health_route_reports_closed_client(client):
+    database.close_connection()
+    response = client.get("/health")
+    assert response.status_code == 500
+    assert "not initialized" in response.get_data(as_text=True)
+
+
+def test_ready_route_reports_counts(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    owner_id = get_owner_ids()["greg"]
+    client.post(
+        "/create",
+        data={"name": "dorothy", "age": "9", "type": "dog", "owner_id": owner_id},
+    )
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ready", "owners": 1, "pets": 1}
+
+
+def test_stats_route_reports_counters(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    owner_id = get_owner_ids()["greg"]
+    for name, kind in [("dorothy", "dog"), ("casey", "dog"), ("suzy", "mouse")]:
+        client.post(
+            "/create",
+            data={"name": name, "age": "9", "type": kind, "owner_id": owner_id},
+        )
+
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "owners": 1,
+        "pets": 3,
+        "pets_by_type": {"dog": 2, "mouse": 1},
+        "pets_by_owner": {owner_id: 3},
+    }
+
+
+def test_missing_ids_are_rejected_by_the_id_filters(client):
+    missing = "67d8c61b5180a31695e907ff"
+    assert client.get(f"/update/{missing}").status_code == 404
+    assert client.get(f"/owner/update/{missing}").status_code == 404
+    response = client.post("/create", data={"name": "orphan", "type": "cat", "owner_id": missing})
+    assert response.status_code == 400
+
+    response = client.get("/stats/id-filters")
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert stats["pets"]["rejected"] == 1
+    assert stats["owners"]["rejected"] == 2
+    assert stats["owners"]["observed_false_positive_rate"] == 0
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_api_pets_streams_filtered_ndjson(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    owner_id = get_owner_ids()["greg"]
+    for name, kind, age in [("dorothy", "dog", "9"), ("casey", "dog", "2"), ("suzy", "mouse", "4")]:
+        client.post("/create", data={"name": name, "age": age, "type": kind, "owner_id": owner_id})
+
+    response = client.get("/api/pets")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.is_streamed
+    assert sorted(pet["name"] for pet in read_ndjson(response)) == ["casey", "dorothy", "suzy"]
+
+    response = client.get(f"/api/pets?type=dog&min_age=3&owner_id={owner_id}")
+    assert [pet["name"] for pet in read_ndjson(response)] == ["dorothy"]
+
+    assert client.get("/api/pets?max_age=old").status_code == 400
+    assert client.get("/api/pets?owner_id=nope").status_code == 400
+
+
+def test_api_owners_streams_filtered_ndjson(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    create_owner(client, name="david", city="Seattle", type_of_home="farm")
+
+    response = client.get("/api/owners?city=Seattle")
+    assert response.status_code == 200
+    assert [owner["name"] for owner in read_ndjson(response)] == ["david"]
+
+
+def test_api_etag_skips_unchanged_body(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    response = client.get("/api/owners")
+    etag = response.headers["ETag"]
+
+    response = client.get("/api/owners", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    create_owner(client, name="david", city="Seattle", type_of_home="farm")
+    response = client.get("/api/owners", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(read_ndjson(response)) == 2
+
+
+def test_api_owners_etag_changes_with_pet_count(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    etag = client.get("/api/owners").headers["ETag"]
+
+    owner_id = get_owner_ids()["greg"]
+    client.post("/create", data={"name": "dorothy", "age": "3", "type": "dog", "owner_id": owner_id})
+    response = client.get("/api/owners", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [owner["pet_count"] for owner in read_ndjson(response)] == [1]
+
+
+def test_search_route_ranks_matches(client):
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    owner_id = get_owner_ids()["greg"]
+    for name, kind in [("dorothy", "dog"), ("casey", "dog"), ("doris", "cat")]:
+        client.post("/create", data={"name": name, "age": "3", "type": kind, "owner_id": owner_id})
+
+    response = client.get("/search?q=dor")
+    assert response.status_code == 200
+    assert sorted(result["name"] for result in response.get_json()) == ["doris", "dorothy"]
+
+    # An exact name match outranks a pet that is only a dog.
+    client.post("/create", data={"name": "dog", "age": "3", "type": "cat", "owner_id": owner_id})
+    response = client.get("/search?q=dog&limit=1")
+    assert [result["name"] for result in response.get_json()] == ["dog"]
+
+    response = client.get("/search?q=port")
+    assert response.get_json()[0]["kind"] == "owner"
+
+    assert client.get("/search?q=dog&limit=0").status_code == 400
+
+
+def test_changes_route_tails_the_oplog(client):
+    start = client.get("/api/changes").get_json()["position"]
+    create_owner(client, name="greg", city="Portland", type_of_home="condo")
+    create_owner(client, name="david", city="Seattle", type_of_home="farm")
+
+    response = client.get(f"/api/changes?since={start}&limit=1")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["position"] == start + 2
+    assert [(change["op"], change["fields"]["name"]) for change in body["changes"]] == [
+        ("insert", "greg")
+    ]
+
+    seq = body["changes"][-1]["seq"]
+    changes = client.get(f"/api/changes?since={seq}").get_json()["changes"]
+    assert [change["fields"]["name"] for change in changes] == ["david"]
+
+    assert client.get("/api/changes?since=soon").status_code == 400
+    database.compact_oplog(keep=0)
+    assert client.get(f"/api/changes?since={start}").status_code == 410
+
+
+# Modules that only the tests need; importing the app must not load them.
+TEST_ONLY_MODULES = ["pytest", "snapshot", "test_database", "test_database_ci"]
+
+# Budgets for importing the app on top of Flask, and for create_app() plus
+# the first request, as multiples of a cold `import flask` in the same
+# interpreter. Both take well under one Flask import today; measuring
+# against Flask instead of in seconds keeps slow CI machines from failing.
+IMPORT_BUDGET_FLASK_IMPORTS = 3
+BOOT_BUDGET_FLASK_IMPORTS = 3
+
+_BOOT_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+import flask
+flask_imported = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = sorted(set(sys.argv[1:]) & set(sys.modules))
+flask_app = app.create_app()
+untouched = app.database.client is None and not os.path.exists(os.path.expanduser("~/.mongita"))
+status = flask_app.test_client().get("/ready").status_code
+booted = time.perf_counter()
+print(json.dumps({
+    "flask_import_seconds": flask_imported - start,
+    "import_seconds": imported - flask_imported,
+    "boot_seconds": booted - imported,
+    "loaded": loaded,
+    "untouched": untouched,
+    "status": status,
+    "created_storage": os.path.exists(os.path.expanduser("~/.mongita")),
+}))
+"""
+
+
+def test_import_and_boot_are_lazy_and_within_budget(tmp_path):
+    # A fresh interpreter; HOME points Mongita's default storage directory
+    # at tmp_path.
+    result = subprocess.run(
+        [sys.executable, "-c", _BOOT_SCRIPT, *TEST_ONLY_MODULES],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "HOME": str(tmp_path)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout)
+    assert report["loaded"] == []
+    # Neither the import nor create_app() opened the database...
+    assert report["untouched"]
+    # ...and the first request did.
+    assert report["status"] == 200
+    assert report["created_storage"]
+    flask_import = report["flask_import_seconds"]
+    assert report["import_seconds"] < IMPORT_BUDGET_FLASK_IMPORTS * flask_import, report
+    assert report["boot_seconds"] < BOOT_BUDGET_FLASK_IMPORTS * flask_import, report
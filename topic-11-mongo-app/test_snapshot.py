@@ -0,0 +1,41 @@
+import pytest
+from mongita import MongitaClientMemory
+
+from snapshot import capture
+from sqlite_store import SQLiteClientMemory
+
+
+def _seeded_client(factory):
+    client = factory()
+    pets = client["pytest_snapshot"].pets
+    pets.create_index("name")
+    pets.insert_many([{"name": "dorothy"}, {"name": "suzy"}])
+    return client
+
+
+def test_restore_is_isolated():
+    for factory in (MongitaClientMemory, SQLiteClientMemory):
+        snapshot = capture(_seeded_client(factory))
+        first = snapshot.restore()["pytest_snapshot"].pets
+        first.update_one({"name": "dorothy"}, {"$set": {"name": "dot"}})
+        first.delete_one({"name": "suzy"})
+        first.insert_one({"name": "walter"})
+        assert sorted(pet["name"] for pet in first.find()) == ["dot", "walter"]
+
+        second = snapshot.restore()["pytest_snapshot"].pets
+        assert sorted(pet["name"] for pet in second.find()) == ["dorothy", "suzy"]
+        assert second.count_documents({"name": "suzy"}) == 1
+
+
+def test_snapshot_of_restored_client():
+    snapshot = capture(_seeded_client(MongitaClientMemory))
+    client = snapshot.restore()
+    client["pytest_snapshot"].pets.insert_one({"name": "casey"})
+    again = capture(client).restore()
+    names = sorted(pet["name"] for pet in again["pytest_snapshot"].pets.find())
+    assert names == ["casey", "dorothy", "suzy"]
+
+
+def test_capture_rejects_disk_clients():
+    with pytest.raises(TypeError, match="in-memory"):
+        capture(object())
@@ -0,0 +1,95 @@
+import pytest
+from bson.objectid import ObjectId
+from mongita.errors import DuplicateKeyError
+
+import sqlite_store
+
+
+def _sample_collection():
+    collection = sqlite_store.SQLiteClientMemory()["pytest_store"].pets
+    owner = ObjectId()
+    collection.insert_many(
+        [
+            {"name": "dorothy", "type": "dog", "age": 9, "owner_id": owner},
+            {"name": "suzy", "type": "mouse", "age": 3, "owner_id": owner},
+            {"name": "heidi", "type": "cat", "age": 15, "owner_id": ObjectId()},
+        ]
+    )
+    return collection, owner
+
+
+def test_round_trip_preserves_object_ids():
+    collection, owner = _sample_collection()
+    pet = collection.find_one({"name": "dorothy"})
+    assert isinstance(pet["_id"], ObjectId)
+    assert pet["owner_id"] == owner
+    assert collection.find_one({"_id": pet["_id"]})["name"] == "dorothy"
+
+
+def test_strings_that_look_like_object_ids_stay_strings():
+    collection = sqlite_store.SQLiteClientMemory()["pytest_store"].owners
+    names = ["$oid:greg", "$oid:" + str(ObjectId()), "$str:x", "$other"]
+    for name in names:
+        collection.insert_one({"name": name})
+    assert sorted(owner["name"] for owner in collection.find()) == sorted(names)
+    for name in names:
+        assert collection.find_one({"name": name})["name"] == name
+    assert collection.count_documents({"name": {"$in": names[:2]}}) == 2
+
+
+def test_find_filters_sort_and_limit():
+    collection, owner = _sample_collection()
+    assert collection.count_documents({"owner_id": owner}) == 2
+    assert collection.count_documents({"age": {"$gte": 9}}) == 2
+    assert collection.count_documents({"type": {"$in": ["cat", "dog"]}}) == 2
+    assert collection.count_documents({"type": {"$nin": ["cat"]}}) == 2
+    assert collection.count_documents({"type": {"$ne": "cat"}}) == 2
+    names = [pet["name"] for pet in collection.find({}, sort=[("age", -1)], limit=2)]
+    assert names == ["heidi", "dorothy"]
+    first = collection.find_one({}, sort=[("_id", 1)])
+    after = list(collection.find({"_id": {"$gt": first["_id"]}}))
+    assert len(after) == 2
+
+
+def test_updates_and_deletes():
+    collection, owner = _sample_collection()
+    result = collection.update_one({"name": "suzy"}, {"$set": {"age": 4}, "$inc": {"visits": 1}})
+    assert result.matched_count == 1
+    assert collection.find_one({"name": "suzy"})["visits"] == 1
+    assert collection.update_one({"name": "nobody"}, {"$set": {"age": 1}}).matched_count == 0
+
+    assert collection.replace_one({"_id": "counter"}, {"count": 1}, upsert=True).upserted_id == "counter"
+    collection.replace_one({"_id": "counter"}, {"count": 2})
+    assert collection.find_one({"_id": "counter"}) == {"_id": "counter", "count": 2}
+
+    assert collection.delete_one({"name": "heidi"}).deleted_count == 1
+    assert collection.delete_one({"name": "heidi"}).deleted_count == 0
+    assert collection.delete_many({"owner_id": owner}).deleted_count == 2
+
+
+def test_duplicate_id_rejected():
+    collection, _ = _sample_collection()
+    pet = collection.find_one({})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one(pet)
+
+
+def test_create_index_uses_btree():
+    collection, owner = _sample_collection()
+    assert collection.create_index("owner_id") == "owner_id_1"
+    assert {"owner_id_1": {"key": [("owner_id", 1)]}} in collection.index_information()
+    where, params = sqlite_store._where_clause({"owner_id": owner})
+    plan = collection._execute(
+        f"EXPLAIN QUERY PLAN SELECT _id FROM {collection._table}{where}", params
+    )
+    assert "USING INDEX" in " ".join(row[-1] for row in plan)
+    collection.drop_index("owner_id_1")
+    assert len(collection.index_information()) == 1
+
+
+def test_failed_insert_many_rolls_back():
+    collection, _ = _sample_collection()
+    existing = collection.find_one({})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_many([{"name": "new"}, existing])
+    assert collection.count_documents({}) == 3
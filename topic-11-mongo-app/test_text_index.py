@@ -0,0 +1,44 @@
+import text_index
+
+
+def test_tokenize():
+    assert text_index.tokenize("Dorothy the Dog!") == ["dorothy", "the", "dog"]
+    assert text_index.tokenize(None) == []
+    assert text_index.tokenize("  ") == []
+
+
+def _sample_index():
+    index = text_index.InvertedIndex()
+    index.add("dorothy", [("Dorothy", 3), ("dog", 1)])
+    index.add("dot", [("Dot", 3), ("cat", 1)])
+    index.add("casey", [("Casey", 3), ("dog", 1)])
+    return index
+
+
+def test_prefix_search_ranks_exact_matches_first():
+    index = _sample_index()
+    assert index.search("dot") == [("dot", 6)]
+    assert index.search("do") == [("dorothy", 3), ("dot", 3), ("casey", 1)]
+    assert index.search("dog") == [("casey", 2), ("dorothy", 2)]
+    assert index.search("do", limit=1) == [("dorothy", 3)]
+    assert index.search("") == []
+    assert index.search("zebra") == []
+
+
+def test_every_query_token_must_match():
+    index = _sample_index()
+    assert [key for key, _ in index.search("dog ca")] == ["casey"]
+    assert index.search("d dog") == [("dorothy", 5), ("casey", 3)]
+
+
+def test_add_replaces_and_remove_forgets():
+    index = _sample_index()
+    index.add("dot", [("Spot", 3), ("cat", 1)])
+    assert [key for key, _ in index.search("dot")] == []
+    assert [key for key, _ in index.search("spot")] == ["dot"]
+    index.remove("dot")
+    index.remove("missing")
+    assert "dot" not in index
+    assert len(index) == 2
+    assert index.search("cat") == []
+    assert "spot" not in index._vocabulary
@@ -0,0 +1,96 @@
+"""
+An in-memory inverted index with prefix search, used by database.search().
+
+Documents are added under a hashable key with a list of (text, weight)
+pairs. Text is split into lowercase word tokens; every token maps to the
+keys that contain it and the weight it has there. A sorted vocabulary lets
+a query token match every indexed token it is a prefix of with a binary
+search, so a query costs O(log V) plus the size of the postings it touches,
+never a pass over every document.
+"""
+
+import bisect
+import heapq
+import re
+
+_TOKEN = re.compile(r"\w+")
+
+# Score multiplier for a query token that matches an indexed token exactly
+# rather than as a prefix.
+EXACT_MATCH_BONUS = 2
+
+
+def tokenize(text):
+    return _TOKEN.findall((text or "").lower())
+
+
+class InvertedIndex:
+    def __init__(self):
+        self._postings = {}  # token -> {key: weight}
+        self._documents = {}  # key -> {token: weight}
+        self._vocabulary = []  # sorted tokens
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, key):
+        return key in self._documents
+
+    def add(self, key, weighted_texts):
+        """Index (or re-index) `key` from [(text, weight), ...]."""
+        self.remove(key)
+        tokens = {}
+        for text, weight in weighted_texts:
+            for token in tokenize(text):
+                tokens[token] = max(tokens.get(token, 0), weight)
+        if not tokens:
+            return
+        self._documents[key] = tokens
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocabulary, token)
+            postings[key] = weight
+
+    def remove(self, key):
+        tokens = self._documents.pop(key, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            postings = self._postings[token]
+            del postings[key]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+    def _matches(self, query_token):
+        """Return {key: score} for one query token, matched as a prefix."""
+        scores = {}
+        vocabulary = self._vocabulary
+        for position in range(bisect.bisect_left(vocabulary, query_token), len(vocabulary)):
+            token = vocabulary[position]
+            if not token.startswith(query_token):
+                break
+            bonus = EXACT_MATCH_BONUS if token == query_token else 1
+            for key, weight in self._postings[token].items():
+                scores[key] = max(scores.get(key, 0), weight * bonus)
+        return scores
+
+    def search(self, query, limit=10):
+        """
+        Return up to `limit` (key, score) pairs, best first.
+
+        Every query token has to match (as a prefix) somewhere in the
+        document; a document's score adds up its best match per token.
+        """
+        query_tokens = sorted(set(tokenize(query)))
+        if not query_tokens:
+            return []
+        per_token = sorted((self._matches(token) for token in query_tokens), key=len)
+        scores = dict(per_token[0])
+        for matches in per_token[1:]:
+            scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            if not scores:
+                return []
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))